@@ -2,9 +2,18 @@ import streamlit as st
 import pandas as pd
 import requests
 import time
+import json
+import os
+import hashlib
+import html
+import threading
+from pathlib import Path
 from io import BytesIO
+import numpy as np
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
+from geo_core import AdminBoundaryIndex, bd09_to_gcj02, valid_coordinate_mask
 
 # 依赖检查函数
 def check_dependencies():
@@ -42,6 +51,8 @@ if 'result_df' not in st.session_state:
     st.session_state.result_df = None
 if 'conversion_done' not in st.session_state:
     st.session_state.conversion_done = False
+if 'result_map_service' not in st.session_state:
+    st.session_state.result_map_service = None   # 结果实际使用的地图服务（决定坐标系）
 
 st.title("📍 正掌讯客户地址-经纬度转换系统V2.0")
 st.markdown("---")
@@ -59,6 +70,15 @@ api_key = st.sidebar.text_input(
     help="请在对应地图开放平台申请API密钥"
 )
 
+st.sidebar.markdown("---")
+st.sidebar.markdown("### 🧭 坐标校验（可选）")
+boundary_file = st.sidebar.file_uploader(
+    "行政区划边界 GeoJSON",
+    type=["json", "geojson"],
+    help="省/市级行政区划边界（如阿里云 DataV GeoAtlas 导出的全国省市边界），"
+         "用于离线校验坐标是否落在所填省份/城市内。也可放置在 boundaries/china_admin.geojson"
+)
+
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📋 使用说明")
 st.sidebar.info(
@@ -96,49 +116,82 @@ st.sidebar.warning("""
 """)
 
 
-def geocode_amap(address, api_key):
+# 高德地图API错误码说明
+AMAP_ERROR_MESSAGES = {
+    "INVALID_USER_KEY": "API Key不正确或过期",
+    "INVALID_USER_IP": "IP地址不在白名单中",
+    "INVALID_USER_DOMAIN": "域名不在白名单中",
+    "INVALID_USER_SIGNATURE": "签名错误",
+    "INVALID_USER_SCODE": "安全码错误",
+    "USERKEY_PLAT_NOMATCH": "Key与绑定平台不符",
+    "IP_QUERY_OVER_LIMIT": "IP访问超限",
+    "NOT_SUPPORT_HTTPS": "服务不支持HTTPS",
+    "INSUFFICIENT_PRIVILEGES": "权限不足",
+    "USER_KEY_RECYCLED": "Key已被删除",
+    "QPS_OVER_LIMIT": "访问已超出QPS配额",
+    "GATEWAY_TIMEOUT": "服务响应超时",
+    "INVALID_PARAMS": "请求参数非法",
+    "MISSING_REQUIRED_PARAMS": "缺少必填参数",
+    "ILLEGAL_REQUEST": "非法请求",
+    "UNKNOWN_ERROR": "未知错误"
+}
+
+# Key/权限类错误：整批失败时逐条重试也不会成功，直接标记整批
+AMAP_FATAL_ERRORS = {
+    "INVALID_USER_KEY", "INVALID_USER_IP", "INVALID_USER_DOMAIN",
+    "INVALID_USER_SIGNATURE", "INVALID_USER_SCODE", "USERKEY_PLAT_NOMATCH",
+    "INSUFFICIENT_PRIVILEGES", "USER_KEY_RECYCLED"
+}
+
+# 限流类错误：退避后整批重试；拆成单条请求只会更快地再次触发限流
+AMAP_THROTTLE_ERRORS = {
+    "QPS_OVER_LIMIT", "ACCESS_TOO_FREQUENT",
+    "CUQPS_HAS_EXCEEDED_THE_LIMIT", "CKQPS_HAS_EXCEEDED_THE_LIMIT", "CQPS_HAS_EXCEEDED_THE_LIMIT"
+}
+
+AMAP_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+AMAP_BATCH_SIZE = 10  # 高德批量地理编码单次最多10个地址
+REQUEST_INTERVAL = 0.5  # 相邻两次请求的间隔（秒），避免API请求过快
+THROTTLE_RETRIES = 3    # 被限流时整批重试的次数
+THROTTLE_BACKOFF = 1.0  # 限流退避的初始等待（秒），每次重试翻倍
+
+
+def _parse_amap_location(geocode):
+    """解析高德返回的单个 geocode 项，失败返回 None"""
+    location = geocode.get("location") if isinstance(geocode, dict) else None
+    if not location or not isinstance(location, str) or "," not in location:
+        return None
+    try:
+        lng, lat = location.split(",")
+        return float(lng), float(lat)
+    except ValueError:
+        return None
+
+
+def geocode_amap(address, api_key, session=None):
     """使用高德地图API进行地理编码"""
-    url = "https://restapi.amap.com/v3/geocode/geo"
     params = {
         "address": address,
         "key": api_key,
         "output": "json"
     }
-    
-    # 高德地图API错误码说明
-    error_messages = {
-        "INVALID_USER_KEY": "API Key不正确或过期",
-        "INVALID_USER_IP": "IP地址不在白名单中",
-        "INVALID_USER_DOMAIN": "域名不在白名单中",
-        "INVALID_USER_SIGNATURE": "签名错误",
-        "INVALID_USER_SCODE": "安全码错误",
-        "USERKEY_PLAT_NOMATCH": "Key与绑定平台不符",
-        "IP_QUERY_OVER_LIMIT": "IP访问超限",
-        "NOT_SUPPORT_HTTPS": "服务不支持HTTPS",
-        "INSUFFICIENT_PRIVILEGES": "权限不足",
-        "USER_KEY_RECYCLED": "Key已被删除",
-        "QPS_OVER_LIMIT": "访问已超出QPS配额",
-        "GATEWAY_TIMEOUT": "服务响应超时",
-        "INVALID_PARAMS": "请求参数非法",
-        "MISSING_REQUIRED_PARAMS": "缺少必填参数",
-        "ILLEGAL_REQUEST": "非法请求",
-        "UNKNOWN_ERROR": "未知错误"
-    }
+    http = session or requests
     
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http.get(AMAP_GEOCODE_URL, params=params, timeout=10)
         result = response.json()
         
         status = result.get("status")
         info_code = result.get("infocode")
         
         if status == "1" and result.get("geocodes"):
-            location = result["geocodes"][0]["location"]
-            lng, lat = location.split(",")
-            return float(lng), float(lat), "成功"
+            location = _parse_amap_location(result["geocodes"][0])
+            if location:
+                return location[0], location[1], "成功"
+            return None, None, "高德API未返回有效坐标"
         else:
             info = result.get('info', '未知错误')
-            error_detail = error_messages.get(info, info)
+            error_detail = AMAP_ERROR_MESSAGES.get(info, info)
             return None, None, f"高德API错误[{info_code}]: {error_detail}"
     except requests.exceptions.Timeout:
         return None, None, "请求超时，请检查网络连接"
@@ -148,6 +201,76 @@ def geocode_amap(address, api_key):
         return None, None, f"请求异常: {str(e)}"
 
 
+def geocode_amap_batch(addresses, api_key, session=None, interval=REQUEST_INTERVAL):
+    """
+    使用高德批量地理编码接口（batch=true）打包请求。
+
+    每次请求最多打包 AMAP_BATCH_SIZE 个地址，按顺序将结果拆回各行；
+    批内未解析成功的地址再单独请求一次（相邻请求间隔 interval 秒）。
+    被限流（QPS 超限）时按指数退避整批重试，仍被限流则整批标记失败。
+    返回与 addresses 等长的 [(lng, lat, status), ...] 列表，以及实际发出的请求数。
+    session 可传入 requests.Session 或任何实现 get() 的对象（便于用录制的响应回放测试）。
+    """
+    http = session or requests
+    results = [None] * len(addresses)
+    request_count = 0
+
+    # 地址中含 "|" 会破坏批量分隔符，只能单独请求
+    batchable = [i for i, a in enumerate(addresses) if "|" not in a]
+    retry = [i for i, a in enumerate(addresses) if "|" in a]
+
+    for start in range(0, len(batchable), AMAP_BATCH_SIZE):
+        chunk = batchable[start:start + AMAP_BATCH_SIZE]
+        params = {
+            "address": "|".join(addresses[i] for i in chunk),
+            "key": api_key,
+            "batch": "true",
+            "output": "json"
+        }
+        for attempt in range(THROTTLE_RETRIES + 1):
+            request_count += 1
+            try:
+                response = http.get(AMAP_GEOCODE_URL, params=params, timeout=10)
+                result = response.json()
+            except Exception:
+                result = None
+                break
+            if result.get("info") not in AMAP_THROTTLE_ERRORS or attempt == THROTTLE_RETRIES:
+                break
+            time.sleep(THROTTLE_BACKOFF * 2 ** attempt)
+        if result is None:
+            # 网络异常：整批回退为单条请求
+            retry.extend(chunk)
+            continue
+
+        geocodes = result.get("geocodes") or []
+        if result.get("status") != "1" or len(geocodes) != len(chunk):
+            info = result.get("info", "未知错误")
+            if info in AMAP_FATAL_ERRORS or info in AMAP_THROTTLE_ERRORS:
+                status = f"高德API错误[{result.get('infocode')}]: {AMAP_ERROR_MESSAGES.get(info, info)}"
+                for i in chunk:
+                    results[i] = (None, None, status)
+            else:
+                retry.extend(chunk)
+            continue
+
+        for i, geocode in zip(chunk, geocodes):
+            location = _parse_amap_location(geocode)
+            if location:
+                results[i] = (location[0], location[1], "成功")
+            else:
+                retry.append(i)
+
+    # 仅对失败项回退到单条请求，与批量请求一样限速
+    for i in sorted(retry):
+        if request_count:
+            time.sleep(interval)
+        results[i] = geocode_amap(addresses[i], api_key, session=session)
+        request_count += 1
+
+    return results, request_count
+
+
 def geocode_baidu(address, api_key):
     """使用百度地图API进行地理编码"""
     url = "https://api.map.baidu.com/geocoding/v3/"
@@ -225,27 +348,15 @@ def validate_columns(df):
     return standardized_df, missing
 
 
-def process_addresses(df, api_key, map_service):
-    """批量处理地址转换"""
-    results = []
-    total = len(df)
-    
-    # 创建进度条
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for idx, row in df.iterrows():
-        # 构建完整地址
-        full_address = f"{row['省份']}{row['城市']}{row['客户地址']}"
-        
-        # 根据选择的地图服务调用相应API
-        if map_service == "高德地图":
-            lng, lat, status = geocode_amap(full_address, api_key)
-        else:
-            lng, lat, status = geocode_baidu(full_address, api_key)
-        
-        # 保存结果
-        results.append({
+def iter_geocode_results(rows, api_key, map_service, start=0):
+    """
+    从第 start 行开始逐批地理编码，每发出一次请求产出一批结果（list[dict]）。
+    不依赖 Streamlit，可在后台线程中运行。
+    """
+    addresses = [f"{row['省份']}{row['城市']}{row['客户地址']}" for row in rows]
+
+    def make_result(row, lng, lat, status):
+        return {
             "客户名称": row["客户名称"],
             "省份": row["省份"],
             "城市": row["城市"],
@@ -253,20 +364,359 @@ def process_addresses(df, api_key, map_service):
             "经度": lng if lng else "",
             "纬度": lat if lat else "",
             "转换状态": status
-        })
-        
-        # 更新进度
-        progress = (idx + 1) / total
-        progress_bar.progress(progress)
-        status_text.text(f"正在处理: {idx + 1}/{total} - {row['客户名称']}")
-        
-        # 避免API请求过快，添加延迟（增加到0.5秒更安全）
-        time.sleep(0.5)
-    
-    progress_bar.empty()
-    status_text.empty()
-    
-    return pd.DataFrame(results)
+        }
+
+    if map_service == "高德地图":
+        # 高德支持批量接口：每次请求打包10个地址，复用连接
+        with requests.Session() as session:
+            for offset in range(start, len(rows), AMAP_BATCH_SIZE):
+                chunk_rows = rows[offset:offset + AMAP_BATCH_SIZE]
+                chunk_results, _ = geocode_amap_batch(
+                    addresses[offset:offset + AMAP_BATCH_SIZE], api_key, session=session
+                )
+                yield [make_result(row, *res) for row, res in zip(chunk_rows, chunk_results)]
+                # 避免API请求过快，按请求而非按行限速
+                time.sleep(REQUEST_INTERVAL)
+    else:
+        for offset in range(start, len(rows)):
+            row = rows[offset]
+            lng, lat, status = geocode_baidu(addresses[offset], api_key)
+            yield [make_result(row, lng, lat, status)]
+            # 避免API请求过快，添加延迟（增加到0.5秒更安全）
+            time.sleep(REQUEST_INTERVAL)
+
+
+# ══════════════════════════════════════════════════════
+# 后台转换任务：定期写入检查点，支持断点续转
+# ══════════════════════════════════════════════════════
+
+JOB_DIR = Path("geocode_jobs")      # 检查点目录
+CHECKPOINT_EVERY = 50               # 每累计多少行写一次检查点
+
+
+def make_job_id(file_bytes, map_service):
+    """同一文件 + 同一地图服务对应同一个任务，刷新页面后可重新关联"""
+    digest = hashlib.sha1(file_bytes)
+    digest.update(map_service.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class GeocodeJob:
+    """
+    在后台线程中执行批量地理编码。
+
+    已完成的结果以 JSON Lines 形式追加写入 JOB_DIR/<job_id>.jsonl，
+    进程崩溃或页面刷新后从已写入的行数继续，不会重复请求。
+
+    每次启动的后台线程绑定一个代号（generation）；discard 后代号递增，
+    仍卡在网络请求中的旧线程醒来后不会再写入结果、检查点或状态。
+    """
+
+    def __init__(self, job_id, rows, map_service):
+        self.job_id = job_id
+        self.rows = rows
+        self.total = len(rows)
+        self.map_service = map_service
+        self.status = "pending"     # pending / running / done / stopped / failed
+        self.error = ""
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.generation = 0
+        self.thread_generation = 0
+        self.results = self._load_checkpoint()
+
+    @property
+    def checkpoint_path(self):
+        return JOB_DIR / f"{self.job_id}.jsonl"
+
+    @property
+    def done_count(self):
+        with self.lock:
+            return len(self.results)
+
+    def _load_checkpoint(self):
+        """读取已完成的结果；最后一行写入不完整时丢弃"""
+        results = []
+        if not self.checkpoint_path.exists():
+            return results
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        results = results[:self.total]
+        if len(results) >= self.total:
+            self.status = "done"
+        return results
+
+    def _write_checkpoint(self, pending, generation):
+        """写入检查点；线程所属的运行已被 discard 时放弃写入"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            JOB_DIR.mkdir(exist_ok=True)
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                for item in pending:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _set_status(self, generation, status, error=""):
+        with self.lock:
+            if generation == self.generation:
+                self.status = status
+                self.error = error
+
+    def start(self, api_key):
+        with self.lock:
+            # 本代线程仍在运行时不重复启动；discard 遗留的旧线程不影响重新开始
+            if self.thread is not None and self.thread.is_alive() and self.thread_generation == self.generation:
+                return
+            # 每次运行使用独立的停止信号，旧线程（若仍在请求中）保持停止状态
+            self.stop_event = threading.Event()
+            self.status = "running"
+            self.error = ""
+            self.thread_generation = self.generation
+            self.thread = threading.Thread(target=self._run, args=(api_key, self.generation, self.stop_event),
+                                           daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self, api_key, generation, stop_event):
+        pending = []
+        try:
+            for batch in iter_geocode_results(self.rows, api_key, self.map_service, start=self.done_count):
+                with self.lock:
+                    if generation != self.generation:
+                        return
+                    self.results.extend(batch)
+                pending.extend(batch)
+                if len(pending) >= CHECKPOINT_EVERY:
+                    self._write_checkpoint(pending, generation)
+                    pending = []
+                if stop_event.is_set():
+                    break
+            if pending:
+                self._write_checkpoint(pending, generation)
+            self._set_status(generation, "done" if self.done_count >= self.total else "stopped")
+        except Exception as e:
+            if pending:
+                self._write_checkpoint(pending, generation)
+            self._set_status(generation, "failed", str(e))
+
+    def result_df(self):
+        with self.lock:
+            return pd.DataFrame(list(self.results))
+
+    def discard(self):
+        """删除检查点，重新从头转换；不必等待旧线程退出，其代号失效后不会再写入"""
+        self.stop()
+        with self.lock:
+            self.generation += 1
+            if self.checkpoint_path.exists():
+                self.checkpoint_path.unlink()
+            self.results = []
+            self.status = "pending"
+            self.error = ""
+
+
+@st.cache_resource
+def get_job_registry():
+    """进程级任务表：浏览器刷新或 Streamlit 重跑后仍可找到正在运行的任务"""
+    return {}
+
+
+def get_or_create_job(job_id, df, map_service):
+    registry = get_job_registry()
+    job = registry.get(job_id)
+    if job is None:
+        rows = df[["客户名称", "省份", "城市", "客户地址"]].astype(str).to_dict("records")
+        job = GeocodeJob(job_id, rows, map_service)
+        registry[job_id] = job
+    return job
+
+
+@st.fragment(run_every=1.0)
+def render_job_progress(job):
+    """轮询任务状态，不阻塞脚本线程；完成后切换到结果页"""
+    done = job.done_count
+    total = job.total
+    st.progress(done / total if total else 1.0)
+    if job.status == "running":
+        st.text(f"正在处理: {done}/{total}（每 {CHECKPOINT_EVERY} 行自动保存进度）")
+    elif job.status == "done":
+        st.session_state.result_df = job.result_df()
+        st.session_state.result_map_service = job.map_service
+        st.session_state.conversion_done = True
+        st.rerun()
+    elif job.status == "failed":
+        st.error(f"❌ 转换中断（已保存 {done}/{total}）：{job.error}")
+    elif job.status == "stopped":
+        st.warning(f"⏸ 转换已暂停，已保存 {done}/{total} 条，可点击“继续转换”从断点恢复")
+
+
+# ══════════════════════════════════════════════════════
+# 地图渲染：大数据量时网格聚合，控制发送到浏览器的数据量
+# ══════════════════════════════════════════════════════
+
+MAP_MAX_FEATURES = 2000     # 发送到浏览器的最大标记/格子数，与客户总数无关
+MAP_BASE_CELL_DEG = 0.005   # 初始网格边长（度），约500米
+
+
+@st.cache_data(show_spinner=False)
+def bin_points(lngs, lats, names, max_bins=MAP_MAX_FEATURES):
+    """
+    向量化网格聚合：从 MAP_BASE_CELL_DEG 开始逐级放大网格，
+    直到非空格子数不超过 max_bins。返回每个格子的中心（成员均值）、数量和示例客户。
+    """
+    lngs = np.asarray(lngs, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    cell = MAP_BASE_CELL_DEG
+    while True:
+        ix = np.floor(lngs / cell).astype(np.int64)
+        iy = np.floor(lats / cell).astype(np.int64)
+        keys = ix * 1_000_003 + iy
+        uniq, first, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        if len(uniq) <= max_bins:
+            break
+        cell *= 2
+    inverse = inverse.ravel()
+    return pd.DataFrame({
+        "经度": np.bincount(inverse, weights=lngs) / counts,
+        "纬度": np.bincount(inverse, weights=lats) / counts,
+        "数量": counts,
+        "示例客户": np.asarray(names, dtype=object)[first],
+    })
+
+
+# 客户端聚合标记回调：数据以紧凑数组传输，由浏览器按需生成标记
+# row[2] / row[3] 直接拼入 HTML，build_customer_map 中须先转义
+CLUSTER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[2]);
+    marker.bindPopup('<b>' + row[2] + '</b><br>' + row[3] + '<br>' +
+                     row[1].toFixed(6) + ', ' + row[0].toFixed(6));
+    return marker;
+};
+"""
+
+
+def build_customer_map(map_df):
+    """
+    构建客户分布地图。客户数不超过 MAP_MAX_FEATURES 时使用客户端聚合标记，
+    否则按网格聚合后绘制圆点。返回 (folium.Map, 模式)，模式为 "cluster" 或格子数。
+    """
+    lngs = map_df["经度"].to_numpy(dtype=float)
+    lats = map_df["纬度"].to_numpy(dtype=float)
+    m = folium.Map(
+        location=[float(lats.mean()), float(lngs.mean())],
+        zoom_start=11,
+        tiles='OpenStreetMap',
+        prefer_canvas=True
+    )
+    m.fit_bounds([[float(lats.min()), float(lngs.min())], [float(lats.max()), float(lngs.max())]])
+
+    if len(map_df) <= MAP_MAX_FEATURES:
+        labels = (map_df["省份"].astype(str) + map_df["城市"].astype(str) + map_df["详细地址"].astype(str)).tolist()
+        # 名称、地址来自用户上传的 Excel，作为 HTML 插入提示框前转义
+        data = [
+            [lat, lng, html.escape(str(name)), html.escape(label)]
+            for lat, lng, name, label in zip(lats.tolist(), lngs.tolist(), map_df["客户名称"].tolist(), labels)
+        ]
+        FastMarkerCluster(data, callback=CLUSTER_CALLBACK).add_to(m)
+        return m, "cluster"
+
+    bins = bin_points(lngs, lats, map_df["客户名称"].astype(str).to_numpy())
+    # 半径量化为少数几档，所有格子作为一个 GeoJSON 图层下发，体积远小于逐个标记
+    radius = np.round(4 + 16 * np.sqrt(bins["数量"] / bins["数量"].max())).astype(int)
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lng, 5), round(lat, 5)]},
+            # GeoJsonTooltip 以 innerHTML 写入提示，示例客户名来自上传的 Excel，先转义
+            "properties": {"r": int(r), "tip": f"{count} 个客户（如：{html.escape(str(sample))}）"},
+        }
+        for lng, lat, count, sample, r in zip(
+            bins["经度"].tolist(), bins["纬度"].tolist(), bins["数量"].tolist(),
+            bins["示例客户"].tolist(), radius.tolist()
+        )
+    ]
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        marker=folium.CircleMarker(color='#1f77b4', fill=True, fill_opacity=0.6, weight=1),
+        style_function=lambda feature: {"radius": feature["properties"]["r"]},
+        tooltip=folium.GeoJsonTooltip(fields=["tip"], labels=False)
+    ).add_to(m)
+    return m, len(bins)
+
+
+# ══════════════════════════════════════════════════════
+# 坐标校验：离线判断坐标是否落在所填省份/城市的行政区划边界内
+# ══════════════════════════════════════════════════════
+
+BOUNDARY_PATH = Path("boundaries/china_admin.geojson")  # 默认边界文件
+
+
+@st.cache_resource(show_spinner="正在加载行政区划边界...")
+def load_boundary_index(raw_bytes):
+    return AdminBoundaryIndex(json.loads(raw_bytes.decode("utf-8")))
+
+
+def validate_coordinates(result_df, index, map_service):
+    """
+    批量校验坐标是否落在所填省份/城市内，返回与 result_df 对齐的校验结论 Series。
+    按所填地区分组，每组一次向量化判定；仅对不一致的点查询实际所在地区。
+    """
+    verdict = pd.Series("", index=result_df.index, dtype=object)
+    lngs = pd.to_numeric(result_df["经度"], errors="coerce")
+    lats = pd.to_numeric(result_df["纬度"], errors="coerce")
+    valid = (result_df["转换状态"] == "成功") & lngs.notna() & lats.notna()
+    if not valid.any():
+        return verdict
+
+    lng_arr = lngs[valid].to_numpy()
+    lat_arr = lats[valid].to_numpy()
+    if map_service == "百度地图":
+        lng_arr, lat_arr = bd09_to_gcj02(lng_arr, lat_arr)
+    sub = pd.DataFrame({
+        "lng": lng_arr, "lat": lat_arr,
+        "省份": result_df.loc[valid, "省份"].astype(str).to_numpy(),
+        "城市": result_df.loc[valid, "城市"].astype(str).to_numpy(),
+    }, index=result_df.index[valid])
+
+    for (province, city), group in sub.groupby(["省份", "城市"], sort=False):
+        prov_region = index.find("province", province)
+        city_region = index.find("city", city, province)
+        # 直辖市等没有市级边界时，退化为省级校验
+        target = city_region or prov_region
+        if target is None:
+            verdict[group.index] = "无边界数据"
+            continue
+        inside = index.contains(target, group["lng"].to_numpy(), group["lat"].to_numpy())
+        verdict[group.index[inside]] = "通过"
+
+        outside = group.loc[~inside]
+        if outside.empty:
+            continue
+        out_lng = outside["lng"].to_numpy()
+        out_lat = outside["lat"].to_numpy()
+        actual_cities = index.locate(out_lng, out_lat, "city")
+        actual_provs = index.locate(out_lng, out_lat, "province")
+        in_declared_prov = (index.contains(prov_region, out_lng, out_lat) if prov_region is not None
+                            else np.ones(len(outside), dtype=bool))
+        for row_idx, actual_city, actual_prov, prov_ok in zip(
+                outside.index, actual_cities, actual_provs, in_declared_prov):
+            actual = actual_city or actual_prov
+            where = f"（实际：{actual['name']}）" if actual else "（不在任何边界内）"
+            verdict[row_idx] = ("城市不符" if prov_ok else "省份不符") + where
+    return verdict
 
 
 # 主界面
@@ -287,6 +737,7 @@ with col2:
 if st.session_state.conversion_done:
     if st.button("🔄 重新开始转换", type="secondary"):
         st.session_state.result_df = None
+        st.session_state.result_map_service = None
         st.session_state.conversion_done = False
         st.rerun()
 
@@ -315,26 +766,44 @@ if uploaded_file is not None and not st.session_state.conversion_done:
             
             st.markdown("---")
             
+            job_id = make_job_id(uploaded_file.getvalue(), map_service)
+            job = get_or_create_job(job_id, df, map_service)
+            
             # 转换按钮
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
-                if not api_key:
+                if job.status == "running":
+                    if st.button("⏸ 暂停转换", use_container_width=True):
+                        job.stop()
+                elif job.status == "done":
+                    st.success(f"✅ 该文件已转换完成（{job.total} 条），结果已保存在本地")
+                    if st.button("📋 查看转换结果", type="primary", use_container_width=True):
+                        st.session_state.result_df = job.result_df()
+                        st.session_state.result_map_service = job.map_service
+                        st.session_state.conversion_done = True
+                        st.rerun()
+                    if api_key and st.button("🗑 丢弃结果并重新转换", use_container_width=True):
+                        job.discard()
+                        job.start(api_key)
+                elif not api_key:
                     st.warning("⚠️ 请在左侧侧边栏输入API Key")
-                    start_convert = st.button("开始转换", disabled=True, use_container_width=True)
+                    st.button("开始转换", disabled=True, use_container_width=True)
                 else:
-                    start_convert = st.button("🚀 开始转换", type="primary", use_container_width=True)
+                    resumable = 0 < job.done_count < job.total
+                    if resumable:
+                        st.info(f"💾 发现已保存的进度：{job.done_count}/{job.total}")
+                    label = "▶️ 继续转换" if resumable else "🚀 开始转换"
+                    if st.button(label, type="primary", use_container_width=True):
+                        job.start(api_key)
+                    if resumable and st.button("🗑 丢弃进度并从头转换", use_container_width=True):
+                        job.discard()
+                        job.start(api_key)
             
-            # 执行转换
-            if start_convert and api_key:
+            # 后台任务进度（刷新页面或重新上传同一文件后自动续上）
+            if job.status in ("running", "stopped", "failed"):
                 st.markdown("---")
                 st.subheader("🔄 转换进行中...")
-                
-                with st.spinner("正在批量转换地址..."):
-                    result_df = process_addresses(df, api_key, map_service)
-                    st.session_state.result_df = result_df
-                    st.session_state.conversion_done = True
-                
-                st.rerun()
+                render_job_progress(job)
                 
     except Exception as e:
         st.error(f"❌ 文件读取错误: {str(e)}")
@@ -360,123 +829,72 @@ elif st.session_state.conversion_done and st.session_state.result_df is not None
     
     st.markdown("---")
     
+    # 坐标校验：有边界数据时离线校验坐标是否落在所填省份/城市内
+    boundary_bytes = None
+    if boundary_file is not None:
+        boundary_bytes = boundary_file.getvalue()
+    elif BOUNDARY_PATH.exists():
+        boundary_bytes = BOUNDARY_PATH.read_bytes()
+    
+    if boundary_bytes:
+        try:
+            boundary_index = load_boundary_index(boundary_bytes)
+            result_df = result_df.copy()
+            # 按结果实际使用的地图服务判断坐标系，而不是侧边栏当前的选择
+            result_map_service = st.session_state.result_map_service or map_service
+            result_df["坐标校验"] = validate_coordinates(result_df, boundary_index, result_map_service)
+            mismatch_df = result_df[
+                result_df["坐标校验"].str.startswith("省份不符") | result_df["坐标校验"].str.startswith("城市不符")
+            ]
+            st.subheader("🧭 坐标校验")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("校验通过", int((result_df["坐标校验"] == "通过").sum()))
+            with col2:
+                st.metric("位置不符", len(mismatch_df))
+            with col3:
+                st.metric("无边界数据", int((result_df["坐标校验"] == "无边界数据").sum()))
+            if len(mismatch_df) > 0:
+                st.warning(f"⚠️ {len(mismatch_df)} 条记录的坐标不在所填省份/城市内，建议核对地址后重新转换")
+                st.dataframe(
+                    mismatch_df[["客户名称", "省份", "城市", "详细地址", "经度", "纬度", "坐标校验"]],
+                    use_container_width=True
+                )
+            st.markdown("---")
+        except Exception as e:
+            st.warning(f"⚠️ 行政区划边界文件无法使用，已跳过坐标校验：{str(e)}")
+    
     # 显示转换结果
     st.subheader("📋 转换结果")
     st.dataframe(result_df, use_container_width=True)
     
-    # 地图可视化 - 显示转换成功的前10个客户
+    # 地图可视化 - 点数较少时聚合标记，点数较多时按网格聚合，浏览器端数据量有上限
     success_df = result_df[result_df["转换状态"] == "成功"].copy()
     
     if len(success_df) > 0:
         st.markdown("---")
-        st.subheader("🗺️ 客户位置地图展示（前10个成功转换的客户）")
-        
-        # 获取前10个成功的客户
-        map_df = success_df.head(10).copy()
+        st.subheader("🗺️ 客户位置地图展示")
         
         try:
-            # 改进的数据清洗
-            map_df = map_df[
-                map_df["经度"].notna() & 
-                map_df["纬度"].notna() & 
-                (map_df["经度"] != "") & 
-                (map_df["纬度"] != "")
-            ].copy()
+            # 确保经纬度是数字类型，并过滤无效坐标
+            map_df = success_df.copy()
+            map_df["经度"] = pd.to_numeric(map_df["经度"], errors='coerce')
+            map_df["纬度"] = pd.to_numeric(map_df["纬度"], errors='coerce')
+            map_df = map_df[valid_coordinate_mask(map_df["纬度"], map_df["经度"])]
             
             if len(map_df) == 0:
-                st.warning("⚠️ 没有有效的经纬度数据可以显示在地图上")
+                st.error("❌ 没有有效的经纬度数据（坐标超出有效范围）")
             else:
-                # 确保经纬度是数字类型
-                map_df["经度"] = pd.to_numeric(map_df["经度"], errors='coerce')
-                map_df["纬度"] = pd.to_numeric(map_df["纬度"], errors='coerce')
-                
-                # 过滤NaN值
-                map_df = map_df.dropna(subset=["经度", "纬度"])
-                
-                # 验证坐标范围（中国范围大致：经度73-135，纬度18-54）
-                map_df = map_df[
-                    (map_df["经度"] >= -180) & (map_df["经度"] <= 180) &
-                    (map_df["纬度"] >= -90) & (map_df["纬度"] <= 90)
-                ]
-                
-                if len(map_df) == 0:
-                    st.error("❌ 没有有效的经纬度数据（坐标超出有效范围）")
+                m, mode = build_customer_map(map_df)
+                if mode == "cluster":
+                    st.success(f"✅ 地图共显示 {len(map_df)} 个客户位置（缩放查看聚合明细）")
                 else:
-                    # 计算地图中心点（所有客户的平均位置）
-                    center_lat = float(map_df["纬度"].mean())
-                    center_lng = float(map_df["经度"].mean())
-                    
-                    # 创建地图
-                    m = folium.Map(
-                        location=[center_lat, center_lng],
-                        zoom_start=11,
-                        tiles='OpenStreetMap'
+                    st.success(
+                        f"✅ {len(map_df)} 个客户已按网格聚合为 {mode} 个区域显示，圆点大小表示客户数量"
                     )
-                    
-                    # 为每个客户添加标记
-                    marker_count = 0
-                    for idx, row in map_df.iterrows():
-                        try:
-                            lat = float(row["纬度"])
-                            lng = float(row["经度"])
-                            
-                            # 创建弹出窗口内容
-                            popup_html = f"""
-                            <div style="font-family: Arial; min-width: 200px;">
-                                <h4 style="color: #1f77b4; margin-bottom: 10px;">📍 {row['客户名称']}</h4>
-                                <hr style="margin: 5px 0;">
-                                <p><b>省份：</b>{row['省份']}</p>
-                                <p><b>城市：</b>{row['城市']}</p>
-                                <p><b>地址：</b>{row['详细地址']}</p>
-                                <hr style="margin: 5px 0;">
-                                <p><b>经度：</b>{lng:.6f}</p>
-                                <p><b>纬度：</b>{lat:.6f}</p>
-                            </div>
-                            """
-                            
-                            # 添加标记点
-                            folium.Marker(
-                                location=[lat, lng],
-                                popup=folium.Popup(popup_html, max_width=300),
-                                tooltip=row["客户名称"],
-                                icon=folium.Icon(color='red', icon='info-sign')
-                            ).add_to(m)
-                            
-                            # 添加圆形区域标记
-                            folium.Circle(
-                                location=[lat, lng],
-                                radius=500,  # 500米半径
-                                color='blue',
-                                fill=True,
-                                fillColor='blue',
-                                fillOpacity=0.1,
-                                opacity=0.3
-                            ).add_to(m)
-                            
-                            marker_count += 1
-                        except Exception as e:
-                            st.warning(f"⚠️ 无法为 {row['客户名称']} 添加标记：{str(e)}")
-                            continue
-                    
-                    if marker_count > 0:
-                        st.success(f"✅ 成功在地图上显示 {marker_count} 个客户位置")
-                        
-                        # 显示地图
-                        st_folium(m, width=1200, height=600, key="customer_map")
-                        
-                        # 显示地图上的客户列表
-                        st.markdown("---")
-                        st.write("**地图上展示的客户列表：**")
-                        display_cols = ["客户名称", "省份", "城市", "详细地址", "经度", "纬度"]
-                        st.dataframe(
-                            map_df[display_cols].reset_index(drop=True),
-                            use_container_width=True
-                        )
-                        
-                        if len(success_df) > 10:
-                            st.info(f"ℹ️ 共有 {len(success_df)} 个客户转换成功，地图仅展示前10个客户位置")
-                    else:
-                        st.error("❌ 无法添加任何标记到地图")
+                
+                # 不回传地图交互状态，避免每次拖动都触发重跑
+                st_folium(m, width=1200, height=600, key="customer_map", returned_objects=[])
         
         except Exception as e:
             st.error(f"❌ 创建地图时出错：{str(e)}")
@@ -574,8 +992,8 @@ else:
     st.markdown("### 💡 温馨提示")
     st.info("""
     - Excel文件支持多种列名格式（如"客户名称"、"公司名称"、"名称"等）
-    - API请求间隔为0.5秒，大量数据转换需要一定时间
-    - 建议单次处理数据量不超过1000条
+    - API请求间隔为0.5秒，高德地图每次请求批量转换10个地址，大量数据转换需要一定时间
+    - 转换在后台执行并定期保存进度，刷新页面后重新上传同一文件即可从断点继续
     - 转换过程中请保持网络连接稳定
     """)
 
@@ -0,0 +1,216 @@
+"""
+coach_text 预处理引擎基准测试
+
+与原先各模块中的 split_sentences / identify_speaker / clean_prefix / build_dialogue
+（下方 legacy_* 为原实现的拷贝）对比吞吐，并校验两者输出完全一致。
+
+用法：
+  python bench_coach_text.py                     # 用内置样例放大到约 20MB
+  python bench_coach_text.py 文字稿目录或文件 --mb 50 --repeat 3
+
+参考结果（内置样例 20MB，--repeat 3，输出不一致 0 例；不同机器上约 2～3.7 倍）：
+  行内标签   原实现 11.4 MB/s → 单遍引擎 33.7 MB/s（2.9x）
+  多行正文   原实现  9.8 MB/s → 单遍引擎 26.7 MB/s（2.7x）
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from coach_text import segment_dialogue
+
+SAMPLE = """销售：王老板您好，我是正康医药的小张，上个月来过一次。我们公司最近推出了新的合作方案，给您带来一些资料。
+客户：你们的价格太贵了，我再想想吧。别家也在推类似的产品，有没有优惠？
+销售：理解您的顾虑！这款产品的毛利空间比同类高，我们这边可以给您做陈列支持…
+客户：我需要考虑一下，下周再说。
+顾客：这个药效果怎么样？
+业务：效果很好，很多门店都在卖。
+这款产品我们可以先铺两盒试试。你们价格能不能再低点？
+"""
+
+SAMPLE_MULTILINE = """销售：
+王老板您好，我是正康医药的小张。
+我们公司最近推出了新的合作方案。
+客户：
+你们的价格太贵了，我再想想吧。
+有没有优惠？
+销售：
+理解您的顾虑！我们这边可以给您做陈列支持…
+"""
+
+
+# ── 原实现（行内标签版） ───────────────────────────────
+
+def legacy_split_sentences(text: str) -> list:
+    lines = text.strip().split("\n")
+    out = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        m = re.match(r'^((?:客户|顾客|买方|销售|业务|销售员|代表|客|销)[：:])\s*', line)
+        prefix = m.group(0) if m else ""
+        body   = line[len(prefix):] if prefix else line
+        parts = re.split(r'(?<=[。！？…])', body)
+        for p in parts:
+            p = p.strip()
+            if p:
+                out.append(prefix + p)
+    return out
+
+
+def legacy_identify_speaker(sentence: str) -> str:
+    s = sentence.strip()
+    if re.match(r'^(客户|顾客|买方|客)[：:]', s):
+        return "customer"
+    if re.match(r'^(销售|业务|销售员|代表|销)[：:]', s):
+        return "sales"
+    sales_kw    = ["我们公司","我们产品","我来介绍","我们可以","这款产品","推荐您","我们这边","给您","合作","方案"]
+    customer_kw = ["你们价格","太贵了","考虑一下","别家","你们的","有没有优惠","我需要","我再想想"]
+    sc = sum(1 for k in sales_kw    if k in s)
+    cc = sum(1 for k in customer_kw if k in s)
+    if sc > cc: return "sales"
+    if cc > sc: return "customer"
+    return "unknown"
+
+
+def legacy_clean_prefix(s: str) -> str:
+    return re.sub(r'^(客户|顾客|买方|销售|业务|销售员|代表|客|销)[：:]\s*', '', s).strip()
+
+
+def legacy_build_dialogue(sentences: list) -> list:
+    out = []
+    for s in sentences:
+        speaker = legacy_identify_speaker(s)
+        text    = legacy_clean_prefix(s)
+        if text:
+            out.append({"speaker": speaker, "text": text})
+    return out
+
+
+# ── 原实现（标签独占一行 + 多行正文版） ────────────────
+
+def legacy_split_sentences_multiline(text: str) -> list:
+    lines = text.strip().split("\n")
+    out = []
+    current_speaker = None
+    buffer = []
+    tag_pattern = re.compile(r'^\s*(客户|顾客|买方|销售|业务|销售员|代表|客|销)[：:]\s*$')
+
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        tag_match = tag_pattern.match(line)
+        if tag_match:
+            if buffer and current_speaker:
+                full_body = ' '.join(buffer).strip()
+                if full_body:
+                    parts = re.split(r'(?<=[。！？…])', full_body)
+                    for p in parts:
+                        p = p.strip()
+                        if p:
+                            out.append(current_speaker + p)
+                buffer = []
+            current_speaker = tag_match.group(1) + '：'
+        else:
+            if current_speaker:
+                cleaned = re.sub(r'^(客户|顾客|买方|销售|业务|销售员|代表|客|销)[：:]', '', line).strip()
+                buffer.append(cleaned)
+            else:
+                m = re.match(r'^((?:客户|顾客|买方|销售|业务|销售员|代表|客|销)[：:])\s*', line)
+                prefix = m.group(0) if m else ""
+                body = line[len(prefix):] if prefix else line
+                parts = re.split(r'(?<=[。！？…])', body)
+                for p in parts:
+                    p = p.strip()
+                    if p:
+                        out.append(prefix + p)
+
+    if buffer and current_speaker:
+        full_body = ' '.join(buffer).strip()
+        if full_body:
+            parts = re.split(r'(?<=[。！？…])', full_body)
+            for p in parts:
+                p = p.strip()
+                if p:
+                    out.append(current_speaker + p)
+    return out
+
+
+def legacy_segment(text: str, multiline_tags: bool = False) -> list:
+    split = legacy_split_sentences_multiline if multiline_tags else legacy_split_sentences
+    return legacy_build_dialogue(split(text))
+
+
+# ── 校验与计时 ────────────────────────────────────────
+
+def fuzz_texts(n: int, seed: int = 7):
+    """随机拼接标签、关键词、标点、空白，覆盖边界情况"""
+    rnd = random.Random(seed)
+    atoms = ["销售：", "客户:", "销售员：", "客：", "代表：", "业务 ：", " ", "  ", "\n", "\n\n", "。", "！", "？", "…",
+             "我们公司", "我们这边给您", "合作方案", "你们价格", "你们的", "太贵了", "我再想想", "有没有优惠",
+             "推荐您", "好的", "嗯", "王老板", "这款产品", "考虑一下", "别家", "：", "客户：\n", "销售：\n"]
+    for _ in range(n):
+        yield "".join(rnd.choice(atoms) for _ in range(rnd.randint(0, 40)))
+
+
+def verify(texts) -> int:
+    mismatches = 0
+    for t in texts:
+        for ml in (False, True):
+            if segment_dialogue(t, multiline_tags=ml) != legacy_segment(t, multiline_tags=ml):
+                mismatches += 1
+                if mismatches <= 3:
+                    print(f"  输出不一致（multiline_tags={ml}）：{t!r}")
+    return mismatches
+
+
+def timed(fn, docs: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for d in docs:
+            fn(d)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def load_corpus(paths: list) -> list:
+    docs = []
+    for p in map(Path, paths):
+        files = sorted(p.rglob("*.txt")) + sorted(p.rglob("*.md")) if p.is_dir() else [p]
+        docs.extend(f.read_text(encoding="utf-8", errors="replace") for f in files)
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coach_text 预处理基准")
+    parser.add_argument("paths", nargs="*", help="文字稿文件或目录（默认使用内置样例）")
+    parser.add_argument("--mb", type=float, default=20, help="语料放大到的大小（MB，UTF-8）")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("正确性校验 …")
+    bad = verify(list(fuzz_texts(20000)) + [SAMPLE, SAMPLE_MULTILINE] + load_corpus(args.paths))
+    print(f"  不一致 {bad} 例")
+
+    for label, base, ml in (("行内标签", load_corpus(args.paths) or [SAMPLE], False),
+                            ("多行正文", load_corpus(args.paths) or [SAMPLE_MULTILINE], True)):
+        size = sum(len(d.encode("utf-8")) for d in base)
+        docs = base * max(1, int(args.mb * 1024 * 1024 / max(size, 1)))
+        mb   = sum(len(d.encode("utf-8")) for d in docs) / 1024 / 1024
+        old  = timed(lambda d: legacy_segment(d, ml), docs, args.repeat)
+        new  = timed(lambda d: segment_dialogue(d, ml), docs, args.repeat)
+        print(f"{label}：{len(docs)} 篇 / {mb:.1f}MB")
+        print(f"  原实现   {old:7.3f}s  {mb / old:7.1f} MB/s")
+        print(f"  单遍引擎 {new:7.3f}s  {mb / new:7.1f} MB/s  （{old / new:.1f}x）")
+
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
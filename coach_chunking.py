@@ -0,0 +1,263 @@
+"""
+正掌讯 · 对话分窗与 LLM 分片合并
+
+长拜访的对话按 token 预算切成相互重叠的窗口，各窗口并发调用 LLM，结果按固定规则合并：
+  - 对话以紧凑的"序号|说话者|内容"逐行序列化，不再使用缩进 JSON；
+  - 每个窗口只负责自己的"核心区间"，两侧重叠的句子仅作上下文，合并时按全局序号去重；
+  - 合并只依赖窗口顺序，同样的输入总得到同样的输出。
+
+短对话只有一个窗口，与整段调用等价。
+"""
+
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+WINDOW_TOKENS        = int(os.environ.get("LLM_WINDOW_TOKENS", 3000))   # 单窗口对话部分的 token 预算
+STAGE_WINDOW_TOKENS  = WINDOW_TOKENS // 2     # 阶段标注逐句输出，输出量随窗口增长，窗口减半
+OVERLAP_TURNS        = 3                      # 窗口两侧各带几句上下文
+MAX_PARALLEL_WINDOWS = 4
+
+SPEAKER_LABEL = {"sales": "销售", "customer": "客户", "unknown": "未知"}
+STAGE_NAMES   = {1: "开场建立信任", 2: "需求探询", 3: "产品价值呈现", 4: "异议处理", 5: "成交推进", 6: "收场跟进"}
+EMOTION_RANK  = {"负面": 0, "中性": 1, "正面": 2}
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef\u3000-\u303f]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符及全角标点约 1 字 1 token，其余约 4 字符 1 token"""
+    other = len(_CJK_RE.sub("", text))
+    return (len(text) - other) + (other + 3) // 4
+
+
+def render_turn(index: int, turn: dict) -> str:
+    return f"{index}|{SPEAKER_LABEL.get(turn.get('speaker'), '未知')}|{turn.get('text', '')}"
+
+
+def render_dialogue(dialogue: list, budget: int = 0) -> str:
+    """
+    紧凑序列化整段对话（每行：序号|说话者|内容）。
+    budget>0 且超出时保留首尾、省略中段，用于需要看全局但不需要逐句细节的阶段。
+    """
+    lines = [render_turn(i, d) for i, d in enumerate(dialogue)]
+    if budget <= 0 or estimate_tokens("\n".join(lines)) <= budget:
+        return "\n".join(lines)
+    head, tail, used = [], [], 0
+    lo, hi = 0, len(lines) - 1
+    while lo <= hi:
+        line = lines[lo] if len(head) <= len(tail) else lines[hi]
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        used += cost
+        if len(head) <= len(tail):
+            head.append(line)
+            lo += 1
+        else:
+            tail.insert(0, line)
+            hi -= 1
+    return "\n".join(head + [f"……（省略第 {lo}~{hi} 句）"] + tail)
+
+
+class Window:
+    """对话窗口：[start, end) 为送入 LLM 的全部句子，[core_start, core_end) 为本窗口负责的句子"""
+
+    def __init__(self, dialogue: list, start: int, end: int, core_start: int, core_end: int, total: int):
+        self.dialogue   = dialogue
+        self.start      = start
+        self.end        = end
+        self.core_start = core_start
+        self.core_end   = core_end
+        self.total      = total
+
+    @property
+    def is_whole(self) -> bool:
+        return self.core_start == 0 and self.core_end == len(self.dialogue)
+
+    def render(self) -> str:
+        return "\n".join(render_turn(i, self.dialogue[i]) for i in range(self.start, self.end))
+
+    def scope_note(self) -> str:
+        """分窗时提示 LLM 只分析核心区间；整段对话时为空"""
+        if self.is_whole:
+            return ""
+        return (f"【说明】长对话共 {len(self.dialogue)} 句，分 {self.total} 段分析，本段负责序号 "
+                f"{self.core_start}~{self.core_end - 1}；其余句子仅作上下文，标注和统计只计本段负责的句子。")
+
+    def owns(self, index) -> bool:
+        try:
+            return self.core_start <= int(index) < self.core_end
+        except (TypeError, ValueError):
+            return False
+
+
+def chunk_dialogue(dialogue: list, budget: int = WINDOW_TOKENS, overlap: int = OVERLAP_TURNS) -> list:
+    """按 token 预算把对话切成核心区间互不重叠、两侧各带 overlap 句上下文的窗口"""
+    if not dialogue:
+        return [Window(dialogue, 0, 0, 0, 0, 1)]
+    cores, start, used = [], 0, 0
+    for i, turn in enumerate(dialogue):
+        cost = estimate_tokens(render_turn(i, turn)) + 1
+        if i > start and used + cost > budget:
+            cores.append((start, i))
+            start, used = i, 0
+        used += cost
+    cores.append((start, len(dialogue)))
+    return [Window(dialogue, max(0, a - overlap), min(len(dialogue), b + overlap), a, b, len(cores))
+            for a, b in cores]
+
+
+def map_windows(dialogue: list, fn, merge, budget: int = WINDOW_TOKENS,
+                overlap: int = OVERLAP_TURNS, max_workers: int = MAX_PARALLEL_WINDOWS) -> dict:
+    """
+    fn(window) -> dict 对每个窗口调用（多窗口时并发），merge(parts, windows, dialogue) 合并。
+    各窗口结果按窗口顺序传给 merge，与完成先后无关。
+    """
+    windows = chunk_dialogue(dialogue, budget, overlap)
+    if len(windows) == 1:
+        parts = [fn(windows[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows)),
+                                thread_name_prefix="coach-window") as pool:
+            parts = list(pool.map(fn, windows))
+    return merge(parts, windows, dialogue)
+
+
+# ── 合并规则 ──────────────────────────────────────────
+
+def _valid(parts: list, windows: list) -> list:
+    """去掉调用失败的窗口；返回 [(结果, 窗口)]"""
+    return [(p, w) for p, w in zip(parts, windows) if isinstance(p, dict) and "error" not in p]
+
+
+def _dedupe(items: list) -> list:
+    seen, out = set(), []
+    for item in items:
+        key = json.dumps(item, ensure_ascii=False, sort_keys=True) if isinstance(item, (dict, list)) else item
+        if key not in seen:
+            seen.add(key)
+            out.append(item)
+    return out
+
+
+def _join_text(values: list) -> str:
+    return "；".join(_dedupe([v.strip() for v in values if isinstance(v, str) and v.strip()]))
+
+
+def merge_values(values: list, join_keys: frozenset = frozenset(), key: str = ""):
+    """
+    通用合并：数值求和、布尔取或、列表拼接去重、字典逐键递归；
+    字符串默认取众数（并列取先出现者），join_keys 中的描述性字段按顺序拼接。
+    """
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    if all(isinstance(v, bool) for v in values):
+        return any(values)
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        total = sum(values)
+        return round(total, 2) if isinstance(total, float) else total
+    if all(isinstance(v, list) for v in values):
+        return _dedupe([x for v in values for x in v])
+    if all(isinstance(v, dict) for v in values):
+        keys = list(dict.fromkeys(k for v in values for k in v))
+        return {k: merge_values([v.get(k) for v in values], join_keys, k) for k in keys}
+    strs = [v for v in values if isinstance(v, str) and v.strip()]
+    if key in join_keys:
+        return _join_text(strs)
+    if not strs:
+        return values[0]
+    counts = Counter(strs)
+    best = max(counts.values())
+    return next(s for s in strs if counts[s] == best)
+
+
+def merge_stage_results(parts: list, windows: list, dialogue: list) -> dict:
+    """
+    阶段标注：按全局序号取各窗口核心区间内的标注，说话者和原文从对话回填，漏标的句子保留但不带阶段；
+    阶段分布、缺失阶段由合并后的逐句标注重新统计。
+    """
+    valid = _valid(parts, windows)
+    if not valid:
+        return parts[0] if parts else {"error": "无对话内容"}
+    by_index = {}
+    for part, win in valid:
+        for k, item in enumerate(part.get("stage_analysis") or []):
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("index", win.start + k)     # 未给序号时按窗口内位置推算
+            if win.owns(idx) and int(idx) not in by_index:
+                by_index[int(idx)] = item
+    analysis = []
+    for idx in range(len(dialogue)):
+        item = dict(by_index.get(idx, {}))
+        item.update({"index": idx, "speaker": dialogue[idx].get("speaker", "unknown"),
+                     "text": dialogue[idx].get("text", "")})
+        try:
+            stage = int(item.get("stage"))
+        except (TypeError, ValueError):
+            stage = None
+        if stage in STAGE_NAMES:
+            item["stage"] = stage
+            item.setdefault("stage_name", STAGE_NAMES[stage])
+        analysis.append(item)
+
+    dist = Counter(it["stage"] for it in analysis if it.get("stage") in STAGE_NAMES)
+    return {
+        "stage_analysis":     analysis,
+        "stage_distribution": {str(s): dist.get(s, 0) for s in STAGE_NAMES},
+        "missing_stages":     [s for s in STAGE_NAMES if not dist.get(s)],
+        "stage_summary":      _join_text([p.get("stage_summary") for p, _ in valid]),
+    }
+
+
+TAG_JOIN_KEYS = frozenset({"question_quality_reason", "objection_detail"})
+
+
+def merge_tag_results(parts: list, windows: list, dialogue: list) -> dict:
+    """行为标签：计数求和、列表去重；情绪总体取最后一段，趋势由首末段比较得出"""
+    valid = _valid(parts, windows)
+    if not valid:
+        return parts[0] if parts else {"error": "无对话内容"}
+    if len(valid) == 1:
+        return valid[0][0]
+    merged = merge_values([p for p, _ in valid], TAG_JOIN_KEYS)
+
+    price = [p.get("price_sensitivity") or {} for p, _ in valid]
+    mentioned = [ps for ps in price if ps.get("mentioned")]
+    if mentioned:
+        merged.setdefault("price_sensitivity", {})["customer_reaction"] = mentioned[-1].get("customer_reaction", "")
+
+    emotions = [(p.get("customer_emotion") or {}).get("overall") for p, _ in valid]
+    emotions = [e for e in emotions if e in EMOTION_RANK]
+    if emotions:
+        emo = merged.setdefault("customer_emotion", {})
+        emo["overall"] = emotions[-1]
+        first, last = EMOTION_RANK[emotions[0]], EMOTION_RANK[emotions[-1]]
+        emo["trend"] = "好转" if last > first else "恶化" if last < first else "平稳"
+    return merged
+
+
+FACT_JOIN_KEYS = frozenset()
+
+
+def merge_fact_results(parts: list, windows: list, dialogue: list) -> dict:
+    """行为事实：计数求和、布尔取或、列表去重；轮次统计直接由对话得出；开场相关取第一段"""
+    valid = _valid(parts, windows)
+    if not valid:
+        return parts[0] if parts else {"error": "无对话内容"}
+    if len(valid) == 1:
+        return valid[0][0]
+    merged = merge_values([p for p, _ in valid], FACT_JOIN_KEYS)
+    merged["basic_stats"] = {
+        "total_turns":    len(dialogue),
+        "sales_turns":    sum(1 for d in dialogue if d.get("speaker") == "sales"),
+        "customer_turns": sum(1 for d in dialogue if d.get("speaker") == "customer"),
+    }
+    opening = (valid[0][0].get("rapport_building") or {}).get("greeting_quality")
+    if opening:
+        merged.setdefault("rapport_building", {})["greeting_quality"] = opening
+    return merged
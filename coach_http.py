@@ -0,0 +1,396 @@
+"""
+正掌讯 · Web 服务公共组件
+
+流式 multipart/form-data 解析：按块读取请求体，用滚动缓冲区查找分隔符，
+文件字段超过阈值后落盘（SpooledTemporaryFile），单个请求的内存占用有上限且与上传大小无关。
+纯标准库实现，替代已移除的 cgi 模块。
+
+带 ETag / Cache-Control 的响应：客户端缓存未变时返回 304，不重发内容。
+
+静态文件（报告目录）：路径限定在根目录内；支持 If-None-Match / If-Modified-Since 条件请求、
+单段 Range 请求；优先发送预压缩的 .br / .gz 副本；正文用 socket.sendfile 零拷贝发送。
+"""
+
+import gzip
+import io
+import mimetypes
+import os
+import tempfile
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只生成 / 发送 gzip 副本
+    brotli = None
+
+READ_CHUNK       = 64 * 1024
+SPOOL_THRESHOLD  = 1024 * 1024          # 文件字段超过 1MB 写入临时文件
+MAX_FIELD_BYTES  = 64 * 1024            # 普通表单字段上限
+MAX_HEADER_BYTES = 16 * 1024            # 单个分段头部上限
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024    # 整个请求体上限
+
+COMPRESS_MIN_BYTES = 1024                # 小于此大小的文件不压缩
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+ENCODINGS          = (("br", ".br"), ("gzip", ".gz"))     # 按优先级
+
+
+class UploadedFile:
+    """上传的文件字段；内容在 .file 中（内存或临时文件），用完调用 close()"""
+
+    def __init__(self, filename: str, content_type: str, file, size: int):
+        self.filename     = filename
+        self.content_type = content_type
+        self.file         = file
+        self.size         = size
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+    def __bool__(self):
+        return self.size > 0
+
+
+def _boundary_of(content_type: str) -> bytes:
+    for part in content_type.split(";"):
+        part = part.strip()
+        if part.startswith("boundary="):
+            return part[len("boundary="):].strip().strip('"').encode("latin-1")
+    raise ValueError("multipart/form-data 缺少 boundary 参数")
+
+
+def _parse_part_headers(raw: bytes) -> tuple:
+    """返回 (字段名, 文件名或 None, Content-Type)"""
+    name, filename, ctype = None, None, ""
+    for line in raw.decode("utf-8", errors="replace").splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if key == "content-disposition":
+            for seg in value.split(";"):
+                seg = seg.strip()
+                if seg.startswith("name="):
+                    name = seg[5:].strip().strip('"')
+                elif seg.startswith("filename="):
+                    filename = seg[9:].strip().strip('"')
+        elif key == "content-type":
+            ctype = value.strip()
+    return name, filename, ctype
+
+
+def parse_multipart_stream(rfile, content_type: str, content_length: int,
+                           spool_threshold: int = SPOOL_THRESHOLD,
+                           max_upload: int = MAX_UPLOAD_BYTES) -> dict:
+    """
+    从 rfile 流式解析 multipart/form-data，最多读取 content_length 字节。
+    返回 {字段名: bytes}；带 filename 的字段为 UploadedFile。
+    """
+    if content_length > max_upload:
+        raise ValueError(f"上传内容过大（{content_length // 1024 // 1024}MB），上限 {max_upload // 1024 // 1024}MB")
+
+    delim     = b"\r\n--" + _boundary_of(content_type)
+    keep      = len(delim) + 4          # 缓冲区末尾保留的长度，防止分隔符跨块被截断
+    remaining = content_length
+    buf       = b"\r\n"                 # 补一个 CRLF，使首个分隔符与后续格式一致
+    fields    = {}
+
+    def fill() -> bool:
+        nonlocal buf, remaining
+        if remaining <= 0:
+            return False
+        chunk = rfile.read(min(READ_CHUNK, remaining))
+        if not chunk:
+            remaining = 0
+            return False
+        remaining -= len(chunk)
+        buf += chunk
+        return True
+
+    # 跳过前导内容，定位第一个分隔符
+    while True:
+        idx = buf.find(delim)
+        if idx >= 0:
+            buf = buf[idx + len(delim):]
+            break
+        buf = buf[-keep:]
+        if not fill():
+            raise ValueError("multipart 数据不完整：未找到分隔符")
+
+    while True:
+        while len(buf) < 2 and fill():
+            pass
+        if buf.startswith(b"--"):
+            break                                     # 结束分隔符
+        # 分段头部
+        while b"\r\n\r\n" not in buf:
+            if len(buf) > MAX_HEADER_BYTES or not fill():
+                raise ValueError("multipart 分段头部不完整")
+        raw_headers, buf = buf.split(b"\r\n\r\n", 1)
+        name, filename, ctype = _parse_part_headers(raw_headers.lstrip(b"\r\n"))
+
+        if filename is not None:
+            sink = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        else:
+            sink = io.BytesIO()
+        size = 0
+
+        # 分段正文：输出到分隔符为止，未找到时保留缓冲区尾部继续读
+        while True:
+            idx = buf.find(delim)
+            if idx >= 0:
+                data, buf = buf[:idx], buf[idx + len(delim):]
+            elif len(buf) > keep:
+                data, buf = buf[:-keep], buf[-keep:]
+            else:
+                data = b""
+            if data:
+                size += len(data)
+                if filename is None and size > MAX_FIELD_BYTES:
+                    raise ValueError(f"表单字段 {name} 过长")
+                sink.write(data)
+            if idx >= 0:
+                break
+            if not fill():
+                sink.close()
+                raise ValueError("multipart 数据不完整：缺少结束分隔符")
+
+        if not name:
+            sink.close()
+            continue
+        if filename is not None:
+            fields[name] = UploadedFile(filename, ctype, sink, size)
+        else:
+            fields[name] = sink.getvalue()
+
+    return fields
+
+
+def etag_matches(handler, etag: str) -> bool:
+    """请求头 If-None-Match 是否包含 etag（支持逗号分隔的多个值和 *）"""
+    header = handler.headers.get("If-None-Match", "")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def send_cached(handler, body: bytes, content_type: str, etag: str, cache_control: str = "no-cache"):
+    """
+    发送可缓存的响应：If-None-Match 命中时返回 304。
+    cache_control 默认 no-cache（每次向服务端确认，未变则 304）；带内容哈希的静态资源可传 immutable 长缓存。
+    """
+    if etag_matches(handler, etag):
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", cache_control)
+        handler.end_headers()
+        return
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.send_header("ETag", etag)
+    handler.send_header("Cache-Control", cache_control)
+    handler.end_headers()
+    if handler.command != "HEAD":
+        handler.wfile.write(body)
+
+
+# ── 静态文件 ──────────────────────────────────────────
+
+def _content_type(path: Path) -> str:
+    ctype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if ctype.startswith("text/") or ctype in ("application/javascript", "application/json"):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def _compressible(path: Path) -> bool:
+    ctype = mimetypes.guess_type(path.name)[0] or ""
+    return ctype.startswith(COMPRESSIBLE_TYPES)
+
+
+def precompress(path) -> list:
+    """
+    生成 path 的 .gz（及安装了 brotli 时的 .br）副本，已是最新的跳过；返回生成的副本路径。
+    先写临时文件再改名，并发请求不会读到写了一半的副本。
+    """
+    path = Path(path)
+    st = path.stat()
+    if st.st_size < COMPRESS_MIN_BYTES or not _compressible(path):
+        return []
+    made = []
+    for enc, suffix in ENCODINGS:
+        if enc == "br" and brotli is None:
+            continue
+        variant = path.with_name(path.name + suffix)
+        try:
+            if variant.stat().st_mtime_ns >= st.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        data = path.read_bytes()
+        packed = brotli.compress(data) if enc == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+        tmp = variant.with_name(f".{variant.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(packed)
+        os.replace(tmp, variant)
+        made.append(variant)
+    return made
+
+
+def resolve_static(root, rel_path: str):
+    """把 URL 路径（已去掉路由前缀）解析为 root 下的普通文件；越界、隐藏文件或不存在返回 None"""
+    rel = urllib.parse.unquote(rel_path.split("?", 1)[0].split("#", 1)[0])
+    if "\0" in rel or "\\" in rel:
+        return None
+    parts = [p for p in rel.split("/") if p not in ("", ".")]
+    if not parts or any(p == ".." or p.startswith(".") for p in parts):
+        return None
+    root = Path(root).resolve()
+    try:
+        target = root.joinpath(*parts).resolve()
+        target.relative_to(root)                   # 符号链接指向根目录外时抛出 ValueError
+    except (ValueError, OSError):
+        return None
+    return target if target.is_file() else None
+
+
+def _accepted_encodings(handler) -> set:
+    accepted = set()
+    for item in handler.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                pass
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def _parse_range(header: str, size: int):
+    """
+    解析单段 Range：返回 (start, end) 闭区间；语法不支持（多段等）返回 None 表示忽略 Range，
+    范围不可满足返回 False。
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _not_modified(handler, etag: str, mtime: int) -> bool:
+    if handler.headers.get("If-None-Match"):
+        return etag_matches(handler, etag)              # 有 If-None-Match 时忽略 If-Modified-Since
+    ims = handler.headers.get("If-Modified-Since")
+    if ims:
+        try:
+            return mtime <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _send_file_body(handler, path: Path, offset: int, count: int):
+    with open(path, "rb") as f:
+        try:
+            handler.connection.sendfile(f, offset, count)      # 内核零拷贝，不支持时自动退回 send
+        except (AttributeError, OSError):
+            f.seek(offset)
+            remaining = count
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                handler.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+def serve_static_file(handler, root, rel_path: str, cache_control: str = "no-cache") -> bool:
+    """
+    从 root 目录发送静态文件；找不到返回 False（由调用方决定 404 内容）。
+    处理顺序：路径校验 → 条件请求 304 → 预压缩副本 / Range → sendfile 发送正文。
+    """
+    path = resolve_static(root, rel_path)
+    if path is None:
+        return False
+    st       = path.stat()
+    mtime    = int(st.st_mtime)
+    etag     = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_mod = formatdate(st.st_mtime, usegmt=True)
+    compress = _compressible(path) and st.st_size >= COMPRESS_MIN_BYTES
+
+    def common_headers(tag):
+        handler.send_header("ETag", tag)
+        handler.send_header("Last-Modified", last_mod)
+        handler.send_header("Cache-Control", cache_control)
+        if compress:
+            handler.send_header("Vary", "Accept-Encoding")
+
+    # 压缩副本：Range 请求只对原文件生效，有 Range 时不走压缩
+    body_path, encoding, size = path, None, st.st_size
+    range_header = handler.headers.get("Range")
+    if compress and not range_header:
+        accepted = _accepted_encodings(handler)
+        for enc, suffix in ENCODINGS:
+            if enc in accepted:
+                if enc == "gzip" or brotli is not None:
+                    precompress(path)
+                variant = path.with_name(path.name + suffix)
+                if variant.is_file() and variant.stat().st_mtime_ns >= st.st_mtime_ns:
+                    body_path, encoding, size = variant, enc, variant.stat().st_size
+                    etag = etag[:-1] + f'-{suffix[1:]}"'
+                    break
+
+    if _not_modified(handler, etag, mtime):
+        handler.send_response(304)
+        common_headers(etag)
+        handler.end_headers()
+        return True
+
+    status, offset, count = 200, 0, size
+    if range_header and encoding is None:
+        if_range = handler.headers.get("If-Range")
+        if not if_range or if_range.strip() in (etag, last_mod):
+            rng = _parse_range(range_header, size)
+            if rng is False:
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{size}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return True
+            if rng:
+                status, offset, count = 206, rng[0], rng[1] - rng[0] + 1
+
+    handler.send_response(status)
+    handler.send_header("Content-Type", _content_type(path))
+    handler.send_header("Content-Length", str(count))
+    handler.send_header("Accept-Ranges", "bytes")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+    if status == 206:
+        handler.send_header("Content-Range", f"bytes {offset}-{offset + count - 1}/{size}")
+    common_headers(etag)
+    handler.end_headers()
+    if handler.command != "HEAD" and count:
+        _send_file_body(handler, body_path, offset, count)
+    return True
@@ -0,0 +1,324 @@
+"""
+正掌讯 · 分析任务队列与工作线程池
+
+文字稿分析任务持久化在 SQLite（与业务库同库的 analysis_jobs 表），进程重启后未完成的任务自动恢复。
+工作线程池从队列中领取任务执行，LLM 总体调用速率由 llm_client 的全局限速统一控制。
+
+同一个库可能同时被网页服务和命令行批量任务使用：执行中的任务由所在进程定期刷新心跳（heartbeat_at），
+只有心跳超时的 running 任务（进程已退出）才会重新排队，不会抢走其他进程正在执行的任务。
+
+任务状态：queued → running → done / failed
+priority 高的任务优先领取（网页单次上传优先于批量任务）。
+"""
+
+import csv
+import io
+import json
+import sqlite3
+import threading
+import uuid
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+TRANSCRIPT_SUFFIXES = {".txt", ".md"}
+MANIFEST_NAME       = "index.csv"      # 可选清单：file,rep_id,rep_name,customer_id,visit_date
+HEARTBEAT_INTERVAL  = 30               # 执行中任务的心跳间隔（秒）
+STALE_AFTER         = 120              # 心跳超过该时长未刷新的 running 任务视为进程已退出（秒）
+
+
+def decode_transcript(raw_bytes: bytes) -> str:
+    """自动检测编码解码文字稿"""
+    for enc in ("utf-8", "utf-8-sig", "gbk", "gb2312", "big5"):
+        try:
+            return raw_bytes.decode(enc)
+        except Exception:
+            continue
+    return raw_bytes.decode("utf-8", errors="replace")
+
+
+def _read_manifest(raw_bytes: bytes) -> dict:
+    rows = csv.DictReader(io.StringIO(decode_transcript(raw_bytes).lstrip("﻿")))
+    return {Path(r.get("file", "")).name: {k: (v or "").strip() for k, v in r.items() if k != "file"}
+            for r in rows if r.get("file")}
+
+
+def collect_transcripts(source) -> list:
+    """
+    从目录路径、ZIP 路径、ZIP 字节或已打开的 ZIP 文件对象中收集文字稿。
+    返回 [(文件名, 文本, 元数据dict), ...]，元数据来自可选的 index.csv 清单。
+    """
+    files, manifest = [], {}
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if hasattr(source, "read") or zipfile.is_zipfile(str(source)):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        zf = zipfile.ZipFile(source if hasattr(source, "read") else str(source))
+        with zf:
+            for info in zf.infolist():
+                name = Path(info.filename).name
+                if info.is_dir() or name.startswith(".") or "__MACOSX" in info.filename:
+                    continue
+                if name == MANIFEST_NAME:
+                    manifest = _read_manifest(zf.read(info))
+                elif Path(name).suffix.lower() in TRANSCRIPT_SUFFIXES:
+                    files.append((name, zf.read(info)))
+    else:
+        root = Path(source)
+        if not root.is_dir():
+            raise ValueError(f"不是目录或 ZIP 文件：{source}")
+        if (root / MANIFEST_NAME).exists():
+            manifest = _read_manifest((root / MANIFEST_NAME).read_bytes())
+        for p in sorted(root.rglob("*")):
+            if p.is_file() and p.suffix.lower() in TRANSCRIPT_SUFFIXES and not p.name.startswith("."):
+                files.append((p.name, p.read_bytes()))
+
+    out = []
+    for name, raw in sorted(files):
+        text = decode_transcript(raw)
+        if text.strip():
+            out.append((name, text, manifest.get(name, {})))
+    return out
+
+
+class JobQueue:
+    """SQLite 持久化任务队列；每次操作独立短连接，可跨线程使用"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id TEXT PRIMARY KEY,
+                batch_id TEXT, source TEXT,
+                text TEXT, meta_json TEXT,
+                status TEXT, stage TEXT, progress REAL,
+                error TEXT, result_json TEXT, attempts INTEGER DEFAULT 0,
+                created_at TEXT, started_at TEXT, finished_at TEXT,
+                priority INTEGER DEFAULT 0, stages_done TEXT DEFAULT '[]', heartbeat_at TEXT
+            )""")
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(analysis_jobs)").fetchall()}
+            migrations = {
+                "priority":    "ALTER TABLE analysis_jobs ADD COLUMN priority INTEGER DEFAULT 0",
+                "stages_done": "ALTER TABLE analysis_jobs ADD COLUMN stages_done TEXT DEFAULT '[]'",
+                "heartbeat_at": "ALTER TABLE analysis_jobs ADD COLUMN heartbeat_at TEXT",
+            }
+            for col, sql in migrations.items():
+                if col not in existing:
+                    conn.execute(sql)
+            conn.execute("DROP INDEX IF EXISTS idx_jobs_status")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON analysis_jobs(status, priority, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch  ON analysis_jobs(batch_id)")
+
+    @contextmanager
+    def _connect(self):
+        # 自动提交模式，需要原子性的操作显式 BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, text: str, meta: dict, batch_id: str = "", source: str = "", priority: int = 0) -> str:
+        return self.enqueue_many([(source, text, meta)], batch_id, priority)[0]
+
+    def enqueue_many(self, items: list, batch_id: str = "", priority: int = 0) -> list:
+        """items: [(来源文件名, 文本, 元数据dict), ...]；单个事务写入，返回任务 ID 列表"""
+        now = datetime.now().isoformat()
+        rows = [(uuid.uuid4().hex[:12], batch_id, source, text, json.dumps(meta, ensure_ascii=False),
+                 priority, now)
+                for source, text, meta in items]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO analysis_jobs (id,batch_id,source,text,meta_json,priority,"
+                "status,stage,progress,stages_done,created_at) VALUES (?,?,?,?,?,?,'queued','',0,'[]',?)", rows)
+            conn.execute("COMMIT")
+        return [r[0] for r in rows]
+
+    def claim(self):
+        """原子领取最早排队的任务，无任务返回 None"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM analysis_jobs WHERE status='queued' "
+                "ORDER BY priority DESC, created_at, rowid LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = datetime.now().isoformat()
+            conn.execute(
+                "UPDATE analysis_jobs SET status='running', started_at=?, heartbeat_at=?, "
+                "attempts=attempts+1 WHERE id=?",
+                (now, now, row["id"]))
+            conn.execute("COMMIT")
+            return self._to_dict(row, with_text=True)
+
+    def update_progress(self, job_id: str, stage: str, progress: float):
+        """记录刚完成的阶段；stages_done 累积已完成阶段列表，供前端逐项点亮"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE analysis_jobs SET stage=?, progress=?, "
+                "stages_done=json_insert(COALESCE(stages_done,'[]'), '$[#]', ?) WHERE id=?",
+                (stage, round(progress, 3), stage, job_id))
+
+    def finish(self, job_id: str, result: dict):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE analysis_jobs SET status='done', stage='done', progress=1, result_json=?, "
+                "finished_at=? WHERE id=?",
+                (json.dumps(result, ensure_ascii=False), datetime.now().isoformat(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE analysis_jobs SET status='failed', error=?, finished_at=? WHERE id=?",
+                         (error[:500], datetime.now().isoformat(), job_id))
+
+    def heartbeat(self, job_ids: list):
+        """刷新本进程执行中任务的心跳"""
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE analysis_jobs SET heartbeat_at=? WHERE status='running' "
+                f"AND id IN ({','.join('?' * len(job_ids))})",
+                (datetime.now().isoformat(), *job_ids))
+
+    def requeue_stale(self, stale_after: float = STALE_AFTER) -> int:
+        """进程异常退出时遗留的 running 任务（心跳超时）重新排队；其他进程正在执行的任务不受影响"""
+        cutoff = (datetime.now() - timedelta(seconds=stale_after)).isoformat()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE analysis_jobs SET status='queued', stage='', progress=0, stages_done='[]' "
+                "WHERE status='running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)", (cutoff,)).rowcount
+
+    def retry_failed(self, batch_id: str = "") -> int:
+        sql, args = "UPDATE analysis_jobs SET status='queued', stage='', progress=0, stages_done='[]', " \
+                    "error=NULL WHERE status='failed'", ()
+        if batch_id:
+            sql, args = sql + " AND batch_id=?", (batch_id,)
+        with self._connect() as conn:
+            return conn.execute(sql, args).rowcount
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM analysis_jobs WHERE id=?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, batch_id: str = "", limit: int = 500) -> list:
+        with self._connect() as conn:
+            if batch_id:
+                rows = conn.execute("SELECT * FROM analysis_jobs WHERE batch_id=? ORDER BY created_at, rowid",
+                                    (batch_id,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM analysis_jobs ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                                    (limit,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def counts(self, batch_id: str = "") -> dict:
+        sql, args = "SELECT status, COUNT(*) FROM analysis_jobs", ()
+        if batch_id:
+            sql, args = sql + " WHERE batch_id=?", (batch_id,)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " GROUP BY status", args).fetchall()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({r[0]: r[1] for r in rows})
+        counts["total"] = sum(counts[k] for k in ("queued", "running", "done", "failed"))
+        return counts
+
+    @staticmethod
+    def _to_dict(row, with_text: bool = False) -> dict:
+        d = dict(row)
+        if not with_text:
+            d.pop("text", None)
+        d["meta"]   = json.loads(d.pop("meta_json") or "{}")
+        d["result"] = json.loads(d.pop("result_json") or "null")
+        d["stages_done"] = json.loads(d.get("stages_done") or "[]")
+        return d
+
+
+class WorkerPool:
+    """
+    有界工作线程池：每个线程循环领取任务，调用 handler(job, progress_cb) 执行。
+    handler 返回的 dict 写入任务结果；抛出异常则任务标记为 failed。
+    progress_cb(阶段名, 进度0~1) 用于上报阶段进度。
+    另有一个心跳线程定期刷新执行中任务的心跳，并回收其他已退出进程遗留的任务。
+    """
+
+    def __init__(self, queue: JobQueue, handler, workers: int = 4, idle_wait: float = 1.0):
+        self.queue     = queue
+        self.handler   = handler
+        self.workers   = max(workers, 1)
+        self.idle_wait = idle_wait
+        self._wake     = threading.Event()
+        self._stop     = threading.Event()
+        self._threads  = []
+        self._running  = set()          # 本进程执行中的任务 ID
+        self._lock     = threading.Lock()
+
+    def start(self, stop_when_empty: bool = False):
+        self.queue.requeue_stale()
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._loop, args=(stop_when_empty,),
+                                          name=f"coach-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+        threading.Thread(target=self._beat, name="coach-heartbeat", daemon=True).start()
+        return self
+
+    def notify(self):
+        """有新任务入队时唤醒空闲线程"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def is_alive(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def join(self, timeout: float = None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def _loop(self, stop_when_empty: bool):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                if stop_when_empty:
+                    return
+                self._wake.wait(self.idle_wait)
+                self._wake.clear()
+                continue
+
+            def progress_cb(stage, progress, job_id=job["id"]):
+                self.queue.update_progress(job_id, stage, progress)
+
+            with self._lock:
+                self._running.add(job["id"])
+            try:
+                result = self.handler(job, progress_cb)
+                self.queue.finish(job["id"], result or {})
+            except Exception as e:
+                self.queue.fail(job["id"], f"{type(e).__name__}: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(job["id"])
+
+    def _beat(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL) and self.is_alive():
+            with self._lock:
+                running = list(self._running)
+            try:
+                self.queue.heartbeat(running)
+                self.queue.requeue_stale()
+            except sqlite3.Error:
+                continue
+
+
+def new_batch_id() -> str:
+    return f"B{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:4]}"
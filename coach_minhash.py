@@ -0,0 +1,89 @@
+"""
+正掌讯 · 对话近似重复检测（MinHash + LSH）
+
+同一份文字稿稍作修改后以新拜访编号重新上传时，对话指纹（精确哈希）不再相同。
+这里把对话正文切成字符 k-gram，用 MinHash 压缩成定长签名，两份对话的签名逐位相等比例
+即其 Jaccard 相似度的估计；签名分段（band）哈希入桶，查询只比较同桶候选，与历史记录数量基本无关。
+
+签名随拜访记录持久化（visit_minhash 表），索引在内存中按主键增量加载。
+"""
+
+import os
+import threading
+import zlib
+
+import numpy as np
+
+NUM_PERM   = 128                 # 签名长度
+BANDS      = 16                  # LSH 分段数；每段 8 位，约 0.7 以上的相似度大概率落入同桶
+ROWS       = NUM_PERM // BANDS
+SHINGLE_K  = 5                   # 字符 k-gram 长度
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", 0.85))    # 判为近似重复的相似度
+
+_PRIME = np.uint64(4294967291)   # 小于 2^32 的最大素数；a < 2^31、x < 2^32，乘积不会溢出 uint64
+_rng   = np.random.RandomState(20240601)     # 固定种子：签名需跨进程、跨版本可比
+_A     = _rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64)[:, None]
+_B     = _rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64)[:, None]
+
+
+def shingles(dialogue: list) -> np.ndarray:
+    """对话正文（去空白，句间以 | 分隔）的字符 k-gram 哈希集合"""
+    text = "|".join("".join(d.get("text", "").split()) for d in dialogue if isinstance(d, dict))
+    grams = {text[i:i + SHINGLE_K] for i in range(max(len(text) - SHINGLE_K + 1, 0))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def signature(dialogue: list):
+    """MinHash 签名（uint32 数组）；对话过短没有 k-gram 时返回 None"""
+    x = shingles(dialogue)
+    if not x.size:
+        return None
+    return ((_A * x[None, :] + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """签名逐位相等的比例 ≈ Jaccard 相似度"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def to_blob(sig: np.ndarray) -> bytes:
+    return sig.astype("<u4").tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<u4").astype(np.uint32)
+
+
+class MinHashIndex:
+    """LSH 内存索引：{(段号, 段内容): [键, ...]}；线程安全"""
+
+    def __init__(self):
+        self.signatures = {}
+        self.buckets    = {}
+        self.last_key   = 0          # 已加载的最大主键，供增量加载
+        self.lock       = threading.Lock()
+
+    def add(self, key: int, sig: np.ndarray):
+        with self.lock:
+            if key in self.signatures:
+                return
+            self.signatures[key] = sig
+            for band in range(BANDS):
+                self.buckets.setdefault((band, sig[band * ROWS:(band + 1) * ROWS].tobytes()), []).append(key)
+            self.last_key = max(self.last_key, key)
+
+    def query(self, sig: np.ndarray, threshold: float = NEAR_DUP_THRESHOLD):
+        """相似度不低于 threshold 的最相似记录：(键, 相似度)；没有则 None。相同相似度取较新的记录"""
+        with self.lock:
+            candidates = set()
+            for band in range(BANDS):
+                candidates.update(self.buckets.get((band, sig[band * ROWS:(band + 1) * ROWS].tobytes()), ()))
+            best = None
+            for key in candidates:
+                sim = similarity(sig, self.signatures[key])
+                if sim >= threshold and (best is None or (sim, key) > best[::-1]):
+                    best = (key, sim)
+        return best
+
+    def __len__(self):
+        return len(self.signatures)
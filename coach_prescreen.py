@@ -0,0 +1,181 @@
+"""
+正掌讯 · 文字稿本地预筛
+
+分句完成后、调用 LLM 之前，先用规则快速体检：
+  - 句数、销售 / 客户 / 未识别说话者的占比
+  - 六个拜访阶段的关键词覆盖（多模式匹配，一次扫描）
+  - 对话指纹：与历史记录完全相同的文字稿直接复用上次分析；
+    MinHash 近似重复：稍作修改后重新上传的文字稿同样复用（见 coach_minhash）
+
+据此给出四种处理方式：
+  full       完整 LLM 流水线
+  light      降级：阶段标注改用关键词规则，不生成改进建议（LLM 调用 5 → 3 次）
+  duplicate  重复 / 近似重复上传：复用历史分析，不调用 LLM、不重复入库
+  skip       信息量不足（空文件、测试文本、说话者无法识别）：不调用 LLM、不入库
+
+阈值可用环境变量调整；COACH_PRESCREEN=0 关闭预筛，全部走完整流水线。
+"""
+
+import os
+from collections import Counter
+
+from coach_chunking import STAGE_NAMES
+from coach_text import KeywordMatcher, dialogue_fingerprint
+
+PRESCREEN_ENABLED   = os.environ.get("COACH_PRESCREEN", "1") != "0"
+MIN_SENTENCES       = int(os.environ.get("PRESCREEN_MIN_SENTENCES", 4))        # 少于此句数不分析
+LIGHT_SENTENCES     = int(os.environ.get("PRESCREEN_LIGHT_SENTENCES", 12))     # 少于此句数降级
+MAX_UNKNOWN_RATIO   = float(os.environ.get("PRESCREEN_MAX_UNKNOWN", 0.5))      # 未识别说话者占比上限
+MIN_MINOR_RATIO     = 0.1       # 发言较少一方的占比低于此值视为单向对话，降级
+MIN_STAGE_COVERAGE  = 2         # 命中关键词的阶段数低于此值，降级
+
+DECISION_LABELS = {"full": "完整分析", "light": "降级分析", "duplicate": "重复文稿", "skip": "跳过分析"}
+PERSIST_DECISIONS = {"full", "light"}      # 只有这两类结果入库，避免重复 / 空文稿污染统计
+
+STAGE_KEYWORDS = {
+    1: ["您好", "你好", "我是", "打扰", "老板", "拜访", "上次来"],
+    2: ["请问", "最近", "销量", "卖得", "进货", "顾客多", "需要什么", "平时"],
+    3: ["这款产品", "我们产品", "效果", "成分", "疗效", "毛利", "优势", "介绍一下"],
+    4: ["太贵", "价格", "考虑一下", "别家", "优惠", "担心", "卖不动", "再想想"],
+    5: ["下单", "铺货", "先进", "试试", "订货", "几盒", "签", "合同"],
+    6: ["下次", "再来", "联系", "微信", "回访", "谢谢", "再见"],
+}
+
+STAGE_MATCHER = KeywordMatcher({k: stage for stage, words in STAGE_KEYWORDS.items() for k in words})
+
+
+def prescreen(dialogue: list, store=None, enabled: bool = PRESCREEN_ENABLED) -> dict:
+    """
+    规则体检，返回指标与处理方式：
+      {"decision", "reasons", "sentences", "sales", "customer", "unknown", "unknown_ratio",
+       "stage_hits", "stage_coverage", "fingerprint", "duplicate"}
+    store 为 VisitStore（可选），用于按指纹 / MinHash 查找历史分析；duplicate 为命中的历史记录。
+    """
+    n       = len(dialogue)
+    speaker = Counter(d.get("speaker", "unknown") for d in dialogue)
+    known   = speaker["sales"] + speaker["customer"]
+    hits    = Counter()
+    for d in dialogue:
+        hits.update(STAGE_MATCHER.count_labels(d.get("text", "")))
+    screen = {
+        "sentences":      n,
+        "sales":          speaker["sales"],
+        "customer":       speaker["customer"],
+        "unknown":        speaker["unknown"],
+        "unknown_ratio":  round(speaker["unknown"] / n, 3) if n else 0.0,
+        "stage_hits":     {str(s): hits.get(s, 0) for s in STAGE_NAMES},
+        "stage_coverage": sum(1 for s in STAGE_NAMES if hits.get(s)),
+        "fingerprint":    dialogue_fingerprint(dialogue),
+        "duplicate":      None,
+        "reasons":        [],
+    }
+    reasons = screen["reasons"]
+    if not enabled:
+        screen["decision"] = "full"
+        return screen
+
+    if n < MIN_SENTENCES:
+        reasons.append(f"仅 {n} 句对话")
+    if n and screen["unknown_ratio"] > MAX_UNKNOWN_RATIO:
+        reasons.append(f"{screen['unknown_ratio']:.0%} 的句子无法识别说话者")
+    if n and (not speaker["sales"] or not speaker["customer"]):
+        reasons.append("只有单方发言")
+    if reasons:
+        screen["decision"] = "skip"
+        return screen
+
+    if store is not None:
+        dup = store.find_by_fingerprint(screen["fingerprint"]) or store.find_near_duplicate(dialogue)
+        if dup:
+            same = (f"相似度 {dup['similarity']:.0%}" if "similarity" in dup else "内容相同")
+            reasons.append(f"与历史拜访 {dup['visit_id']}（{dup['visit_date']}）{same}")
+            screen["duplicate"] = dup
+            screen["decision"]  = "duplicate"
+            return screen
+
+    if n < LIGHT_SENTENCES:
+        reasons.append(f"对话较短（{n} 句）")
+    if min(speaker["sales"], speaker["customer"]) / known < MIN_MINOR_RATIO:
+        reasons.append("对话严重单向")
+    if screen["stage_coverage"] < MIN_STAGE_COVERAGE:
+        reasons.append(f"仅覆盖 {screen['stage_coverage']} 个拜访阶段")
+    screen["decision"] = "light" if reasons else "full"
+    return screen
+
+
+def summary_line(screen: dict) -> str:
+    line = (f"预筛：{DECISION_LABELS[screen['decision']]}（{screen['sentences']} 句，"
+            f"未识别 {screen['unknown_ratio']:.0%}，阶段覆盖 {screen['stage_coverage']}/6）")
+    return line + (f" — {'；'.join(screen['reasons'])}" if screen["reasons"] else "")
+
+
+def public_screen(screen: dict) -> dict:
+    """写入结果 JSON 的预筛信息（历史记录只保留编号）"""
+    out = {k: v for k, v in screen.items() if k != "duplicate"}
+    if screen.get("duplicate"):
+        out["duplicate_of"] = screen["duplicate"]["visit_id"]
+        out["similarity"]   = screen["duplicate"].get("similarity", 1.0)
+    return out
+
+
+# ── 规则输出 ──────────────────────────────────────────
+
+def rule_stages(dialogue: list) -> dict:
+    """关键词规则标注阶段：命中最多的阶段，无命中沿用上一句；输出结构同 stage_segmentation"""
+    analysis, current = [], None
+    for i, d in enumerate(dialogue):
+        counts = STAGE_MATCHER.count_labels(d.get("text", ""))
+        if counts:
+            current = max(sorted(counts), key=lambda s: counts[s])
+        item = {"index": i, "speaker": d.get("speaker", "unknown"), "text": d.get("text", "")}
+        if current:
+            item.update({"stage": current, "stage_name": STAGE_NAMES[current]})
+        analysis.append(item)
+    dist = Counter(it["stage"] for it in analysis if "stage" in it)
+    return {
+        "stage_analysis":     analysis,
+        "stage_distribution": {str(s): dist.get(s, 0) for s in STAGE_NAMES},
+        "missing_stages":     [s for s in STAGE_NAMES if not dist.get(s)],
+        "stage_summary":      "（对话较短，阶段按关键词规则标注）",
+    }
+
+
+def light_suggestions(score: dict) -> dict:
+    issue = (score or {}).get("critical_issue", "")
+    return {
+        "script_improvement": [],
+        "next_visit_script":  {},
+        "30day_action_plan":  [],
+        "coaching_summary":   "对话信息量较少，未生成逐句话术建议。" + (f"首要问题：{issue}" if issue else ""),
+    }
+
+
+def skipped_outputs(screen: dict) -> dict:
+    """skip 时各阶段的占位输出，报告页照常渲染并说明原因"""
+    reason = "；".join(screen["reasons"])
+    return {
+        "stages":      {"stage_analysis": [], "stage_distribution": {}, "missing_stages": [],
+                        "stage_summary": ""},
+        "tags":        {},
+        "facts":       {},
+        "score":       {"total_score": 0, "grade": "-", "grade_description": "未分析",
+                        "critical_issue": f"文字稿信息量不足，未进行 AI 分析：{reason}",
+                        "scores": {}, "strengths": [], "weaknesses": []},
+        "suggestions": {"coaching_summary": "请上传完整的拜访对话（销售与客户双方、带说话者标签）后重新分析。"},
+    }
+
+
+def apply_prescreen(screen: dict, graph: dict, dialogue: list) -> dict:
+    """按预筛结果改写阶段依赖图：被省掉的 LLM 阶段换成本地规则 / 历史结果，依赖关系不变"""
+    decision = screen["decision"]
+    if decision == "full":
+        return graph
+    graph = dict(graph)
+    if decision == "light":
+        graph["stages"]      = (lambda: rule_stages(dialogue), [])
+        graph["suggestions"] = (lambda score, facts: light_suggestions(score), ["score", "facts"])
+        return graph
+    preset = screen["duplicate"] if decision == "duplicate" else skipped_outputs(screen)
+    for name in graph:
+        graph[name] = ((lambda value: lambda **_: value)(preset.get(name) or {}), graph[name][1])
+    return graph
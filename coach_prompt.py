@@ -0,0 +1,167 @@
+"""
+正掌讯 · 提示词组装与前缀复用
+
+一次拜访分析的 5 个 LLM 阶段共享同一段稳定内容：系统提示、对话原文、行为事实。
+这里统一组装提示词，让这些内容按固定顺序放在最前面、各阶段的任务说明放在最后，
+同一次分析内的多次调用就拥有逐字相同的前缀，服务端的前缀缓存（DashScope / DeepSeek / OpenAI
+兼容接口的 prompt cache）可以命中。
+
+同时压缩下游阶段的输入：
+  - 事实、标签、阶段结果用紧凑 JSON（无空格）；
+  - 评分阶段不再重复发送逐句阶段标注（其中含对话全文），改为阶段序列摘要 "0-3:1 4-9:2 …"。
+
+STAGE_SCHEMAS 为各阶段输出的顶层字段约定，解析后缺字段时只就缺失字段补问（见 llm_json）。
+
+PromptContext 记录每个阶段的估算输入 token 数，以及与此前调用重复的前缀长度（可被缓存的部分）；
+传入 on_delta 时各阶段走流式输出，模型生成中的文本按阶段回调（见 stage_stream）。
+"""
+
+import hashlib
+import json
+import threading
+
+from coach_chunking import estimate_tokens, render_dialogue, WINDOW_TOKENS
+from llm_client import UsageCollector
+from llm_json import NUMBER
+
+SYS_COACH = ("你是资深销售培训专家，10年以上B2B/B2C销售培训经验，擅长销售对话分析，评估客观专业。"
+             "请严格按要求输出 JSON。")
+
+DIALOGUE_HEADER = "对话（每行：序号|说话者|内容）："
+
+# 各阶段输出的顶层字段与类型（与提示词中的输出示例一致）
+STAGE_SCHEMAS = {
+    "stages":      {"stage_analysis": list, "stage_summary": str},
+    "tags":        {"questioning": dict, "price_sensitivity": dict, "objections": list,
+                    "customer_emotion": dict, "sales_behavior": dict},
+    "facts":       {"basic_stats": dict, "questioning_facts": dict, "needs_discovery": dict,
+                    "product_presentation": dict, "objection_handling": dict, "closing": dict,
+                    "rapport_building": dict},
+    "score":       {"scores": dict, "total_score": NUMBER, "grade": str, "grade_description": str,
+                    "strengths": list, "weaknesses": list, "critical_issue": str},
+    "suggestions": {"improvement_plan": dict, "script_improvement": list, "next_visit_script": dict,
+                    "30day_action_plan": list, "coaching_summary": str},
+}
+
+
+def compact_json(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def stage_digest(stages: dict) -> dict:
+    """阶段结果摘要：分布、缺失阶段、总结，逐句标注压缩为区间序列（不含原文）"""
+    labels = [item.get("stage") if isinstance(item, dict) else None for item in stages.get("stage_analysis") or []]
+    runs, i = [], 0
+    while i < len(labels):
+        j = i
+        while j + 1 < len(labels) and labels[j + 1] == labels[i]:
+            j += 1
+        stage = labels[i] if labels[i] is not None else "?"
+        runs.append(f"{i}-{j}:{stage}" if j > i else f"{i}:{stage}")
+        i = j + 1
+    out = {k: stages[k] for k in ("stage_distribution", "missing_stages", "stage_summary") if k in stages}
+    if runs:
+        out["sequence"] = " ".join(runs)
+    if "error" in stages:
+        out["error"] = stages["error"]
+    return out
+
+
+class PromptContext:
+    """
+    一次拜访分析的提示词上下文（线程安全，供并发阶段共用）。
+
+    build(stage, blocks, task)：blocks 为 [(名称, 文本)]，按给定顺序放在提示词最前面，task 放最后。
+    on_delta(阶段, 已生成文本)：可选，模型生成过程中按阶段回调。
+    usage：本次分析的 LLM 调用记录（各阶段调用时传给 collector），并发分析多份文稿时用量互不混入。
+    use_cache：本次分析是否读取 LLM 响应缓存（如界面上按会话选择强制重新分析）。
+    """
+
+    def __init__(self, dialogue: list = None, system: str = SYS_COACH, on_delta=None, use_cache: bool = True):
+        self.dialogue = dialogue or []
+        self.system   = system
+        self.on_delta = on_delta
+        self.usage    = UsageCollector()
+        self.use_cache = use_cache
+        self._lock    = threading.Lock()
+        self._streams = {}          # 阶段 -> [各次调用已生成文本]（长对话分窗时一个阶段有多次调用）
+        self._seen    = {}          # 前缀哈希 -> [前缀名称, 估算 token 数, 使用次数]
+        self._stages  = {}          # 阶段 -> {"calls", "input_tokens", "reused_tokens"}
+        self._whole   = None
+
+    # ── 共享内容块 ────────────────────────────────────
+
+    def dialogue_block(self, win=None) -> tuple:
+        """对话块：逐句阶段传入窗口；下游阶段用整段对话（超预算保留首尾），只渲染一次，保证各阶段逐字相同"""
+        if win is not None:
+            return ("dialogue", f"{DIALOGUE_HEADER}\n{win.render()}")
+        if self._whole is None:
+            self._whole = f"{DIALOGUE_HEADER}\n{render_dialogue(self.dialogue, budget=WINDOW_TOKENS)}"
+        return ("dialogue", self._whole)
+
+    @staticmethod
+    def json_block(name: str, label: str, obj) -> tuple:
+        return (name, f"{label}：{compact_json(obj)}")
+
+    # ── 组装与统计 ────────────────────────────────────
+
+    def build(self, stage: str, blocks: list, task: str) -> str:
+        blocks = [(n, t) for n, t in blocks if t]
+        prompt = "\n\n".join([t for _, t in blocks] + [task.strip()])
+        self._track(stage, blocks, prompt)
+        return prompt
+
+    def _track(self, stage: str, blocks: list, prompt: str):
+        h = hashlib.sha1(self.system.encode("utf-8"))
+        prefixes, text, names = [], self.system, []
+        for name, block in blocks:
+            h.update(b"\x00" + block.encode("utf-8"))
+            text += "\n\n" + block
+            names.append(name)
+            prefixes.append((h.hexdigest(), "+".join(names), estimate_tokens(text)))
+        total = estimate_tokens(self.system) + estimate_tokens(prompt)
+        with self._lock:
+            reused = 0
+            for key, label, tokens in prefixes:
+                entry = self._seen.setdefault(key, [label, tokens, 0])
+                if entry[2]:
+                    reused = tokens
+                entry[2] += 1
+            s = self._stages.setdefault(stage, {"calls": 0, "input_tokens": 0, "reused_tokens": 0})
+            s["calls"]         += 1
+            s["input_tokens"]  += total
+            s["reused_tokens"] += reused
+
+    def stream(self, stage: str):
+        """本次调用的 on_delta 回调（供 LLM 客户端）；同一阶段各窗口的文本按调用顺序拼接后回调"""
+        if self.on_delta is None:
+            return None
+        with self._lock:
+            parts = self._streams.setdefault(stage, [])
+            parts.append("")
+            slot = len(parts) - 1
+
+        def on_delta(_delta, text):
+            with self._lock:
+                parts[slot] = text
+                joined = "\n".join(p for p in parts if p)
+            self.on_delta(stage, joined)
+        return on_delta
+
+    def report(self) -> dict:
+        """各阶段估算输入 token、可复用前缀 token，以及重复出现的前缀"""
+        with self._lock:
+            stages = {k: dict(v) for k, v in self._stages.items()}
+            shared = [{"prefix": label, "tokens": tokens, "uses": uses}
+                      for label, tokens, uses in self._seen.values() if uses > 1]
+        total  = sum(s["input_tokens"] for s in stages.values())
+        reused = sum(s["reused_tokens"] for s in stages.values())
+        return {"stages": stages, "input_tokens": total, "reused_tokens": reused,
+                "reuse_ratio": round(reused / total, 3) if total else 0.0,
+                "shared_prefixes": sorted(shared, key=lambda p: -p["tokens"])}
+
+
+def usage_line(report: dict) -> str:
+    per_stage = "，".join(f"{k} {v['input_tokens']}" for k, v in report["stages"].items())
+    return (f"提示词输入约 {report['input_tokens']} tokens，其中可复用前缀 {report['reused_tokens']}"
+            f"（{report['reuse_ratio']:.0%}）；{per_stage}")
@@ -0,0 +1,186 @@
+"""
+正掌讯 · 拜访报告渲染
+
+报告外壳模板在导入时编译一次（切分为固定片段 + 插槽），每份报告只写入本次拜访的紧凑 JSON 数据；
+样式和渲染脚本是共享静态资源（static/coach_report.css / .js），按内容哈希命名后随报告目录发布，
+浏览器可长期缓存。
+
+两种输出：
+  - 链接模式（默认）：报告引用同目录 static/ 下的资源，文件小，file:// 直接打开也可用；
+  - 内联模式：样式和脚本内嵌，单文件可下载、可嵌入 Streamlit 组件。
+"""
+
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from coach_http import precompress
+
+ASSET_SRC_DIR = Path(__file__).resolve().parent / "static"
+ASSET_SUBDIR  = "static"          # 报告目录下的静态资源子目录
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"    # 文件名带内容哈希，可永久缓存
+
+DIM_KEYS  = ["opening", "needs", "presentation", "objection", "closing", "communication"]
+STAGE_MAP = {1: "开场", 2: "需求探询", 3: "产品呈现", 4: "异议处理", 5: "成交推进", 6: "收场跟进"}
+SPEAKER_CODE = {"sales": "s", "customer": "c"}
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width,initial-scale=1,maximum-scale=1,user-scalable=no">
+<meta name="apple-mobile-web-app-capable" content="yes">
+<meta name="apple-mobile-web-app-status-bar-style" content="default">
+<title>正掌讯 · {{title}} 拜访报告</title>
+{{css}}
+</head>
+<body>
+<div id="app"></div>
+<script id="report-data" type="application/json">{{payload}}</script>
+<script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
+{{js}}
+</body>
+</html>
+"""
+
+
+def _compile_template(src: str) -> tuple:
+    """模板按 {{插槽}} 切分：返回 (片段列表, 插槽名列表)，渲染时只做一次拼接"""
+    parts = re.split(r"\{\{(\w+)\}\}", src)
+    return parts[0::2], parts[1::2]
+
+
+def _render(compiled: tuple, values: dict) -> str:
+    literals, slots = compiled
+    out = [literals[0]]
+    for slot, lit in zip(slots, literals[1:]):
+        out.append(values[slot])
+        out.append(lit)
+    return "".join(out)
+
+
+class StaticAsset:
+    """共享静态资源：内容、按内容哈希生成的文件名和 ETag"""
+
+    def __init__(self, name: str, content_type: str):
+        stem, suffix = name.rsplit(".", 1)
+        self.text         = (ASSET_SRC_DIR / name).read_text(encoding="utf-8")
+        self.body         = self.text.encode("utf-8")
+        self.digest       = hashlib.sha256(self.body).hexdigest()[:10]
+        self.filename     = f"{stem}.{self.digest}.{suffix}"
+        self.etag         = f'"{self.digest}"'
+        self.content_type = content_type
+
+
+REPORT_CSS   = StaticAsset("coach_report.css", "text/css; charset=utf-8")
+REPORT_JS    = StaticAsset("coach_report.js",  "application/javascript; charset=utf-8")
+ASSETS       = {a.filename: a for a in (REPORT_CSS, REPORT_JS)}
+_COMPILED    = _compile_template(REPORT_TEMPLATE)
+_INLINE_CSS  = f"<style>\n{REPORT_CSS.text}</style>"
+_INLINE_JS   = f"<script>\n{REPORT_JS.text}</script>"
+_LINKED_CSS  = f'<link rel="stylesheet" href="{ASSET_SUBDIR}/{REPORT_CSS.filename}">'
+_LINKED_JS   = f'<script src="{ASSET_SUBDIR}/{REPORT_JS.filename}"></script>'
+_published   = set()
+
+
+def publish_assets(report_dir) -> Path:
+    """把共享资源写入报告目录的 static/ 下（已存在则跳过），返回该目录"""
+    target = Path(report_dir) / ASSET_SUBDIR
+    if str(target) in _published:
+        return target
+    target.mkdir(parents=True, exist_ok=True)
+    for asset in ASSETS.values():
+        path = target / asset.filename
+        if not path.exists():
+            path.write_bytes(asset.body)
+            precompress(path)
+    _published.add(str(target))
+    return target
+
+
+def _stage_no(s):
+    return int(s) if str(s).isdigit() else s
+
+
+def report_payload(result: dict, history: list, team: dict, report_dir=None) -> dict:
+    """报告页所需的本次拜访数据（紧凑结构，键名与 coach_report.js 对应）"""
+    r    = result
+    sc   = r.get("score") or {}
+    scs  = sc.get("scores") or {}
+    tags = r.get("tags") or {}
+    sugg = r.get("suggestions") or {}
+    stg  = r.get("stages") or {}
+    dialogue = r.get("dialogue", [])
+
+    stage_dist = stg.get("stage_distribution") or {}
+    nv   = sugg.get("next_visit_script") or {}
+    objr = nv.get("objection_responses") or {}
+
+    def history_link(hp):
+        # 报告都在同一目录下，历史卡片用文件名相对链接
+        if not hp or not Path(hp).exists():
+            return ""
+        if report_dir and Path(hp).resolve().parent == Path(report_dir).resolve():
+            return Path(hp).name
+        return hp
+
+    return {
+        "rep_name":    r.get("rep_name", ""),
+        "visit_id":    r.get("visit_id", ""),
+        "customer_id": r.get("customer_id", ""),
+        "visit_date":  r.get("visit_date", ""),
+        "total":       sc.get("total_score", 0),
+        "grade":       sc.get("grade", "-"),
+        "grade_description": sc.get("grade_description", ""),
+        "critical_issue":    sc.get("critical_issue", ""),
+        "dims":        [[(scs.get(k) or {}).get("score", 0), (scs.get(k) or {}).get("comment", "")] for k in DIM_KEYS],
+        "strengths":   sc.get("strengths", []),
+        "weaknesses":  sc.get("weaknesses", []),
+        "counts":      [sum(1 for d in dialogue if d["speaker"] == "sales"),
+                        sum(1 for d in dialogue if d["speaker"] == "customer"),
+                        (tags.get("questioning") or {}).get("total_questions", 0),
+                        len(tags.get("objections", []))],
+        "missing":     [STAGE_MAP.get(_stage_no(s), str(s)) for s in stg.get("missing_stages") or []],
+        "stage_data":  [int(stage_dist.get(str(i), 0)) for i in range(1, 7)],
+        "stage_summary": stg.get("stage_summary", ""),
+        "turns":       [[SPEAKER_CODE.get(d.get("speaker"), "u"), d.get("text", ""), d.get("stage_name", "")]
+                        for d in stg.get("stage_analysis", dialogue)],
+        "improve":     [[s.get("original", ""), s.get("issue", ""), s.get("improved", ""), s.get("principle", "")]
+                        for s in sugg.get("script_improvement", [])],
+        "next":        {"opening": nv.get("opening", ""), "questions": nv.get("needs_questions", []),
+                        "price": objr.get("price_objection", ""), "closing": nv.get("closing_statement", "")},
+        "plan":        [[w.get("week"), w.get("focus", ""), w.get("action", ""), w.get("metric", "")]
+                        for w in sugg.get("30day_action_plan", [])],
+        "summary":     sugg.get("coaching_summary", ""),
+        "team": {
+            "visits": team["visits"], "avg": team["avg_score"], "best": team["best_score"],
+            "dims":   [team["dim_avgs"][k] for k in DIM_KEYS],
+            "tags":   [list(t) for t in team["top_tags"]],
+            "trend":  [[t["visit_date"], t["total_score"]] for t in team["trend"]],
+        },
+        "history":     [[h.get("total_score", 0), h["grade"], h.get("rep_name", ""), h.get("visit_date", ""),
+                         h.get("visit_id", ""), history_link(h.get("html_path", ""))] for h in history[:10]],
+    }
+
+
+def _escape_html(s) -> str:
+    return str(s).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def render_report(result: dict, history: list, team: dict, report_dir=None, inline: bool = False) -> str:
+    """
+    生成报告 HTML。report_dir 为报告写入目录（链接模式下在其中发布共享资源）；
+    inline=True 时样式脚本内嵌，供下载和嵌入使用。
+    """
+    if not inline and report_dir is not None:
+        publish_assets(report_dir)
+    payload = json.dumps(report_payload(result, history, team, report_dir),
+                         ensure_ascii=False, separators=(",", ":"))
+    return _render(_COMPILED, {
+        "title":   _escape_html(result.get("rep_name", "")),
+        "css":     _INLINE_CSS if inline else _LINKED_CSS,
+        "js":      _INLINE_JS if inline else _LINKED_JS,
+        # JSON 放在 <script> 中，转义 < 防止正文里的 </script> 提前结束标签
+        "payload": payload.replace("<", "\\u003c"),
+    })
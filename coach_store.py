@@ -0,0 +1,762 @@
+"""
+正掌讯 · 拜访分析数据访问层
+
+visit_analysis / score_trend 两张表的读写统一走这里：
+  - 每个线程复用一个长连接，WAL 模式，读写互不阻塞，多线程 / 多进程写入排队而不报错
+  - 建表、补列、建索引只在进程内首次访问时执行一次
+  - 预编译语句 + executemany 批量写入，单个事务内同时写两张表
+  - score_aggregates 物化团队 / 个人汇总（维度均值、等级分布、标签频次、近期趋势），
+    写入时增量更新，报告直接读取汇总，不再逐条解析历史 JSON
+  - dialogue_hash 记录对话指纹，visit_minhash 记录 MinHash 签名，预筛阶段据此识别重复 / 近似重复上传、
+    复用已有分析
+  - 查询与统计：各维度得分、标签冗余为带索引的列 / visit_tags 表，对话原文和标签进 FTS5 全文索引，
+    按销售、日期、分数、标签、关键词筛选分页，按销售 / 月份 / 等级聚合，均不解析 JSON
+
+命令行：
+  python coach_store.py search --rep R001 --from 2026-07-01 --to 2026-09-30 --dim "objection<5"
+  python coach_store.py tags --from 2026-10-01
+  python coach_store.py stats --group month
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+from coach_text import dialogue_fingerprint
+from coach_minhash import MinHashIndex, signature, to_blob, from_blob, NEAR_DUP_THRESHOLD
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS visit_analysis (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        visit_id TEXT, rep_id TEXT, rep_name TEXT,
+        customer_id TEXT, visit_date TEXT,
+        total_score REAL, grade TEXT,
+        dialogue_json TEXT, stages_json TEXT, tags_json TEXT,
+        facts_json TEXT, score_json TEXT, suggestions_json TEXT,
+        html_path TEXT, created_at TEXT,
+        score_opening REAL, score_needs REAL, score_presentation REAL,
+        score_objection REAL, score_closing REAL, score_communication REAL,
+        tag_labels TEXT, dialogue_hash TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS score_trend (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        visit_id TEXT, rep_id TEXT,
+        score_opening REAL, score_needs REAL, score_presentation REAL,
+        score_objection REAL, score_closing REAL, score_communication REAL,
+        total_score REAL, grade TEXT, visit_date TEXT, created_at TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS score_aggregates (
+        scope TEXT, key TEXT, name TEXT,
+        visits INTEGER, score_sum REAL, best_score REAL,
+        dim_sums TEXT, grade_counts TEXT, tag_counts TEXT, trend TEXT,
+        last_visit_date TEXT, updated_at TEXT,
+        PRIMARY KEY (scope, key)
+    )""",
+    # 每次拜访的标签（"类别:取值"），按标签 / 日期统计频次
+    """CREATE TABLE IF NOT EXISTS visit_tags (
+        visit_pk INTEGER, tag TEXT, visit_date TEXT, rep_id TEXT
+    )""",
+    # 对话原文与标签全文索引；rowid 即 visit_analysis.id。trigram 分词支持中文任意子串检索
+    """CREATE VIRTUAL TABLE IF NOT EXISTS visit_fts USING fts5(dialogue, tags, tokenize='trigram')""",
+    # 对话 MinHash 签名（近似重复检测），visit_pk 即 visit_analysis.id
+    """CREATE TABLE IF NOT EXISTS visit_minhash (
+        visit_pk INTEGER PRIMARY KEY, signature BLOB
+    )""",
+]
+
+MIGRATIONS = {
+    "html_path":        "ALTER TABLE visit_analysis ADD COLUMN html_path TEXT DEFAULT ''",
+    "customer_id":      "ALTER TABLE visit_analysis ADD COLUMN customer_id TEXT DEFAULT ''",
+    "suggestions_json": "ALTER TABLE visit_analysis ADD COLUMN suggestions_json TEXT DEFAULT '{}'",
+    "tags_json":        "ALTER TABLE visit_analysis ADD COLUMN tags_json TEXT DEFAULT '{}'",
+    **{f"score_{d}": f"ALTER TABLE visit_analysis ADD COLUMN score_{d} REAL"
+       for d in ("opening", "needs", "presentation", "objection", "closing", "communication")},
+    "tag_labels":       "ALTER TABLE visit_analysis ADD COLUMN tag_labels TEXT",
+    "dialogue_hash":    "ALTER TABLE visit_analysis ADD COLUMN dialogue_hash TEXT",
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_visit_created    ON visit_analysis(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_rep        ON visit_analysis(rep_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_date       ON visit_analysis(visit_date)",
+    "CREATE INDEX IF NOT EXISTS idx_trend_rep_date   ON score_trend(rep_id, visit_date)",
+    "CREATE INDEX IF NOT EXISTS idx_trend_created    ON score_trend(created_at)",
+    # 统计用覆盖索引：分组聚合只读索引，不触及含对话 JSON 的宽行
+    "CREATE INDEX IF NOT EXISTS idx_visit_metrics    ON visit_analysis(rep_id, visit_date, grade, total_score, "
+    "score_opening, score_needs, score_presentation, score_objection, score_closing, score_communication, "
+    "rep_name, customer_id)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_score      ON visit_analysis(total_score)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_objection  ON visit_analysis(score_objection)",
+    "CREATE INDEX IF NOT EXISTS idx_vtags_date_tag   ON visit_tags(visit_date, tag)",
+    "CREATE INDEX IF NOT EXISTS idx_vtags_tag_date   ON visit_tags(tag, visit_date, rep_id, visit_pk)",
+    "CREATE INDEX IF NOT EXISTS idx_vtags_visit      ON visit_tags(visit_pk)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_hash       ON visit_analysis(dialogue_hash)",
+]
+
+DEFAULT_DB_PATH = "sales_ai.db"   # 各版本语音教练应用与命令行共用的业务库
+
+SCORE_DIMS = ["opening", "needs", "presentation", "objection", "closing", "communication"]
+TREND_KEEP = 8          # 汇总中保留的近期得分点数
+TEAM_KEY   = "all"      # 目前只有一个团队：全部销售
+
+PAGE_SIZE_MAX = 200
+SORT_COLUMNS  = {"visit_date": "visit_date", "total_score": "total_score", "created_at": "created_at",
+                 **{d: f"score_{d}" for d in SCORE_DIMS}}
+GROUP_COLUMNS = {"rep": "v.rep_id", "month": "substr(v.visit_date,1,7)", "grade": "v.grade", "customer": "v.customer_id"}
+DIM_OPS       = {"<", "<=", ">", ">=", "="}
+
+INSERT_VISIT = """INSERT INTO visit_analysis
+    (visit_id,rep_id,rep_name,customer_id,visit_date,total_score,grade,
+     dialogue_json,stages_json,tags_json,facts_json,score_json,suggestions_json,html_path,created_at,
+     score_opening,score_needs,score_presentation,score_objection,score_closing,score_communication,tag_labels,
+     dialogue_hash)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""
+
+INSERT_TREND = """INSERT INTO score_trend
+    (visit_id,rep_id,score_opening,score_needs,score_presentation,
+     score_objection,score_closing,score_communication,total_score,grade,visit_date,created_at)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"""
+
+
+class VisitStore:
+    """线程安全：每个线程持有自己的连接（threading.local）"""
+
+    def __init__(self, db_path: str):
+        self.db_path  = db_path
+        self._local   = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+        self._minhash  = MinHashIndex()
+
+    # ── 连接与迁移 ────────────────────────────────────
+
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        if not self._migrated:
+            self.migrate()
+        return conn
+
+    def migrate(self):
+        """建表、补齐旧库缺失列、建索引；进程内只执行一次"""
+        with self._migrate_lock:
+            if self._migrated:
+                return
+            conn = self._local.conn
+            with conn:
+                for sql in SCHEMA:
+                    conn.execute(sql)
+                existing = {row[1] for row in conn.execute("PRAGMA table_info(visit_analysis)").fetchall()}
+                for col, sql in MIGRATIONS.items():
+                    if col not in existing:
+                        conn.execute(sql)
+                for sql in INDEXES:
+                    conn.execute(sql)
+                # 旧库升级：冗余列为空的历史记录补齐查询索引
+                if conn.execute("SELECT 1 FROM visit_analysis "
+                                "WHERE tag_labels IS NULL OR dialogue_hash IS NULL LIMIT 1").fetchone():
+                    self._backfill_search_index(conn)
+                if conn.execute("SELECT 1 FROM visit_analysis v WHERE NOT EXISTS "
+                                "(SELECT 1 FROM visit_minhash m WHERE m.visit_pk = v.id) LIMIT 1").fetchone():
+                    self._backfill_minhash(conn)
+                need_backfill = (
+                    conn.execute("SELECT 1 FROM score_aggregates LIMIT 1").fetchone() is None and
+                    conn.execute("SELECT 1 FROM visit_analysis LIMIT 1").fetchone() is not None)
+                if need_backfill:
+                    self._rebuild_aggregates(conn)
+            self._migrated = True
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ── 写入 ──────────────────────────────────────────
+
+    @staticmethod
+    def _rows(record: dict, now: str) -> tuple:
+        score       = record.get("score") or {}
+        total_score = score.get("total_score", 0)
+        grade       = score.get("grade", "N/A")
+        visit_date  = record.get("visit_date") or datetime.now().strftime("%Y-%m-%d")
+        visit_row = (
+            record["visit_id"], record["rep_id"], record["rep_name"], record.get("customer_id", ""),
+            visit_date, total_score, grade,
+            json.dumps(record.get("dialogue"),    ensure_ascii=False),
+            json.dumps(record.get("stages"),      ensure_ascii=False),
+            json.dumps(record.get("tags"),        ensure_ascii=False),
+            json.dumps(record.get("facts"),       ensure_ascii=False),
+            json.dumps(score,                     ensure_ascii=False),
+            json.dumps(record.get("suggestions"), ensure_ascii=False),
+            record.get("html_path", ""), now)
+        sc = score.get("scores", {})
+        trend_row = (record["visit_id"], record["rep_id"],
+                     *[(sc.get(d) or {}).get("score", 0) for d in SCORE_DIMS],
+                     total_score, grade, visit_date, now)
+        return visit_row, trend_row
+
+    def save_many(self, records: list) -> list:
+        """单个事务批量写入多条分析结果，返回 visit_analysis 行 ID 列表"""
+        now  = datetime.now().isoformat()
+        conn = self.conn()
+        ids  = []
+        with conn:
+            for record in records:
+                visit_row, trend_row = self._rows(record, now)
+                visit = _visit_summary(record.get("score") or {}, record.get("tags") or {}, visit_row[4])
+                visit_row += (*[visit["dims"][d] for d in SCORE_DIMS], _join_labels(visit["tags"]),
+                              dialogue_fingerprint(record.get("dialogue") or []))
+                pk = conn.execute(INSERT_VISIT, visit_row).lastrowid
+                ids.append(pk)
+                conn.execute(INSERT_TREND, trend_row)
+                self._index_visit(conn, pk, record["rep_id"], visit_row[4], visit["tags"],
+                                  record.get("dialogue") or [], record.get("tags") or {})
+                self._store_minhash(conn, pk, record.get("dialogue") or [])
+                # INSERT 之后已持有写锁，汇总的读-改-写不会与其他写入交错
+                self._apply_visit(conn, visit, record["rep_id"], record["rep_name"], now)
+        return ids
+
+    @staticmethod
+    def _index_visit(conn, pk: int, rep_id: str, visit_date: str, labels: list, dialogue: list, tags: dict):
+        conn.executemany("INSERT INTO visit_tags (visit_pk, tag, visit_date, rep_id) VALUES (?,?,?,?)",
+                         [(pk, t, visit_date, rep_id) for t in labels])
+        conn.execute("INSERT INTO visit_fts (rowid, dialogue, tags) VALUES (?,?,?)",
+                     (pk, _dialogue_text(dialogue), " ".join(labels + _text_leaves(tags))))
+
+    def _backfill_search_index(self, conn):
+        """为冗余列为空的记录补齐维度得分、标签、对话指纹和全文索引"""
+        cur = conn.execute("SELECT id, rep_id, visit_date, score_json, tags_json, dialogue_json "
+                           "FROM visit_analysis WHERE tag_labels IS NULL OR dialogue_hash IS NULL")
+        for pk, rep_id, visit_date, score_j, tags_j, dialogue_j in cur.fetchall():
+            score, tags, dialogue = _loads(score_j, {}), _loads(tags_j, {}), _loads(dialogue_j, [])
+            dialogue = dialogue if isinstance(dialogue, list) else []
+            visit = _visit_summary(score if isinstance(score, dict) else {},
+                                   tags if isinstance(tags, dict) else {}, visit_date or "")
+            conn.execute(
+                "UPDATE visit_analysis SET score_opening=?, score_needs=?, score_presentation=?, "
+                "score_objection=?, score_closing=?, score_communication=?, tag_labels=?, dialogue_hash=? "
+                "WHERE id=?",
+                (*[visit["dims"][d] for d in SCORE_DIMS], _join_labels(visit["tags"]),
+                 dialogue_fingerprint([d for d in dialogue if isinstance(d, dict)]), pk))
+            conn.execute("DELETE FROM visit_tags WHERE visit_pk=?", (pk,))
+            conn.execute("DELETE FROM visit_fts WHERE rowid=?", (pk,))
+            self._index_visit(conn, pk, rep_id, visit_date or "", visit["tags"], dialogue,
+                              tags if isinstance(tags, dict) else {})
+
+    @staticmethod
+    def _store_minhash(conn, pk: int, dialogue: list):
+        sig = signature(dialogue)
+        conn.execute("INSERT OR REPLACE INTO visit_minhash (visit_pk, signature) VALUES (?,?)",
+                     (pk, to_blob(sig) if sig is not None else None))
+
+    def _backfill_minhash(self, conn):
+        """为没有签名的历史记录计算 MinHash"""
+        cur = conn.execute("SELECT v.id, v.dialogue_json FROM visit_analysis v WHERE NOT EXISTS "
+                           "(SELECT 1 FROM visit_minhash m WHERE m.visit_pk = v.id)")
+        for pk, dialogue_j in cur.fetchall():
+            dialogue = _loads(dialogue_j, [])
+            self._store_minhash(conn, pk, dialogue if isinstance(dialogue, list) else [])
+
+    # ── 汇总 ──────────────────────────────────────────
+
+    def _apply_visit(self, conn, visit: dict, rep_id: str, rep_name: str, now: str):
+        for scope, key, name in (("team", TEAM_KEY, ""), ("rep", rep_id, rep_name or rep_id)):
+            row = conn.execute(
+                "SELECT visits, score_sum, best_score, dim_sums, grade_counts, tag_counts, trend "
+                "FROM score_aggregates WHERE scope=? AND key=?", (scope, key)).fetchone()
+            agg = _agg_from_row(row)
+            _accumulate(agg, visit)
+            self._store_agg(conn, scope, key, name, agg, now)
+
+    @staticmethod
+    def _store_agg(conn, scope: str, key: str, name: str, agg: dict, now: str):
+        conn.execute(
+            "INSERT OR REPLACE INTO score_aggregates (scope,key,name,visits,score_sum,best_score,"
+            "dim_sums,grade_counts,tag_counts,trend,last_visit_date,updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+            (scope, key, name, agg["visits"], agg["score_sum"], agg["best_score"],
+             json.dumps(agg["dim_sums"]), json.dumps(agg["grade_counts"], ensure_ascii=False),
+             json.dumps(agg["tag_counts"], ensure_ascii=False), json.dumps(agg["trend"], ensure_ascii=False),
+             agg["trend"][-1][0] if agg["trend"] else "", now))
+
+    def _rebuild_aggregates(self, conn):
+        """按历史记录一次性重建汇总（旧库升级时执行），在内存中累计后整体写回"""
+        conn.execute("DELETE FROM score_aggregates")
+        now  = datetime.now().isoformat()
+        aggs = {}
+        cur  = conn.execute(
+            "SELECT rep_id, rep_name, visit_date, score_json, tags_json FROM visit_analysis ORDER BY created_at, id")
+        for rep_id, rep_name, visit_date, score_j, tags_j in cur:
+            try:
+                score = json.loads(score_j or "{}") or {}
+                tags  = json.loads(tags_j or "{}") or {}
+            except Exception:
+                score, tags = {}, {}
+            visit = _visit_summary(score, tags, visit_date or "")
+            for scope, key, name in (("team", TEAM_KEY, ""), ("rep", rep_id, rep_name or rep_id)):
+                entry = aggs.setdefault((scope, key), [name, _agg_from_row(None)])
+                entry[0] = name
+                _accumulate(entry[1], visit)
+        for (scope, key), (name, agg) in aggs.items():
+            self._store_agg(conn, scope, key, name, agg, now)
+
+    def rebuild_aggregates(self):
+        conn = self.conn()
+        with conn:
+            self._rebuild_aggregates(conn)
+
+    def team_summary(self) -> dict:
+        return self._summary("team", TEAM_KEY)
+
+    def rep_summary(self, rep_id: str) -> dict:
+        return self._summary("rep", rep_id)
+
+    def rep_summaries(self) -> list:
+        keys = [r[0] for r in self.conn().execute(
+            "SELECT key FROM score_aggregates WHERE scope='rep' ORDER BY visits DESC").fetchall()]
+        return [self._summary("rep", k) for k in keys]
+
+    def _summary(self, scope: str, key: str) -> dict:
+        row = self.conn().execute(
+            "SELECT name, visits, score_sum, best_score, dim_sums, grade_counts, tag_counts, trend, last_visit_date "
+            "FROM score_aggregates WHERE scope=? AND key=?", (scope, key)).fetchone()
+        if not row:
+            return {"key": key, "name": "", "visits": 0, "avg_score": 0, "best_score": 0,
+                    "dim_avgs": {d: 0 for d in SCORE_DIMS}, "grade_counts": {}, "top_tags": [],
+                    "trend": [], "last_visit_date": ""}
+        name, visits, score_sum, best, dim_sums, grades, tag_counts, trend, last_date = row
+        dim_sums, tag_counts = json.loads(dim_sums), json.loads(tag_counts)
+        return {
+            "key":             key,
+            "name":            name,
+            "visits":          visits,
+            "avg_score":       round(score_sum / visits, 1) if visits else 0,
+            "best_score":      best,
+            "dim_avgs":        {d: round(dim_sums.get(d, 0) / visits, 1) if visits else 0 for d in SCORE_DIMS},
+            "grade_counts":    json.loads(grades),
+            "top_tags":        sorted(tag_counts.items(), key=lambda kv: -kv[1])[:10],
+            "trend":           [{"visit_date": d, "total_score": s} for d, s in json.loads(trend)],
+            "last_visit_date": last_date or "",
+        }
+
+    def save(self, record: dict) -> int:
+        return self.save_many([record])[0]
+
+    # ── 查询 ──────────────────────────────────────────
+
+    def load_history(self, limit: int = 20) -> list:
+        """最近 limit 次拜访（走 created_at 索引）"""
+        rows = self.conn().execute("""
+            SELECT visit_id, rep_id, rep_name, visit_date, total_score, grade,
+                   score_json, tags_json, html_path
+            FROM visit_analysis ORDER BY created_at DESC LIMIT ?
+        """, (limit,)).fetchall()
+        out = []
+        for vid, rid, rname, vdate, tscore, grade, score_j, tags_j, hpath in rows:
+            try:
+                scores = json.loads(score_j or "{}").get("scores", {})
+            except Exception:
+                scores = {}
+            try:
+                tags = json.loads(tags_j or "{}")
+            except Exception:
+                tags = {}
+            out.append({
+                "visit_id":    vid,
+                "rep_id":      rid,
+                "rep_name":    rname or rid,
+                "visit_date":  vdate or "",
+                "total_score": tscore or 0,
+                "grade":       grade or "-",
+                "scores":      scores,
+                "tags":        tags,
+                "html_path":   hpath or "",
+            })
+        return out
+
+    def load_recent_visits(self, limit: int = 10) -> list:
+        """最近拜访的基本信息（不解析 JSON 列），用于报告中的历史记录卡片"""
+        rows = self.conn().execute("""
+            SELECT visit_id, rep_id, rep_name, visit_date, total_score, grade, html_path
+            FROM visit_analysis ORDER BY created_at DESC LIMIT ?
+        """, (limit,)).fetchall()
+        return [{"visit_id": vid, "rep_id": rid, "rep_name": rname or rid, "visit_date": vdate or "",
+                 "total_score": tscore or 0, "grade": grade or "-", "html_path": hpath or ""}
+                for vid, rid, rname, vdate, tscore, grade, hpath in rows]
+
+    def load_rep_trend(self, rep_id: str, limit: int = 30) -> list:
+        """某销售最近 limit 次拜访的各维度得分，按拜访日期升序"""
+        rows = self.conn().execute("""
+            SELECT visit_id, visit_date, score_opening, score_needs, score_presentation,
+                   score_objection, score_closing, score_communication, total_score, grade
+            FROM score_trend WHERE rep_id=? ORDER BY visit_date DESC, id DESC LIMIT ?
+        """, (rep_id, limit)).fetchall()
+        keys = ["visit_id", "visit_date", *SCORE_DIMS, "total_score", "grade"]
+        return [dict(zip(keys, r)) for r in reversed(rows)]
+
+    def find_by_fingerprint(self, fingerprint: str):
+        """对话指纹相同的最近一次分析（含各阶段输出），没有则返回 None"""
+        return self._load_analysis("dialogue_hash=? ORDER BY id DESC", (fingerprint,))
+
+    def find_near_duplicate(self, dialogue: list, threshold: float = NEAR_DUP_THRESHOLD):
+        """
+        MinHash 估计相似度不低于 threshold 的最相似历史分析，附 "similarity" 字段；没有则返回 None。
+        内存索引按主键增量追平数据库（含其他进程写入的记录），查询只比较 LSH 同桶候选。
+        """
+        sig = signature(dialogue)
+        if sig is None:
+            return None
+        index = self._minhash
+        rows = self.conn().execute(
+            "SELECT visit_pk, signature FROM visit_minhash WHERE visit_pk > ? AND signature IS NOT NULL",
+            (index.last_key,)).fetchall()
+        for pk, blob in rows:
+            index.add(pk, from_blob(blob))
+        hit = index.query(sig, threshold)
+        if hit is None:
+            return None
+        record = self._load_analysis("id=?", (hit[0],))
+        if record is not None:
+            record["similarity"] = round(hit[1], 3)
+        return record
+
+    def _load_analysis(self, where: str, args: tuple):
+        row = self.conn().execute(f"""
+            SELECT visit_id, rep_id, rep_name, visit_date, stages_json, tags_json, facts_json,
+                   score_json, suggestions_json, html_path
+            FROM visit_analysis WHERE {where} LIMIT 1
+        """, args).fetchone()
+        if row is None:
+            return None
+        vid, rid, rname, vdate, stages_j, tags_j, facts_j, score_j, sugg_j, hpath = row
+        return {"visit_id": vid, "rep_id": rid, "rep_name": rname or rid, "visit_date": vdate or "",
+                "stages": _loads(stages_j, {}), "tags": _loads(tags_j, {}), "facts": _loads(facts_j, {}),
+                "score": _loads(score_j, {}), "suggestions": _loads(sugg_j, {}), "html_path": hpath or ""}
+
+    # ── 检索与统计 ────────────────────────────────────
+
+    def _where(self, query: dict) -> tuple:
+        """
+        query 键（均可选）：rep_id, customer_id, grade, date_from, date_to（含端点，YYYY-MM-DD）,
+        min_score, max_score, dims=[(维度, 运算符, 值)], tag（完整标签，如 "异议:价格异议"）, text（全文关键词）
+        """
+        conds, args = [], []
+        for key, col in (("rep_id", "v.rep_id"), ("customer_id", "v.customer_id"), ("grade", "v.grade")):
+            if query.get(key):
+                conds.append(f"{col} = ?")
+                args.append(query[key])
+        if query.get("date_from"):
+            conds.append("v.visit_date >= ?")
+            args.append(query["date_from"])
+        if query.get("date_to"):
+            conds.append("v.visit_date <= ?")
+            args.append(query["date_to"])
+        if query.get("min_score") is not None:
+            conds.append("v.total_score >= ?")
+            args.append(float(query["min_score"]))
+        if query.get("max_score") is not None:
+            conds.append("v.total_score <= ?")
+            args.append(float(query["max_score"]))
+        for dim, op, value in query.get("dims") or []:
+            if dim not in SCORE_DIMS or op not in DIM_OPS:
+                raise ValueError(f"不支持的维度条件：{dim}{op}{value}")
+            conds.append(f"v.score_{dim} {op} ?")
+            args.append(float(value))
+        if query.get("tag"):
+            # 日期、销售条件同时下推到标签子查询，走 (tag, visit_date, rep_id) 索引缩小候选集
+            sub, sub_args = ["tag = ?"], [query["tag"]]
+            for key, cond in (("date_from", "visit_date >= ?"), ("date_to", "visit_date <= ?"), ("rep_id", "rep_id = ?")):
+                if query.get(key):
+                    sub.append(cond)
+                    sub_args.append(query[key])
+            conds.append(f"v.id IN (SELECT visit_pk FROM visit_tags WHERE {' AND '.join(sub)})")
+            args.extend(sub_args)
+        if query.get("text"):
+            fts_sql, fts_args = _fts_condition(query["text"])
+            if fts_sql:
+                conds.append(f"v.id IN ({fts_sql})")
+                args.extend(fts_args)
+        return (" WHERE " + " AND ".join(conds)) if conds else "", args
+
+    def search_visits(self, query: dict = None, sort: str = "visit_date", desc: bool = True,
+                      page: int = 1, page_size: int = 20) -> dict:
+        """按条件分页检索拜访；返回 {"total", "page", "page_size", "pages", "items"}，条目不含大字段"""
+        query     = query or {}
+        order     = SORT_COLUMNS.get(sort)
+        if order is None:
+            raise ValueError(f"不支持的排序字段：{sort}")
+        page      = max(int(page), 1)
+        page_size = min(max(int(page_size), 1), PAGE_SIZE_MAX)
+        where, args = self._where(query)
+        conn  = self.conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM visit_analysis v{where}", args).fetchone()[0]
+        rows  = conn.execute(f"""
+            SELECT v.id, v.visit_id, v.rep_id, v.rep_name, v.customer_id, v.visit_date, v.total_score, v.grade,
+                   {", ".join(f"v.score_{d}" for d in SCORE_DIMS)}, v.tag_labels, v.html_path
+            FROM visit_analysis v{where}
+            ORDER BY v.{order} {"DESC" if desc else "ASC"}, v.id {"DESC" if desc else "ASC"}
+            LIMIT ? OFFSET ?""", [*args, page_size, (page - 1) * page_size]).fetchall()
+        items = []
+        for r in rows:
+            items.append({
+                "id": r[0], "visit_id": r[1], "rep_id": r[2], "rep_name": r[3] or r[2], "customer_id": r[4] or "",
+                "visit_date": r[5] or "", "total_score": r[6] or 0, "grade": r[7] or "-",
+                "scores": dict(zip(SCORE_DIMS, r[8:14])),
+                "tags": r[14].split("\n") if r[14] else [], "html_path": r[15] or "",
+            })
+        return {"total": total, "page": page, "page_size": page_size,
+                "pages": (total + page_size - 1) // page_size, "items": items}
+
+    def tag_stats(self, query: dict = None, limit: int = 20) -> list:
+        """标签频次（按拜访计），可叠加与 search_visits 相同的筛选条件"""
+        query = query or {}
+        where, args = self._where(query)
+        if where:
+            sql = (f"SELECT t.tag, COUNT(*) AS n FROM visit_tags t WHERE t.visit_pk IN "
+                   f"(SELECT v.id FROM visit_analysis v{where}) GROUP BY t.tag ORDER BY n DESC, t.tag LIMIT ?")
+        else:
+            sql = "SELECT tag, COUNT(*) AS n FROM visit_tags GROUP BY tag ORDER BY n DESC, tag LIMIT ?"
+        return [{"tag": t, "visits": n} for t, n in self.conn().execute(sql, [*args, limit]).fetchall()]
+
+    def score_stats(self, query: dict = None, group: str = "rep") -> list:
+        """按 rep / month / grade / customer 分组的拜访数、平均分、各维度均值"""
+        col = GROUP_COLUMNS.get(group)
+        if col is None:
+            raise ValueError(f"不支持的分组：{group}")
+        where, args = self._where(query or {})
+        dims = ", ".join(f"AVG(v.score_{d})" for d in SCORE_DIMS)
+        rows = self.conn().execute(f"""
+            SELECT {col} AS g,
+                   {"MAX(v.rep_name)" if group == "rep" else "''"},
+                   COUNT(*), AVG(v.total_score), MIN(v.total_score), MAX(v.total_score), {dims}
+            FROM visit_analysis v{where}
+            GROUP BY g ORDER BY g""", args).fetchall()
+        return [{"group": g or "", "name": name or g or "", "visits": n,
+                 "avg_score": round(avg or 0, 1), "min_score": lo or 0, "max_score": hi or 0,
+                 "dim_avgs": {d: round(x or 0, 1) for d, x in zip(SCORE_DIMS, dim_avgs)}}
+                for g, name, n, avg, lo, hi, *dim_avgs in rows]
+
+
+def _fts_condition(text: str) -> tuple:
+    """
+    关键词（空格分隔，全部命中）转为 visit_fts 子查询。
+    trigram 分词只能索引 3 字及以上的片段；更短的词退化为 instr 扫描全文表。
+    没有有效关键词（空白）时返回 (None, [])，不加条件。
+    """
+    terms = [t for t in text.split() if t]
+    if not terms:
+        return None, []
+    long_terms  = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    conds, args = [], []
+    if long_terms:
+        conds.append("visit_fts MATCH ?")
+        args.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms))
+    for t in short_terms:
+        conds.append("(instr(dialogue, ?) > 0 OR instr(tags, ?) > 0)")
+        args.extend([t, t])
+    return "SELECT rowid FROM visit_fts WHERE " + " AND ".join(conds), args
+
+
+def _join_labels(labels: list) -> str:
+    return "\n".join(labels)
+
+
+def _dialogue_text(dialogue: list) -> str:
+    return "\n".join(d.get("text", "") for d in dialogue if isinstance(d, dict))
+
+
+def _text_leaves(obj) -> list:
+    """标签结构中的全部文本值（异议内容、关键时刻等），进全文索引"""
+    if isinstance(obj, str):
+        return [obj] if obj.strip() else []
+    if isinstance(obj, dict):
+        return [s for v in obj.values() for s in _text_leaves(v)]
+    if isinstance(obj, list):
+        return [s for v in obj for s in _text_leaves(v)]
+    return []
+
+
+def _loads(raw, default):
+    try:
+        value = json.loads(raw) if raw else default
+    except Exception:
+        return default
+    return default if value is None else value
+
+
+def _agg_from_row(row) -> dict:
+    if not row:
+        return {"visits": 0, "score_sum": 0.0, "best_score": 0, "dim_sums": {d: 0 for d in SCORE_DIMS},
+                "grade_counts": {}, "tag_counts": {}, "trend": []}
+    visits, score_sum, best, dim_sums, grades, tag_counts, trend = row
+    return {"visits": visits, "score_sum": score_sum, "best_score": best, "dim_sums": json.loads(dim_sums),
+            "grade_counts": json.loads(grades), "tag_counts": json.loads(tag_counts), "trend": json.loads(trend)}
+
+
+def _accumulate(agg: dict, visit: dict):
+    """把一次拜访累加进汇总（原地修改）"""
+    agg["visits"]     += 1
+    agg["score_sum"]  += visit["total_score"]
+    agg["best_score"]  = max(agg["best_score"], visit["total_score"])
+    for d in SCORE_DIMS:
+        agg["dim_sums"][d] = agg["dim_sums"].get(d, 0) + visit["dims"][d]
+    agg["grade_counts"][visit["grade"]] = agg["grade_counts"].get(visit["grade"], 0) + 1
+    for t in visit["tags"]:
+        agg["tag_counts"][t] = agg["tag_counts"].get(t, 0) + 1
+    agg["trend"] = (agg["trend"] + [[visit["visit_date"], visit["total_score"]]])[-TREND_KEEP:]
+
+
+def _visit_summary(score: dict, tags: dict, visit_date: str) -> dict:
+    """从单次评分 / 标签中提取汇总所需的字段；标签统一成 "类别:取值" 形式计数"""
+    sc = score.get("scores") or {}
+    labels = set()
+    for obj in tags.get("objections") or []:
+        if isinstance(obj, dict) and obj.get("type"):
+            labels.add(f"异议:{obj['type']}")
+    if (tags.get("price_sensitivity") or {}).get("mentioned"):
+        labels.add("提及价格")
+    emotion = (tags.get("customer_emotion") or {}).get("overall")
+    if emotion:
+        labels.add(f"客户情绪:{emotion}")
+    quality = (tags.get("questioning") or {}).get("question_quality")
+    if quality:
+        labels.add(f"提问质量:{quality}")
+
+    def num(v):
+        try:
+            return float(v or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    return {
+        "total_score": num(score.get("total_score")),
+        "grade":       score.get("grade") or "N/A",
+        "dims":        {d: num((sc.get(d) or {}).get("score")) for d in SCORE_DIMS},
+        "tags":        sorted(labels),
+        "visit_date":  visit_date,
+    }
+
+
+_stores      = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str) -> VisitStore:
+    """同一数据库路径在进程内共享一个 VisitStore"""
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = VisitStore(db_path)
+        return _stores[db_path]
+
+
+# ── 命令行 ────────────────────────────────────────────
+
+def parse_dim_filter(expr: str) -> tuple:
+    """"objection<5" → ("objection", "<", 5.0)"""
+    m = re.fullmatch(r"\s*(\w+)\s*(<=|>=|<|>|=)\s*([\d.]+)\s*", expr)
+    if not m:
+        raise ValueError(f"维度条件格式应为 维度<数值，例如 objection<5：{expr}")
+    return m.group(1), m.group(2), float(m.group(3))
+
+
+def _first_given(params: dict, *names):
+    """按顺序取第一个给出的参数值：空串视为未给出，0 / 0.0 是有效值"""
+    for name in names:
+        value = params.get(name)
+        if value is not None and value != "":
+            return value
+    return None
+
+
+def query_from_params(params: dict) -> dict:
+    """HTTP 查询参数 / 命令行参数（{名称: 字符串}）转为 _where 的 query"""
+    query = {}
+    for key, name in (("rep_id", "rep"), ("customer_id", "customer"), ("grade", "grade"),
+                      ("date_from", "from"), ("date_to", "to"), ("tag", "tag"), ("text", "q")):
+        value = _first_given(params, name, key)
+        if isinstance(value, str):
+            value = value.strip()
+        if value:
+            query[key] = value
+    for key, name in (("min_score", "min"), ("max_score", "max")):
+        value = _first_given(params, name, key)
+        if value not in (None, ""):
+            query[key] = float(value)
+    dims = params.get("dim") or []
+    query["dims"] = [parse_dim_filter(d) for d in ([dims] if isinstance(dims, str) else dims)]
+    return query
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="拜访记录检索与统计")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"数据库路径（默认 {DEFAULT_DB_PATH}）")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name, help_text in (("search", "分页检索拜访"), ("tags", "标签频次"), ("stats", "分组评分统计")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--rep");  p.add_argument("--customer"); p.add_argument("--grade")
+        p.add_argument("--from"); p.add_argument("--to")
+        p.add_argument("--min", type=float); p.add_argument("--max", type=float)
+        p.add_argument("--dim", action="append", default=[], help='维度条件，可重复，如 "objection<5"')
+        p.add_argument("--tag"); p.add_argument("-q", help="对话 / 标签关键词（空格分隔，全部命中）")
+        p.add_argument("--json", action="store_true", help="输出 JSON")
+        if name == "search":
+            p.add_argument("--sort", default="visit_date", choices=sorted(SORT_COLUMNS))
+            p.add_argument("--asc", action="store_true")
+            p.add_argument("--page", type=int, default=1)
+            p.add_argument("--page-size", type=int, default=20)
+        elif name == "tags":
+            p.add_argument("--limit", type=int, default=20)
+        else:
+            p.add_argument("--group", default="rep", choices=sorted(GROUP_COLUMNS))
+    args  = parser.parse_args(argv)
+    store = get_store(args.db)
+    try:
+        query = query_from_params(vars(args))
+        store._where(query)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        _run_command(store, args, query)
+    except sqlite3.OperationalError as e:
+        parser.error(f"查询失败：{e}")
+
+
+def _run_command(store, args, query):
+    """执行子命令并输出结果"""
+    if args.cmd == "search":
+        data = store.search_visits(query, args.sort, not args.asc, args.page, args.page_size)
+        if args.json:
+            print(json.dumps(data, ensure_ascii=False, indent=2))
+            return
+        print(f"共 {data['total']} 条，第 {data['page']}/{max(data['pages'], 1)} 页")
+        for v in data["items"]:
+            dims = " ".join(f"{d[:4]}={v['scores'][d] or 0:g}" for d in SCORE_DIMS)
+            print(f"  {v['visit_date']}  {v['visit_id']:<18} {v['rep_name']:<8} {v['total_score']:>5g} {v['grade']}  {dims}")
+    elif args.cmd == "tags":
+        data = store.tag_stats(query, args.limit)
+        if args.json:
+            print(json.dumps(data, ensure_ascii=False, indent=2))
+            return
+        for t in data:
+            print(f"  {t['visits']:>6}  {t['tag']}")
+    else:
+        data = store.score_stats(query, args.group)
+        if args.json:
+            print(json.dumps(data, ensure_ascii=False, indent=2))
+            return
+        for g in data:
+            dims = " ".join(f"{d[:4]}={g['dim_avgs'][d]:.1f}" for d in SCORE_DIMS)
+            print(f"  {g['name']:<12} {g['visits']:>6} 次  均分 {g['avg_score']:>5.1f}  {dims}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+正掌讯 · 对话文字稿预处理引擎
+
+分句、说话者识别、去前缀在一次遍历中完成；所有正则在导入时编译一次，
+说话者关键词用多模式匹配器（按字典树编译成单个正则）一次扫描整句。
+
+两种输入格式：
+  - 行内标签：每行 "销售：……" / "客户：……"（默认）
+  - 标签独占一行，后跟多行正文，直到下一个标签（multiline_tags=True）
+"""
+
+import hashlib
+import re
+
+SALES_TAGS    = ["销售", "业务", "销售员", "代表", "销"]
+CUSTOMER_TAGS = ["客户", "顾客", "买方", "客"]
+TAG_SPEAKER   = {**{t: "sales" for t in SALES_TAGS}, **{t: "customer" for t in CUSTOMER_TAGS}}
+
+SALES_KEYWORDS    = ["我们公司", "我们产品", "我来介绍", "我们可以", "这款产品", "推荐您", "我们这边", "给您", "合作", "方案"]
+CUSTOMER_KEYWORDS = ["你们价格", "太贵了", "考虑一下", "别家", "你们的", "有没有优惠", "我需要", "我再想想"]
+
+_TAG_ALT      = "客户|顾客|买方|销售|业务|销售员|代表|客|销"
+_PREFIX_RE    = re.compile(rf"({_TAG_ALT})[：:]\s*")           # 行首 / 句首标签（配合 match 使用）
+_TAG_LINE_RE  = re.compile(rf"\s*({_TAG_ALT})[：:]\s*$")        # 标签独占一行
+_TAG_STRIP_RE = re.compile(rf"({_TAG_ALT})[：:]")               # 多行模式下正文行残留的标签
+_SENT_END_RE  = re.compile(r"(?<=[。！？…])")
+_SPACE_RE     = re.compile(r"\s+")
+
+
+class KeywordMatcher:
+    """
+    多模式关键词匹配器。
+
+    关键词先建成字典树，再输出为一个前缀合并的正则，包在零宽先行断言里，
+    一次 finditer 即可在每个位置找出最长命中（效果等同 Aho-Corasick 的单遍扫描，匹配在 C 层完成）。
+    较短关键词若是较长关键词的子串，由预先计算的"蕴含"表补全（对应 AC 自动机的输出链）。
+    """
+
+    def __init__(self, keywords: dict):
+        """keywords: {关键词: 类别}"""
+        self.labels  = dict(keywords)
+        words        = sorted(self.labels, key=len, reverse=True)
+        self.implied = {w: frozenset(k for k in words if k in w) for w in words}
+        trie = {}
+        for w in words:
+            node = trie
+            for ch in w:
+                node = node.setdefault(ch, {})
+            node[""] = True
+        self.pattern = re.compile(f"(?=({self._trie_regex(trie)}))") if words else None
+
+    @classmethod
+    def _trie_regex(cls, node: dict) -> str:
+        branches = []
+        for ch in sorted((k for k in node if k), reverse=True):
+            branches.append(re.escape(ch) + cls._trie_regex(node[ch]))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # 当前位置已是一个完整关键词：后续分支可选，贪婪优先取最长
+            body = f"(?:{body})?"
+        return body
+
+    def found(self, text: str) -> set:
+        """返回 text 中出现过的全部关键词（去重）"""
+        hits = set()
+        if self.pattern is None:
+            return hits
+        for m in self.pattern.finditer(text):
+            hits |= self.implied[m.group(1)]
+        return hits
+
+    def count_labels(self, text: str) -> dict:
+        """每个类别命中的不同关键词个数"""
+        counts = {}
+        for w in self.found(text):
+            label = self.labels[w]
+            counts[label] = counts.get(label, 0) + 1
+        return counts
+
+
+SPEAKER_MATCHER = KeywordMatcher({**{k: "sales" for k in SALES_KEYWORDS},
+                                  **{k: "customer" for k in CUSTOMER_KEYWORDS}})
+
+
+def _speaker_by_keywords(sentence: str) -> str:
+    counts = SPEAKER_MATCHER.count_labels(sentence)
+    sc, cc = counts.get("sales", 0), counts.get("customer", 0)
+    if sc > cc: return "sales"
+    if cc > sc: return "customer"
+    return "unknown"
+
+
+def _emit(out: list, speaker: str, body: str):
+    """已知说话者的正文：按句末标点切分后直接输出"""
+    for p in _SENT_END_RE.split(body):
+        p = p.strip()
+        if p:
+            out.append({"speaker": speaker, "text": p})
+
+
+def _emit_untagged(out: list, body: str):
+    """无行首标签的正文：逐句检查句首标签，否则按关键词判断"""
+    for p in _SENT_END_RE.split(body):
+        p = p.strip()
+        if not p:
+            continue
+        m = _PREFIX_RE.match(p)
+        if m:
+            text = p[m.end():].strip()
+            if text:
+                out.append({"speaker": TAG_SPEAKER[m.group(1)], "text": text})
+        else:
+            out.append({"speaker": _speaker_by_keywords(p), "text": p})
+
+
+def segment_dialogue(text: str, multiline_tags: bool = False) -> list:
+    """
+    单遍完成分句 + 说话者识别 + 去前缀，返回 [{"speaker": "sales"|"customer"|"unknown", "text": ...}]。
+    multiline_tags=True 时支持"标签独占一行 + 多行正文"格式。
+    """
+    out = []
+    if not multiline_tags:
+        for line in text.strip().split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            m = _PREFIX_RE.match(line)
+            if m:
+                _emit(out, TAG_SPEAKER[m.group(1)], line[m.end():])
+            else:
+                _emit_untagged(out, line)
+        return out
+
+    speaker, buffer = None, []
+    for line in text.strip().split("\n"):
+        if not line.strip():
+            continue
+        tag = _TAG_LINE_RE.match(line)
+        if tag:
+            if buffer and speaker:
+                _emit(out, speaker, " ".join(buffer).strip())
+                buffer = []
+            speaker = TAG_SPEAKER[tag.group(1)]
+        elif speaker:
+            # 标签行之后的正文都归当前说话者，行首残留的标签去掉
+            m = _TAG_STRIP_RE.match(line)
+            buffer.append((line[m.end():] if m else line).strip())
+        else:
+            m = _PREFIX_RE.match(line)
+            if m:
+                _emit(out, TAG_SPEAKER[m.group(1)], line[m.end():])
+            else:
+                _emit_untagged(out, line)
+    if buffer and speaker:
+        _emit(out, speaker, " ".join(buffer).strip())
+    return out
+
+
+def dialogue_fingerprint(dialogue: list) -> str:
+    """对话内容指纹（说话者 + 去空白正文的 SHA-1），用于识别重复上传的文字稿"""
+    h = hashlib.sha1()
+    for d in dialogue:
+        h.update(f"{d.get('speaker', '')}|{_SPACE_RE.sub('', d.get('text', ''))}\n".encode("utf-8"))
+    return h.hexdigest()
@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from scipy.spatial.distance import cdist
+from geo_core import (identify_coordinate_columns, clean_coordinates, haversine, knn,
+                      project_equirectangular, unproject_equirectangular)
 import matplotlib.pyplot as plt
 from sklearn.cluster import KMeans
 import warnings
@@ -95,16 +96,8 @@ if customer_file and rep_file:
                 if customer_name_col:
                     break
             
-            # 识别经纬度列（注意：兼容"维度"这个错别字）
-            lat_col = lon_col = None
-            for col in df_customers.columns:
-                col_lower = col.lower()
-                # 纬度：支持"纬度"、"维度"（错别字）、"lat"、"latitude"
-                if '纬度' in col or '维度' in col or 'lat' in col_lower or 'latitude' in col_lower:
-                    lat_col = col
-                # 经度：支持"经度"、"lon"、"lng"、"longitude"
-                if '经度' in col or 'lon' in col_lower or 'lng' in col_lower or 'longitude' in col_lower:
-                    lon_col = col
+            # 识别经纬度列（兼容"维度"这个错别字）
+            lat_col, lon_col = identify_coordinate_columns(df_customers.columns)
             
             # 识别代表姓名列
             rep_name_candidates = ['代表姓名', '代表名称', '姓名', '名称']
@@ -141,11 +134,8 @@ if customer_file and rep_file:
         
         # 数据清洗
         original_count = len(df_customers)
-        df_customers = df_customers.dropna(subset=['纬度', '经度', '客户名称'])
-        df_customers = df_customers[
-            (df_customers['纬度'].apply(lambda x: isinstance(x, (int, float)))) &
-            (df_customers['经度'].apply(lambda x: isinstance(x, (int, float))))
-        ]
+        df_customers = df_customers.dropna(subset=['客户名称'])
+        df_customers, _ = clean_coordinates(df_customers, '纬度', '经度')
         cleaned_count = len(df_customers)
         
         if original_count > cleaned_count:
@@ -163,16 +153,24 @@ if customer_file and rep_file:
                 MIN_CAPACITY = int(avg_capacity * 0.85)
                 MAX_CAPACITY = int(avg_capacity * 1.15)
                 
-                # 提取坐标
-                customers_coords = df_customers[['纬度', '经度']].values
+                # 提取坐标，投影到以客户重心为原点的局部平面（km），避免经纬度直接聚类时经度方向被放大
+                cust_lats = df_customers['纬度'].to_numpy(dtype=float)
+                cust_lons = df_customers['经度'].to_numpy(dtype=float)
+                lat0, lon0 = float(cust_lats.mean()), float(cust_lons.mean())
+                customers_xy = np.column_stack(project_equirectangular(cust_lats, cust_lons, lat0, lon0))
                 
-                # K-Means聚类
+                # K-Means聚类（平面坐标），中心还原为经纬度
                 kmeans = KMeans(n_clusters=n_reps, random_state=42, n_init=10, max_iter=300)
-                initial_labels = kmeans.fit_predict(customers_coords)
-                cluster_centers = kmeans.cluster_centers_
+                initial_labels = kmeans.fit_predict(customers_xy)
+                center_lats, center_lons = unproject_equirectangular(
+                    kmeans.cluster_centers_[:, 0], kmeans.cluster_centers_[:, 1], lat0, lon0)
+                cluster_centers = np.column_stack([center_lats, center_lons])
                 
-                # 计算距离矩阵
-                dist_matrix = cdist(customers_coords, cluster_centers, metric='euclidean')
+                # 各客户到全部中心的球面距离（km）：k 近邻按由近到远给出中心顺序，供容量平衡逐个尝试
+                center_dist, center_order = knn(center_lats, center_lons, k=n_reps,
+                                                query_lats=cust_lats, query_lons=cust_lons)
+                dist_matrix = np.empty_like(center_dist)
+                np.put_along_axis(dist_matrix, center_order, center_dist, axis=1)
                 
                 # 容量平衡优化
                 assignments = initial_labels.copy()
@@ -199,8 +197,7 @@ if customer_file and rep_file:
                             if counts[over_cluster] <= MAX_CAPACITY:
                                 break
                             
-                            customer_distances = dist_matrix[customer_idx, :]
-                            sorted_clusters = np.argsort(customer_distances)
+                            sorted_clusters = center_order[customer_idx]
                             
                             for candidate_cluster in sorted_clusters:
                                 if candidate_cluster != over_cluster and counts[candidate_cluster] < MAX_CAPACITY:
@@ -246,14 +243,11 @@ if customer_file and rep_file:
                 rep_data = df_customers['rep_index'].apply(lambda idx: pd.Series(get_rep_info(idx)))
                 df_customers[['建议负责代表', '代表中心纬度', '代表中心经度']] = rep_data
                 
-                # 计算距离
-                def calculate_distance(row):
-                    lat_diff = row['纬度'] - row['代表中心纬度']
-                    lon_diff = row['经度'] - row['代表中心经度']
-                    distance = np.sqrt(lat_diff**2 + lon_diff**2) * 111
-                    return round(distance, 2)
-                
-                df_customers['距离代表中心距离(km)'] = df_customers.apply(calculate_distance, axis=1)
+                # 计算距离（向量化球面距离）
+                df_customers['距离代表中心距离(km)'] = np.round(haversine(
+                    df_customers['纬度'].to_numpy(dtype=float), df_customers['经度'].to_numpy(dtype=float),
+                    df_customers['代表中心纬度'].to_numpy(dtype=float), df_customers['代表中心经度'].to_numpy(dtype=float)
+                ), 2)
                 
                 st.success("✅ 分配完成！")
                 
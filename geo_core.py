@@ -0,0 +1,417 @@
+"""
+正掌讯 · 地理空间公共模块
+路线优化、客户分配、地址转换三个应用共用的坐标计算工具：
+
+    - 向量化 Haversine 距离与距离矩阵（带缓存）
+    - 等距圆柱投影（局部平面近似，单位 km）及其逆变换
+    - 基于 KD 树的空间索引与 k 近邻查询
+    - 经纬度列名识别与坐标有效性校验
+    - BD-09 → GCJ-02 坐标转换
+    - 省/市行政区划边界的网格索引与批量点-多边形判定
+
+约定：距离类函数参数顺序为 (lats, lons)；边界类函数沿用 GeoJSON 的 (lngs, lats) 顺序。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy 不可用时 k 近邻退化为分块暴力搜索
+    cKDTree = None
+
+EARTH_RADIUS_KM = 6371.0
+
+# 中国境内坐标大致范围（含南海诸岛）
+CHINA_LNG_RANGE = (73.0, 136.0)
+CHINA_LAT_RANGE = (3.0, 54.0)
+
+
+# ══════════════════════════════════════════════════════
+# 距离计算
+# ══════════════════════════════════════════════════════
+
+def haversine(lat1, lon1, lat2, lon2):
+    """逐元素计算球面距离（km），支持标量或可广播的数组"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats, lons, lats2=None, lons2=None, dtype=np.float64):
+    """
+    两组点之间的全量距离矩阵（km），形状 (len(lats), len(lats2))。
+    省略第二组时计算第一组内部的两两距离。
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lats2 = lats if lats2 is None else np.asarray(lats2, dtype=float)
+    lons2 = lons if lons2 is None else np.asarray(lons2, dtype=float)
+    return haversine(lats[:, None], lons[:, None], lats2[None, :], lons2[None, :]).astype(dtype, copy=False)
+
+
+_MATRIX_CACHE = OrderedDict()
+_MATRIX_CACHE_LOCK = threading.Lock()
+MATRIX_CACHE_SIZE = 8       # 缓存最近使用的距离矩阵个数
+
+
+def distance_matrix(lats, lons):
+    """
+    带缓存的点集两两距离矩阵（km）。
+    以坐标内容哈希为键，同一批点重复计算时直接返回缓存结果（只读数组）。
+    """
+    lats = np.ascontiguousarray(lats, dtype=float)
+    lons = np.ascontiguousarray(lons, dtype=float)
+    key = hashlib.sha1(lats.tobytes() + b"|" + lons.tobytes()).hexdigest()
+    with _MATRIX_CACHE_LOCK:
+        cached = _MATRIX_CACHE.get(key)
+        if cached is not None:
+            _MATRIX_CACHE.move_to_end(key)
+            return cached
+    matrix = haversine_matrix(lats, lons)
+    matrix.setflags(write=False)
+    with _MATRIX_CACHE_LOCK:
+        _MATRIX_CACHE[key] = matrix
+        while len(_MATRIX_CACHE) > MATRIX_CACHE_SIZE:
+            _MATRIX_CACHE.popitem(last=False)
+    return matrix
+
+
+def project_equirectangular(lats, lons, lat0=None, lon0=None):
+    """
+    等距圆柱投影到以 (lat0, lon0) 为原点的局部平面，返回 (x, y)，单位 km。
+    城市级范围内误差很小，适合聚类、网格划分等需要平面坐标的场景。
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lat0 = float(np.mean(lats)) if lat0 is None else lat0
+    lon0 = float(np.mean(lons)) if lon0 is None else lon0
+    k = np.pi / 180.0 * EARTH_RADIUS_KM
+    return (lons - lon0) * k * np.cos(np.radians(lat0)), (lats - lat0) * k
+
+
+def unproject_equirectangular(x, y, lat0, lon0):
+    """project_equirectangular 的逆变换：局部平面坐标 (x, y)（km）还原为 (lats, lons)"""
+    k = np.pi / 180.0 * EARTH_RADIUS_KM
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return lat0 + y / k, lon0 + x / (k * np.cos(np.radians(lat0)))
+
+
+# ══════════════════════════════════════════════════════
+# 空间索引与 k 近邻
+# ══════════════════════════════════════════════════════
+
+def _to_unit_xyz(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class PointIndex:
+    """
+    点集空间索引。坐标映射到单位球面三维直角坐标后建 KD 树，
+    弦长与球面距离单调对应，因此 k 近邻结果与 Haversine 完全一致。
+    """
+
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self._xyz = _to_unit_xyz(self.lats, self.lons)
+        self._tree = cKDTree(self._xyz) if cKDTree is not None else None
+
+    def __len__(self):
+        return len(self.lats)
+
+    def query(self, lats, lons, k=1):
+        """返回 (距离km, 下标)，形状均为 (n, k)"""
+        k = min(k, len(self))
+        xyz = _to_unit_xyz(np.atleast_1d(lats), np.atleast_1d(lons))
+        if self._tree is not None:
+            _, idx = self._tree.query(xyz, k=k)
+            idx = np.asarray(idx).reshape(len(xyz), k)
+        else:
+            idx = np.empty((len(xyz), k), dtype=np.int64)
+            for start in range(0, len(xyz), 1024):
+                chord = xyz[start:start + 1024] @ self._xyz.T
+                part = np.argpartition(-chord, k - 1, axis=1)[:, :k]
+                order = np.take_along_axis(chord, part, axis=1).argsort(axis=1)[:, ::-1]
+                idx[start:start + 1024] = np.take_along_axis(part, order, axis=1)
+        dist = haversine(np.atleast_1d(lats)[:, None], np.atleast_1d(lons)[:, None],
+                         self.lats[idx], self.lons[idx])
+        return dist, idx
+
+    def within(self, lat, lon, radius_km):
+        """返回距 (lat, lon) 不超过 radius_km 的点下标"""
+        if self._tree is not None:
+            chord = 2 * np.sin(radius_km / EARTH_RADIUS_KM / 2)
+            idx = np.asarray(self._tree.query_ball_point(_to_unit_xyz([lat], [lon])[0], chord), dtype=np.int64)
+        else:
+            idx = np.arange(len(self))
+        return idx[haversine(lat, lon, self.lats[idx], self.lons[idx]) <= radius_km]
+
+    def nearest(self, lat, lon, skip=None):
+        """
+        距 (lat, lon) 最近且 skip[下标] 为 False 的点下标（skip 为布尔数组，如已访问标记）；没有可选点返回 None。
+        先取少量近邻，全部被跳过时按 4 倍扩大 k 重新查询。
+        """
+        k = 8
+        while True:
+            _, idx = self.query(lat, lon, k=k)
+            idx = idx[0]
+            free = idx if skip is None else idx[~skip[idx]]
+            if len(free):
+                return int(free[0])
+            if k >= len(self):
+                return None
+            k *= 4
+
+
+def knn(lats, lons, k=1, query_lats=None, query_lons=None):
+    """
+    k 近邻查询。省略查询点时对点集自身做查询并排除自身，返回 (距离km, 下标)。
+    """
+    index = PointIndex(lats, lons)
+    if query_lats is None:
+        dist, idx = index.query(lats, lons, k=k + 1)
+        return dist[:, 1:], idx[:, 1:]
+    return index.query(query_lats, query_lons, k=k)
+
+
+# ══════════════════════════════════════════════════════
+# 列名识别与坐标校验
+# ══════════════════════════════════════════════════════
+
+def identify_coordinate_columns(columns):
+    """
+    从列名中识别纬度列和经度列，返回 (lat_col, lon_col)，找不到的为 None。
+    兼容"纬度"、"维度"（常见错别字）、lat/latitude 与 "经度"、lon/lng/longitude。
+    """
+    lat_col = lon_col = None
+    for col in columns:
+        name = str(col)
+        lower = name.lower()
+        if '纬度' in name or '维度' in name or 'lat' in lower:
+            lat_col = col
+        if '经度' in name or 'lon' in lower or 'lng' in lower:
+            lon_col = col
+    return lat_col, lon_col
+
+
+def valid_coordinate_mask(lats, lons, china_only=False):
+    """坐标有效性掩码：数值、非空且在经纬度范围内；china_only 时限定在中国范围内"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lng_range, lat_range = (CHINA_LNG_RANGE, CHINA_LAT_RANGE) if china_only else ((-180.0, 180.0), (-90.0, 90.0))
+    with np.errstate(invalid="ignore"):
+        return (np.isfinite(lats) & np.isfinite(lons) &
+                (lons >= lng_range[0]) & (lons <= lng_range[1]) &
+                (lats >= lat_range[0]) & (lats <= lat_range[1]))
+
+
+def clean_coordinates(df, lat_col, lon_col, china_only=False):
+    """把经纬度列转为数值并剔除无效行，返回 (清洗后的 DataFrame, 剔除行数)"""
+    out = df.copy()
+    out[lat_col] = pd.to_numeric(out[lat_col], errors="coerce")
+    out[lon_col] = pd.to_numeric(out[lon_col], errors="coerce")
+    mask = valid_coordinate_mask(out[lat_col].to_numpy(), out[lon_col].to_numpy(), china_only=china_only)
+    return out[mask], int((~mask).sum())
+
+
+def bd09_to_gcj02(lngs, lats):
+    """百度 BD-09 坐标向量化转换为 GCJ-02（高德/DataV 边界使用的坐标系）"""
+    x = np.asarray(lngs, dtype=float) - 0.0065
+    y = np.asarray(lats, dtype=float) - 0.006
+    z = np.sqrt(x * x + y * y) - 0.00002 * np.sin(y * np.pi * 3000.0 / 180.0)
+    theta = np.arctan2(y, x) - 0.000003 * np.cos(x * np.pi * 3000.0 / 180.0)
+    return z * np.cos(theta), z * np.sin(theta)
+
+
+# ══════════════════════════════════════════════════════
+# 行政区划边界
+# ══════════════════════════════════════════════════════
+
+BOUNDARY_GRID_DEG = 1.0     # 空间网格索引的格子边长（度）
+PIP_CHUNK = 4096            # 点-多边形判定时每批处理的点数，控制内存
+
+# 行政区名称后缀，匹配时去掉（"广东省"与"广东"视为同一地区）
+ADMIN_SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区",
+                  "自治州", "地区", "盟", "省", "市")
+
+
+def normalize_admin_name(name):
+    name = str(name or "").strip()
+    for suffix in ADMIN_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def points_in_rings(lngs, lats, rings):
+    """
+    向量化射线法（奇偶规则）：判断一批点是否落在由若干闭合环组成的区域内。
+    外环与内环（洞）、多个多边形统一按奇偶规则处理。
+    按纬度分带，每带内的点只与跨越该带的边做广播判定，并分块控制内存。
+    """
+    lngs = np.asarray(lngs, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    inside = np.zeros(len(lngs), dtype=bool)
+    if not len(lngs) or not rings:
+        return inside
+    xi = np.concatenate([r[:, 0] for r in rings])
+    yi = np.concatenate([r[:, 1] for r in rings])
+    xj = np.concatenate([np.roll(r[:, 0], 1) for r in rings])
+    yj = np.concatenate([np.roll(r[:, 1], 1) for r in rings])
+    dy = yj - yi
+    dy[dy == 0] = 1e-12
+    slope = (xj - xi) / dy
+    edge_lo = np.minimum(yi, yj)
+    edge_hi = np.maximum(yi, yj)
+
+    lo, hi = lats.min(), lats.max()
+    n_bands = int(np.clip(np.sqrt(len(xi)), 1, 256))
+    width = (hi - lo) / n_bands or 1.0
+    band = np.minimum(((lats - lo) / width).astype(np.int64), n_bands - 1)
+    order = np.argsort(band, kind="stable")
+    bounds = np.searchsorted(band[order], np.arange(n_bands + 1))
+    for b in range(n_bands):
+        pts = order[bounds[b]:bounds[b + 1]]
+        if not len(pts):
+            continue
+        band_lo, band_hi = lo + b * width, lo + (b + 1) * width
+        e = np.flatnonzero((edge_hi >= band_lo) & (edge_lo <= band_hi))
+        if not len(e):
+            continue
+        exi, eyi, eyj, eslope = xi[e], yi[e], yj[e], slope[e]
+        step = max(1, PIP_CHUNK * 512 // len(e))
+        for start in range(0, len(pts), step):
+            chunk = pts[start:start + step]
+            x = lngs[chunk, None]
+            y = lats[chunk, None]
+            crosses = ((eyi > y) != (eyj > y)) & (x < eslope * (y - eyi) + exi)
+            inside[chunk] = np.logical_xor.reduce(crosses, axis=1)
+    return inside
+
+
+def _geometry_rings(geometry):
+    """把 GeoJSON Polygon/MultiPolygon 展开为 [N×2 数组, ...]"""
+    if not geometry:
+        return []
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    polygons = [coords] if gtype == "Polygon" else coords if gtype == "MultiPolygon" else []
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            arr = np.asarray(ring, dtype=float)
+            if arr.ndim == 2 and len(arr) >= 3:
+                rings.append(arr[:, :2])
+    return rings
+
+
+class AdminBoundaryIndex:
+    """
+    省/市级行政区划边界及其网格空间索引。
+
+    支持 DataV GeoAtlas 格式（properties 含 name/level/adcode/parent），
+    也支持 properties 中直接给出 province 字段的市级边界。
+    """
+
+    def __init__(self, geojson, cell_deg=BOUNDARY_GRID_DEG):
+        self.cell_deg = cell_deg
+        self.regions = []
+        self.grid = {}
+        features = geojson.get("features", []) if isinstance(geojson, dict) else []
+        province_by_code = {}
+        for feature in features:
+            props = feature.get("properties") or {}
+            if props.get("level") == "province" and props.get("adcode") is not None:
+                province_by_code[str(props["adcode"])] = normalize_admin_name(props.get("name"))
+        for feature in features:
+            props = feature.get("properties") or {}
+            rings = _geometry_rings(feature.get("geometry"))
+            if not rings or not props.get("name"):
+                continue
+            level = props.get("level") or ("city" if props.get("province") else "province")
+            if level not in ("province", "city"):
+                continue
+            name = normalize_admin_name(props["name"])
+            if level == "province":
+                province = name
+            else:
+                parent = props.get("parent") or {}
+                parent_code = str(parent.get("adcode", "")) if isinstance(parent, dict) else ""
+                province = normalize_admin_name(props.get("province")) or province_by_code.get(parent_code, "")
+            stacked = np.vstack(rings)
+            region = {
+                "name": props["name"],
+                "norm": name,
+                "level": level,
+                "province": province,
+                "rings": rings,
+                "bbox": (stacked[:, 0].min(), stacked[:, 1].min(), stacked[:, 0].max(), stacked[:, 1].max()),
+            }
+            self.regions.append(region)
+            self._add_to_grid(len(self.regions) - 1, region["bbox"])
+        self.by_name = {}
+        for region in self.regions:
+            self.by_name.setdefault((region["level"], region["norm"]), []).append(region)
+
+    def _cell(self, lng, lat):
+        return int(np.floor(lng / self.cell_deg)), int(np.floor(lat / self.cell_deg))
+
+    def _add_to_grid(self, idx, bbox):
+        x0, y0 = self._cell(bbox[0], bbox[1])
+        x1, y1 = self._cell(bbox[2], bbox[3])
+        for gx in range(x0, x1 + 1):
+            for gy in range(y0, y1 + 1):
+                self.grid.setdefault((gx, gy), []).append(idx)
+
+    def find(self, level, name, province=""):
+        """按名称查找地区；同名地区按省份区分"""
+        norm = normalize_admin_name(name)
+        candidates = self.by_name.get((level, norm))
+        if not candidates:
+            candidates = [r for (lvl, n), rs in self.by_name.items()
+                          if lvl == level and norm and (n.startswith(norm) or norm.startswith(n)) for r in rs]
+        if province and len(candidates) > 1:
+            prov = normalize_admin_name(province)
+            candidates = [r for r in candidates if r["province"] == prov] or candidates
+        return candidates[0] if candidates else None
+
+    def contains(self, region, lngs, lats):
+        lngs = np.asarray(lngs, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        x0, y0, x1, y1 = region["bbox"]
+        in_bbox = (lngs >= x0) & (lngs <= x1) & (lats >= y0) & (lats <= y1)
+        result = np.zeros(len(lngs), dtype=bool)
+        if in_bbox.any():
+            result[in_bbox] = points_in_rings(lngs[in_bbox], lats[in_bbox], region["rings"])
+        return result
+
+    def locate(self, lngs, lats, level="city"):
+        """
+        批量查找点所在地区，返回与输入等长的地区列表（找不到为 None）。
+        先用网格索引筛出候选地区，再逐个地区做向量化判定。
+        """
+        lngs = np.asarray(lngs, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        found = [None] * len(lngs)
+        candidates = set()
+        for lng, lat in zip(lngs, lats):
+            candidates.update(self.grid.get(self._cell(lng, lat), []))
+        unresolved = np.ones(len(lngs), dtype=bool)
+        for idx in sorted(candidates):
+            region = self.regions[idx]
+            if region["level"] != level or not unresolved.any():
+                continue
+            pos = np.flatnonzero(unresolved)
+            hit = pos[self.contains(region, lngs[pos], lats[pos])]
+            for i in hit:
+                found[i] = region
+            unresolved[hit] = False
+        return found
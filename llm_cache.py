@@ -0,0 +1,146 @@
+"""
+正掌讯 · LLM 响应缓存
+
+以 (model, system, prompt, max_tokens, temperature) 的 SHA-256 作为键，
+将模型输出持久化到本地 SQLite。同一文字稿重复上传、报告重新生成时直接命中缓存，
+不再消耗 token。支持过期时间（TTL）、按条数/体积的 LRU 淘汰、命中统计与跳过开关。
+
+环境变量：
+    LLM_CACHE_PATH    缓存库路径（默认 llm_cache.db）
+    LLM_CACHE_TTL     过期秒数（默认 7 天，0 表示永不过期）
+    LLM_CACHE_BYPASS  设为 1 时跳过读取缓存（仍写入新结果）
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH  = os.environ.get("LLM_CACHE_PATH", "llm_cache.db")
+DEFAULT_TTL         = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES   = 200 * 1024 * 1024
+
+
+def make_key(model: str, system: str, prompt: str, max_tokens: int, temperature: float) -> str:
+    payload = json.dumps([model, system or "", prompt, int(max_tokens), float(temperature)],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """线程安全的 SQLite 响应缓存，单连接 + 锁，WAL 模式"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: int = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 bypass: bool = False):
+        self.path        = path
+        self.ttl         = ttl
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.bypass      = bypass or os.environ.get("LLM_CACHE_BYPASS", "") == "1"
+        self.hits        = 0
+        self.misses      = 0
+        self._lock       = threading.Lock()
+        self._conn       = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT, response TEXT, size INTEGER,
+            created_at REAL, accessed_at REAL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        """读取缓存；过期条目视为未命中并删除"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at=? WHERE key=?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = ""):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key,model,response,size,created_at,accessed_at) "
+                "VALUES (?,?,?,?,?,?)",
+                (key, model, response, len(response.encode("utf-8")), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """超出条数或体积上限时，按最近访问时间淘汰最旧的条目"""
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size),0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY accessed_at ASC").fetchall()
+        doomed = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size or 0
+        self._conn.executemany("DELETE FROM llm_cache WHERE key=?", doomed)
+
+    def fetch(self, model: str, system: str, prompt: str, max_tokens: int, temperature: float,
+              request, bypass: bool = False) -> str:
+        """
+        命中缓存直接返回，否则调用 request() 获取响应并写入缓存。
+        request 抛出的异常原样向上传递，失败结果不会被缓存。
+        """
+        key = make_key(model, system, prompt, max_tokens, temperature)
+        if not (bypass or self.bypass):
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        response = request()
+        self.put(key, response, model)
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size),0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits":     self.hits,
+            "misses":   self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries":  count,
+            "bytes":    total,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+_default_cache = None
+_default_lock  = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """进程内共享的默认缓存实例"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+        return _default_cache
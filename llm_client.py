@@ -0,0 +1,393 @@
+"""
+正掌讯 · 共享 LLM 客户端
+
+语音教练各版本与 AI 原型引擎共用的 OpenAI 兼容接口客户端（默认 DashScope）：
+  - 复用 keep-alive 连接池，避免每个阶段重新握手
+  - 信号量限制并发请求数
+  - 429 / 5xx / 网络异常按指数退避重试（遵循 Retry-After）
+  - 可选全局限速（每分钟请求数），多个工作线程共享同一配额
+  - 支持 SSE 流式输出，on_delta 回调可提前拿到部分内容
+  - 每次调用记录 token 用量（含服务端前缀缓存命中的输入 token）、耗时、重试次数、是否命中缓存；
+    调用时传入 UsageCollector 可单独统计一次任务的用量（多个任务并发时互不混入）
+  - 失败抛出 LLMError，不再返回 "ERROR: ..." 字符串
+
+本地联调 / 测试可启动桩服务：
+    python llm_client.py --stub --port 8901
+    LLM_BASE_URL=http://127.0.0.1:8901/v1 python voice_solution_mobile_v2.py --demo
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_cache import get_llm_cache
+
+LLM_BASE_URL        = os.environ.get("LLM_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 4))
+LLM_RATE_LIMIT      = float(os.environ.get("LLM_RATE_LIMIT", 0))   # 每分钟请求数，0 表示不限
+LLM_MAX_RETRIES     = 3
+LLM_TIMEOUT         = 90
+RETRY_STATUS        = {429, 500, 502, 503, 504}
+RECORD_HISTORY      = 500
+
+
+class LLMError(Exception):
+    """LLM 调用失败（重试耗尽或不可重试的错误）"""
+
+    def __init__(self, message: str, status: int = None, attempts: int = 1):
+        super().__init__(message)
+        self.status   = status
+        self.attempts = attempts
+
+
+class UsageCollector:
+    """收集一次任务（如一次拜访分析）的调用记录，随 complete / chat 的 collector 参数传入"""
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._records = []
+
+    def add(self, record: dict):
+        with self._lock:
+            self._records.append(record)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return summarize_records(self._records)
+
+
+class RateLimiter:
+    """按固定间隔放行请求的全局限速器（每分钟 rate 次），线程安全"""
+
+    def __init__(self, rate_per_min: float = 0):
+        self._lock = threading.Lock()
+        self._next = 0.0
+        self.set_rate(rate_per_min)
+
+    def set_rate(self, rate_per_min: float):
+        self.interval = 60.0 / rate_per_min if rate_per_min and rate_per_min > 0 else 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class LLMClient:
+    """线程安全，进程内共享一个实例即可（见 get_llm_client）"""
+
+    def __init__(self, base_url: str = LLM_BASE_URL, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES, backoff: float = 1.0, timeout: int = LLM_TIMEOUT,
+                 rate_limit: float = LLM_RATE_LIMIT):
+        self.url         = base_url.rstrip("/") + "/chat/completions"
+        self.max_retries = max_retries
+        self.backoff     = backoff
+        self.timeout     = timeout
+        self.session     = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(max_concurrency, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots      = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self.limiter     = RateLimiter(rate_limit)
+        self._lock       = threading.Lock()
+        self._records    = deque(maxlen=RECORD_HISTORY)
+        self._seq        = 0
+
+    # ── 对外接口 ──────────────────────────────────────
+
+    def complete(self, prompt: str, system: str = "", *, api_key: str, model: str,
+                 max_tokens: int = 2000, temperature: float = 0.3,
+                 use_cache: bool = True, on_delta=None, collector: UsageCollector = None) -> str:
+        """
+        单轮对话补全，返回模型输出文本。
+
+        on_delta : 可选回调 on_delta(片段, 已累计全文)，传入时走 SSE 流式输出；
+                   命中缓存时以完整内容回调一次。
+        collector: 可选，本次调用的记录同时写入该收集器
+        失败抛出 LLMError；失败结果不会写入缓存。
+        """
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        cached = True
+
+        def request():
+            nonlocal cached
+            cached = False
+            return self.chat(messages, api_key=api_key, model=model, max_tokens=max_tokens,
+                             temperature=temperature, on_delta=on_delta, collector=collector)
+
+        t0 = time.perf_counter()
+        content = get_llm_cache().fetch(model, system, prompt, max_tokens, temperature,
+                                        request, bypass=not use_cache)
+        if cached:
+            self._record(model=model, latency=time.perf_counter() - t0, usage={},
+                         attempts=0, cached=True, stream=False, collector=collector)
+            if on_delta:
+                on_delta(content, content)
+        return content
+
+    def chat(self, messages: list, *, api_key: str, model: str, max_tokens: int = 2000,
+             temperature: float = 0.3, on_delta=None, collector: UsageCollector = None) -> str:
+        """直接调用接口（不经缓存），带并发限制与重试"""
+        payload = {"model": model, "messages": messages,
+                   "max_tokens": max_tokens, "temperature": temperature}
+        if on_delta:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+        t0 = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            emitted = False
+            self.limiter.acquire()
+            try:
+                with self._slots:
+                    resp = self.session.post(self.url, headers=headers, json=payload,
+                                             timeout=self.timeout, stream=bool(on_delta))
+                    try:
+                        if resp.status_code in RETRY_STATUS:
+                            raise LLMError(f"HTTP {resp.status_code}: {resp.text[:200]}",
+                                           status=resp.status_code, attempts=attempt)
+                        if resp.status_code >= 400:
+                            # 4xx（429 除外）重试无意义，直接失败
+                            raise LLMError(f"HTTP {resp.status_code}: {resp.text[:200]}",
+                                           status=resp.status_code, attempts=attempt)
+                        if on_delta:
+                            def emit(delta, text):
+                                nonlocal emitted
+                                emitted = True
+                                on_delta(delta, text)
+                            content, usage = self._read_stream(resp, emit)
+                        else:
+                            data    = resp.json()
+                            content = data["choices"][0]["message"]["content"]
+                            usage   = data.get("usage") or {}
+                    finally:
+                        resp.close()
+            except LLMError as e:
+                retry_after = resp.headers.get("Retry-After") if e.status in RETRY_STATUS else None
+                if e.status not in RETRY_STATUS or attempt > self.max_retries:
+                    e.attempts = attempt
+                    raise
+                self._sleep(attempt, retry_after)
+                continue
+            except requests.exceptions.JSONDecodeError as e:
+                # resp.json() 的解析错误同时继承 RequestException 与 ValueError，须先于网络异常处理；
+                # 响应体不是 JSON 时重试无意义，直接按格式异常失败
+                raise LLMError(f"响应格式异常: {e}", attempts=attempt) from e
+            except requests.RequestException as e:
+                # 连接、超时以及流式读取中断（ChunkedEncodingError 等）；
+                # 流式输出已经回调过部分内容时不再重试，避免调用方收到重复片段
+                if emitted or attempt > self.max_retries:
+                    raise LLMError(f"网络异常: {e}", attempts=attempt) from e
+                self._sleep(attempt, None)
+                continue
+            except (ValueError, KeyError, IndexError) as e:
+                raise LLMError(f"响应格式异常: {e}", attempts=attempt) from e
+
+            self._record(model=model, latency=time.perf_counter() - t0, usage=usage,
+                         attempts=attempt, cached=False, stream=bool(on_delta), collector=collector)
+            return content
+
+    # ── 用量统计 ──────────────────────────────────────
+
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def records(self, since: int = 0) -> list:
+        """返回序号大于 since 的调用记录"""
+        with self._lock:
+            return [r for r in self._records if r["seq"] > since]
+
+    def usage_summary(self, since: int = 0) -> dict:
+        """全进程的用量（含其他并发任务）；单个任务的用量用 UsageCollector 统计"""
+        return summarize_records(self.records(since))
+
+    # ── 内部 ──────────────────────────────────────────
+
+    def _record(self, *, model, latency, usage, attempts, cached, stream, collector=None):
+        with self._lock:
+            self._seq += 1
+            record = {
+                "seq":               self._seq,
+                "model":             model,
+                "latency":           round(latency, 3),
+                "prompt_tokens":     int(usage.get("prompt_tokens") or 0),
+                "cached_prompt_tokens": _cached_prompt_tokens(usage),
+                "completion_tokens": int(usage.get("completion_tokens") or 0),
+                "attempts":          attempts,
+                "cached":            cached,
+                "stream":            stream,
+                "at":                time.time(),
+            }
+            self._records.append(record)
+        if collector is not None:
+            collector.add(record)
+
+    def _sleep(self, attempt: int, retry_after):
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = self.backoff * (2 ** (attempt - 1)) + random.uniform(0, self.backoff / 2)
+        time.sleep(min(delay, 30))
+
+    @staticmethod
+    def _read_stream(resp, on_delta):
+        """解析 SSE：逐行读取 data: {...}，直到 data: [DONE]"""
+        parts, usage = [], {}
+        for line in resp.iter_lines():
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data.decode("utf-8"))
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta, "".join(parts))
+        return "".join(parts), usage
+
+
+_default_client = None
+_default_lock   = threading.Lock()
+
+
+def summarize_records(recs: list) -> dict:
+    """调用记录汇总：调用次数、缓存命中、重试次数、token 用量、累计耗时"""
+    return {
+        "calls":             len(recs),
+        "cached":            sum(1 for r in recs if r["cached"]),
+        "retries":           sum(max(r["attempts"] - 1, 0) for r in recs),
+        "prompt_tokens":     sum(r["prompt_tokens"] for r in recs),
+        "cached_prompt_tokens": sum(r["cached_prompt_tokens"] for r in recs),
+        "completion_tokens": sum(r["completion_tokens"] for r in recs),
+        "latency":           round(sum(r["latency"] for r in recs), 3),
+    }
+
+
+def _cached_prompt_tokens(usage: dict) -> int:
+    """服务端前缀缓存命中的输入 token：OpenAI / DashScope 为 prompt_tokens_details.cached_tokens，
+    DeepSeek 为 prompt_cache_hit_tokens"""
+    details = usage.get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0)
+
+
+def get_llm_client() -> LLMClient:
+    """进程内共享的默认客户端"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
+
+
+# ══════════════════════════════════════════════════════
+# 本地桩服务（测试 / 离线联调）
+# ══════════════════════════════════════════════════════
+
+def _default_responder(messages: list) -> str:
+    return json.dumps({"stub": True, "echo": messages[-1]["content"][:40]}, ensure_ascii=False)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """模拟 /chat/completions：普通 JSON 与 SSE 流式两种响应，可配置前 N 次返回 503"""
+
+    server_version = "StubLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length  = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        stub    = self.server
+        with stub.lock:
+            stub.requests_seen += 1
+            fail = stub.requests_seen <= stub.fail_first
+        if fail:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(b"stub unavailable")
+            return
+
+        content = stub.responder(payload.get("messages") or [])
+        usage   = {"prompt_tokens": sum(len(m.get("content", "")) for m in payload.get("messages") or []),
+                   "completion_tokens": len(content)}
+        if payload.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            step = max(len(content) // 4, 1)
+            for i in range(0, len(content), step):
+                chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        body = json.dumps({"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                           "usage": usage}, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(responder=None, port: int = 0, fail_first: int = 0) -> ThreadingHTTPServer:
+    """
+    在后台线程启动桩服务，返回 server；server.base_url 可直接传给 LLMClient(base_url=...)。
+    responder(messages) -> str 决定返回内容；fail_first 为前若干次请求返回 503（测试重试）。
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubLLMHandler)
+    server.daemon_threads = True
+    server.responder      = responder or _default_responder
+    server.fail_first     = fail_first
+    server.requests_seen  = 0
+    server.lock           = threading.Lock()
+    server.base_url       = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="共享 LLM 客户端 / 本地桩服务")
+    parser.add_argument("--stub", action="store_true", help="启动本地桩服务")
+    parser.add_argument("--port", type=int, default=8901, help="桩服务端口（默认 8901）")
+    parser.add_argument("--fail-first", type=int, default=0, help="前 N 次请求返回 503")
+    args = parser.parse_args()
+    if args.stub:
+        srv = start_stub_server(port=args.port, fail_first=args.fail_first)
+        print(f"[Stub] LLM 桩服务已启动：{srv.base_url}")
+        print(f"[Stub] 使用：LLM_BASE_URL={srv.base_url} python voice_solution_mobile_v2.py --demo")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            srv.shutdown()
+    else:
+        parser.print_help()
@@ -0,0 +1,266 @@
+"""
+正掌讯 · LLM 输出的 JSON 提取、修复与补问
+
+模型输出常见的问题：前后夹带说明文字或 Markdown 代码块、尾随逗号、max_tokens 截断导致括号不闭合。
+原先用 re.search(r'\{.*\}', ..., re.DOTALL) 贪婪匹配兜底，长输出上回溯代价高，且任何缺陷都会让整个阶段作废。
+
+这里改为：
+  - JSONScanner：单遍扫描（可增量 feed），跟踪括号栈与字符串状态，找出第一个完整的顶层对象 / 数组；
+    闭合前的尾随逗号直接剔除；输出被截断时回退到最后一个完整的值并补齐括号（未闭合的字符串值补引号）
+  - validate：按阶段的字段约定检查顶层字段是否缺失 / 类型不符
+  - request_json：解析后仍缺字段时只就缺失字段补问一次并合并，而不是整阶段重跑；
+    补问提示词以原提示词开头，服务端前缀缓存可命中
+
+字段约定（schema）：list 表示顶层为数组；dict 为 {字段: 类型或类型元组}，ANY 表示任意非空值。
+"""
+
+import json
+
+from llm_client import LLMError
+
+REASK_LIMIT = 1          # 缺字段时的补问次数
+MAX_RESTARTS = 32        # 候选起点解析失败后重新找起点的次数上限，防止病态输入退化为平方复杂度
+NUMBER      = (int, float)
+ANY         = object
+
+_TOKEN_CHARS = set("0123456789+-.eEtrufalsn")     # 数字与 true / false / null
+_CLOSERS     = {"{": "}", "[": "]"}
+
+
+class JSONExtractError(ValueError):
+    pass
+
+
+class JSONScanner:
+    """
+    增量扫描器：feed(片段) 逐段喂入模型输出，value 为第一个解析成功的顶层值（未找到时为 None）；
+    输出结束后调用 finish() 取结果，必要时修复截断。
+    expect 为 dict / list 时优先返回该类型的值（如数组包着的对象）。
+    """
+
+    def __init__(self, expect: type = None):
+        self.expect = expect
+        self.text   = ""
+        self.value  = None
+        self.notes  = []          # 做过的修复：trailing_comma / truncated
+        self._pos   = 0
+        self._other = None        # 第一个解析成功但类型不符的值，作为兜底
+        self._restarts = 0
+        self._reset(None)
+
+    def _reset(self, start):
+        self._start = start
+        self._stack = []          # [[括号, 状态]]，状态：key / colon / value / after
+        self._chain = None        # 括号栈的不可变链表 (括号, 上层)，记录完整位置时 O(1) 快照
+        self._in_str = self._esc = self._str_key = False
+        self._tok   = None        # 数字 / 字面量起点
+        self._comma = None        # 最近一个逗号的位置（其后紧跟闭括号即为尾随逗号）
+        self._drops = []          # 需剔除的尾随逗号位置
+        self._safe  = None        # 最近的完整位置：(结束位置, 括号栈, 剔除数)
+
+    def feed(self, chunk: str):
+        if self.value is not None:
+            return self.value
+        self.text += chunk
+        self._scan()
+        return self.value
+
+    def finish(self):
+        """返回 (值, 修复说明)；没有可用的 JSON 时抛出 JSONExtractError"""
+        if self.value is None and self._stack:
+            self._repair_truncated()
+        if self.value is None and self._other is not None:
+            self.value = self._other
+        if self.value is None:
+            raise JSONExtractError("输出中没有可解析的 JSON")
+        return self.value, self.notes
+
+    # ── 扫描 ──────────────────────────────────────────
+
+    def _scan(self):
+        text, i = self.text, self._pos
+        while i < len(text) and self.value is None:
+            c = text[i]
+            if self._start is None:
+                if c in _CLOSERS:
+                    self._reset(i)
+                    self._push(c, i)
+                i += 1
+                continue
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._str_key:
+                        self._stack[-1][1] = "colon"
+                    else:
+                        self._value_done(i + 1)
+                i += 1
+                continue
+
+            if self._tok is not None and c not in _TOKEN_CHARS:
+                self._tok = None
+                self._value_done(i)
+
+            ok = True
+            if c in " \t\r\n":
+                pass
+            elif c == '"':
+                self._in_str, self._comma = True, None
+                self._str_key = self._stack[-1] == ["{", "key"]
+            elif c in _CLOSERS:
+                self._comma = None
+                self._push(c, i)
+            elif c in "}]":
+                if self._comma is not None:
+                    self._drops.append(self._comma)
+                    self._comma = None
+                ok = _CLOSERS[self._stack.pop()[0]] == c
+                self._chain = self._chain[1]
+                if ok and not self._stack:
+                    i = self._complete(i + 1)
+                    continue
+                if ok:
+                    self._value_done(i + 1)
+            elif c == ",":
+                self._comma = i
+                self._stack[-1][1] = "key" if self._stack[-1][0] == "{" else "value"
+            elif c == ":":
+                self._stack[-1][1] = "value"
+            elif c in _TOKEN_CHARS:
+                if self._tok is None:
+                    self._tok, self._comma = i, None
+            else:
+                ok = False
+            if not ok:
+                i = self._restart()
+                continue
+            i += 1
+        self._pos = i
+
+    def _push(self, c, i):
+        self._stack.append([c, "key" if c == "{" else "value"])
+        self._chain = (c, self._chain)
+        self._mark_safe(i + 1)
+
+    def _value_done(self, end):
+        if self._stack:
+            self._stack[-1][1] = "after"
+            self._mark_safe(end)
+
+    def _mark_safe(self, end):
+        self._safe = (end, self._chain, len(self._drops))
+
+    def _slice(self, end, drops):
+        text, start = self.text, self._start
+        if not drops:
+            return text[start:end]
+        parts, prev = [], start
+        for d in drops:
+            parts.append(text[prev:d])
+            prev = d + 1
+        parts.append(text[prev:end])
+        return "".join(parts)
+
+    def _accept(self, candidate: str, notes: list) -> bool:
+        try:
+            value = json.loads(candidate, strict=False)      # 容忍字符串内的裸换行
+        except ValueError:
+            return False
+        if self.expect is None or isinstance(value, self.expect):
+            self.value, self.notes = value, notes
+            return True
+        if self._other is None:
+            self._other, self.notes = value, notes
+        return False
+
+    def _complete(self, end):
+        """顶层括号闭合：尝试解析；失败或类型不符时从下一个字符重新找起点"""
+        notes = ["trailing_comma"] if self._drops else []
+        if self._accept(self._slice(end, self._drops), notes):
+            return end
+        return self._restart()
+
+    def _restart(self):
+        start = self._start
+        self._reset(None)
+        self._restarts += 1
+        return start + 1 if self._restarts <= MAX_RESTARTS else len(self.text)
+
+    def _repair_truncated(self):
+        """输出被截断：未闭合的字符串值补引号；否则回退到最后一个完整的值，再补齐括号"""
+        if self._tok is not None:
+            try:
+                json.loads(self.text[self._tok:])
+                self._value_done(len(self.text))       # 末尾恰好是完整的数字 / 字面量
+            except ValueError:
+                pass
+        if self._in_str and not self._str_key:
+            body  = self._slice(len(self.text) - (1 if self._esc else 0), self._drops) + '"'
+            chain = self._chain
+        elif self._safe:
+            end, chain, n = self._safe
+            body = self._slice(end, self._drops[:n])
+        else:
+            return
+        closers = []
+        while chain:
+            closers.append(_CLOSERS[chain[0]])
+            chain = chain[1]
+        closers = "".join(closers)
+        notes   = (["trailing_comma"] if self._drops else []) + ["truncated"]
+        self._accept(body + closers, notes)
+
+
+def extract_json(text: str, expect: type = None):
+    """从模型输出中取出 JSON，返回 (值, 修复说明)；失败抛出 JSONExtractError"""
+    scanner = JSONScanner(expect)
+    scanner.feed(text or "")
+    return scanner.finish()
+
+
+# ── 字段校验与补问 ────────────────────────────────────
+
+def validate(value, schema) -> list:
+    """缺失或类型不符的顶层字段；顶层类型不符时返回 ["$"]"""
+    if schema is None:
+        return []
+    if schema is list or schema is dict:
+        return [] if isinstance(value, schema) else ["$"]
+    if not isinstance(value, dict):
+        return ["$"]
+    return [k for k, t in schema.items() if value.get(k) is None or not isinstance(value[k], t)]
+
+
+def reask_prompt(prompt: str, missing: list) -> str:
+    return (f"{prompt}\n\n【补充】上一次输出缺少或格式不正确的字段：{'、'.join(missing)}。"
+            f"请只输出一个 JSON 对象，仅包含这些字段（结构同上述要求），不要输出其他字段。")
+
+
+def request_json(call, prompt: str, schema=None, reask: int = REASK_LIMIT, raw_chars: int = 300):
+    """
+    call(prompt, reask=False) -> 模型原始输出（失败抛出 LLMError）。
+    解析并校验；缺字段时只就缺失字段补问（最多 reask 次）并合并。解析失败返回 {"error", "raw"}。
+    """
+    expect = schema if schema in (list, dict) else (dict if schema else None)
+    raw = call(prompt)
+    try:
+        value, _ = extract_json(raw, expect)
+    except JSONExtractError:
+        return {"error": "JSON解析失败", "raw": raw[:raw_chars]}
+
+    missing = validate(value, schema)
+    for _ in range(reask):
+        if not missing or "$" in missing:
+            break
+        try:
+            extra, _ = extract_json(call(reask_prompt(prompt, missing), reask=True), dict)
+        except (JSONExtractError, LLMError):
+            break
+        value.update({k: extra[k] for k in missing if k in extra})
+        missing = validate(value, schema)
+    return value
@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import streamlit as st
 from scipy.spatial.distance import cdist
+from geo_core import PointIndex, distance_matrix, valid_coordinate_mask
 import matplotlib
 matplotlib.use('Agg')
 from matplotlib.backends.backend_pdf import PdfPages
@@ -44,42 +45,19 @@ if uploaded_file is not None:
         df = data.iloc[:, [1, 8, 9]].copy()
         df.columns = ['Name', 'Longitude', 'Latitude']
         
-        # Drop any rows with missing coordinates
-        df = df.dropna()
+        # Drop any rows with missing or invalid coordinates
+        df['Longitude'] = pd.to_numeric(df['Longitude'], errors='coerce')
+        df['Latitude'] = pd.to_numeric(df['Latitude'], errors='coerce')
+        df = df[valid_coordinate_mask(df['Latitude'], df['Longitude'])]
         df = df.reset_index(drop=True)
         
         st.write(f"### 成功加载 {len(df)} 家药店")
         
-        # Pre-compute distance matrix using vectorized operations
-        @st.cache_data
-        def compute_distance_matrix(lats, lons):
-            """
-            Vectorized haversine distance calculation for all pairs
-            """
-            # Convert to radians
-            lats_rad = np.radians(lats)
-            lons_rad = np.radians(lons)
-            
-            # Create matrices
-            lat1 = lats_rad[:, np.newaxis]
-            lat2 = lats_rad[np.newaxis, :]
-            lon1 = lons_rad[:, np.newaxis]
-            lon2 = lons_rad[np.newaxis, :]
-            
-            # Haversine formula
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            
-            a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-            c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-            
-            R = 6371  # Earth radius in km
-            return R * c
-        
-        # Compute distance matrix once
+        # Compute distance matrix once (vectorized haversine, cached across reruns by geo_core)
         lats = df['Latitude'].values
         lons = df['Longitude'].values
-        dist_matrix = compute_distance_matrix(lats, lons)
+        dist_matrix = distance_matrix(lats, lons)
+        point_index = PointIndex(lats, lons)   # KD tree for nearest-neighbor steps
         
         # Fast path distance calculation using pre-computed matrix
         def calculate_path_distance_fast(path_indices):
@@ -118,21 +96,20 @@ if uploaded_file is not None:
             final_distance = calculate_path_distance_fast(path)
             return path, final_distance
         
-        # Optimized nearest neighbor using distance matrix
+        # Nearest neighbor tour using the spatial index (haversine distances)
         def nearest_neighbor_fast(start_idx, n_pharmacies):
             """
-            Fast nearest neighbor using pre-computed distances
+            Fast nearest neighbor: each step queries the KD tree for the nearest unvisited pharmacy
             """
             path = [start_idx]
-            unvisited = set(range(n_pharmacies)) - {start_idx}
+            visited = np.zeros(n_pharmacies, dtype=bool)
+            visited[start_idx] = True
             current = start_idx
             
-            while unvisited:
-                # Find nearest unvisited pharmacy
-                distances = dist_matrix[current, list(unvisited)]
-                nearest_idx = list(unvisited)[np.argmin(distances)]
+            for _ in range(n_pharmacies - 1):
+                nearest_idx = point_index.nearest(lats[current], lons[current], skip=visited)
                 path.append(nearest_idx)
-                unvisited.remove(nearest_idx)
+                visited[nearest_idx] = True
                 current = nearest_idx
             
             return path
@@ -0,0 +1,151 @@
+"""
+正掌讯 · 多阶段 LLM 流水线的依赖图执行器
+
+各阶段声明自己依赖哪些阶段的输出，依赖全部就绪的阶段立即提交到线程池并发执行。
+LLM 调用以网络等待为主，线程并发即可让互不依赖的阶段同时进行。
+
+用法：
+    results, timings = run_stage_graph({
+        "stages": (lambda: stage_segmentation(dialogue), []),
+        "tags":   (lambda: extract_tags(dialogue), []),
+        "score":  (lambda stages, tags: score_visit(stages, tags), ["stages", "tags"]),
+    })
+
+步骤结果可持久缓存（StepCache + cache_stages）：键为 步骤名 + 版本盐 + 全部依赖输出 的哈希，
+输入不变的步骤直接取缓存；指定 force 的步骤跳过读取、重新执行，下游步骤的输入随之变化、自然失效。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def run_stage_graph(stages: dict, max_workers: int = 3, on_start=None, on_done=None):
+    """
+    执行阶段依赖图。
+
+    stages   : {阶段名: (函数, [依赖阶段名, ...])}，函数以依赖阶段的输出作为同名关键字参数调用
+    on_start : 可选回调 on_start(阶段名)，阶段提交执行时触发
+    on_done  : 可选回调 on_done(阶段名, 输出, 耗时秒)，阶段完成时触发
+
+    回调均在调用线程中触发（便于直接更新 UI / 打印日志）。
+    任一阶段抛出异常时取消尚未开始的阶段并重新抛出。
+    返回 (results, timings)：results 为 {阶段名: 输出}，timings 为 {阶段名: 耗时秒, "total": 总耗时秒}。
+    """
+    for name, (_, deps) in stages.items():
+        unknown = [d for d in deps if d not in stages]
+        if unknown:
+            raise ValueError(f"阶段 {name} 依赖了不存在的阶段: {unknown}")
+
+    results, timings = {}, {}
+    pending = dict(stages)
+    running = {}
+    t_start = time.perf_counter()
+
+    def timed(func, kwargs):
+        t0 = time.perf_counter()
+        out = func(**kwargs)
+        return out, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            ready = [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]
+            for name in ready:
+                func, deps = pending.pop(name)
+                if on_start:
+                    on_start(name)
+                running[pool.submit(timed, func, {d: results[d] for d in deps})] = name
+            if not running:
+                raise ValueError(f"阶段依赖存在循环: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    output, elapsed = future.result()
+                except Exception:
+                    for f in running:
+                        f.cancel()
+                    raise
+                results[name] = output
+                timings[name] = round(elapsed, 3)
+                if on_done:
+                    on_done(name, output, elapsed)
+
+    timings["total"] = round(time.perf_counter() - t_start, 3)
+    return results, timings
+
+
+# ── 步骤结果缓存 ──────────────────────────────────────
+
+def input_hash(*parts) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StepCache:
+    """步骤输出的 SQLite 持久缓存（JSON），单连接 + 锁，WAL 模式"""
+
+    def __init__(self, path: str):
+        self.path  = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS step_cache (
+            step TEXT, input_hash TEXT, output TEXT, created_at REAL,
+            PRIMARY KEY (step, input_hash)
+        )""")
+        self._conn.commit()
+
+    def get(self, step: str, key: str) -> tuple:
+        """返回 (是否命中, 输出)"""
+        with self._lock:
+            row = self._conn.execute("SELECT output FROM step_cache WHERE step=? AND input_hash=?",
+                                     (step, key)).fetchone()
+        return (True, json.loads(row[0])) if row else (False, None)
+
+    def put(self, step: str, key: str, output):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO step_cache (step, input_hash, output, created_at) "
+                               "VALUES (?,?,?,?)", (step, key, json.dumps(output, ensure_ascii=False), time.time()))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM step_cache")
+            self._conn.commit()
+
+
+def cache_stages(stages: dict, cache: StepCache, salt: dict = None, force=(), status: dict = None,
+                 cacheable=lambda output: not (isinstance(output, dict) and "error" in output)) -> dict:
+    """
+    给依赖图中的每个阶段加上持久缓存，返回同结构的新依赖图。
+
+    salt      : {阶段名: 额外键材料}，如根步骤的原始输入、提示词模板版本
+    force     : 跳过缓存读取、强制重新执行的阶段（结果仍写回缓存）
+    status    : 可选 dict，执行后记录每个阶段来源 "cache" / "run"
+    cacheable : 判断输出是否可缓存（默认不缓存带 error 的失败结果）
+    """
+    salt = salt or {}
+
+    def wrap(name, func):
+        def run(**inputs):
+            key = input_hash(name, salt.get(name, ""), inputs)
+            if name not in force:
+                hit, output = cache.get(name, key)
+                if hit:
+                    if status is not None:
+                        status[name] = "cache"
+                    return output
+            output = func(**inputs)
+            if cacheable(output):
+                cache.put(name, key, output)
+            if status is not None:
+                status[name] = "run"
+            return output
+        return run
+
+    return {name: (wrap(name, func), deps) for name, (func, deps) in stages.items()}
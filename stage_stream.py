@@ -0,0 +1,119 @@
+"""
+正掌讯 · 流水线流式执行面
+
+Streamlit 的页面元素只能在脚本线程中更新，而多阶段 LLM 流水线耗时数分钟。
+这里把流水线放到工作线程中执行，阶段开始 / 模型输出片段 / 阶段完成 / 日志作为事件放入队列，
+脚本线程按批取出事件刷新页面：首个阶段的输出片段几秒内即可显示，而不必等整条流水线结束。
+
+用法：
+    run = StreamRun(lambda events: run_pipeline(text, events=events))
+    for batch in run.batches():
+        for e in batch:
+            ...                       # e.kind: log / start / delta / done
+    run.result / run.error / run.outputs（已完成阶段的输出，失败时同样保留）
+"""
+
+import queue
+import threading
+from collections import namedtuple
+
+Event = namedtuple("Event", "kind name data")
+
+
+class PipelineEvents:
+    """流水线向外报告进度的接口；默认实现只转发日志，供同步调用"""
+
+    def __init__(self, log=None):
+        self._log = log
+
+    def log(self, message: str):
+        if self._log:
+            self._log(message)
+
+    def start(self, name: str):
+        pass
+
+    def delta(self, name: str, text: str):
+        """模型输出片段：text 为该阶段目前已生成的全文"""
+        pass
+
+    def done(self, name: str, output, elapsed: float):
+        pass
+
+    def delta_cb(self, name: str):
+        """适配 LLM 客户端的 on_delta(片段, 全文) 回调"""
+        return lambda _delta, text: self.delta(name, text)
+
+
+class StreamRun(PipelineEvents):
+    """在工作线程中执行 target(events)，事件经队列交给调用线程"""
+
+    def __init__(self, target, poll: float = 0.1):
+        super().__init__()
+        self.poll    = poll
+        self.queue   = queue.Queue()
+        self.outputs = {}            # 已完成阶段的输出（调用线程中维护）
+        self.result  = None
+        self.error   = None
+        self._thread = threading.Thread(target=self._run, args=(target,), daemon=True,
+                                        name="pipeline-stream")
+        self._thread.start()
+
+    def _run(self, target):
+        try:
+            self.queue.put(Event("result", None, target(self)))
+        except Exception as e:
+            self.queue.put(Event("error", None, e))
+
+    # ── 工作线程侧 ────────────────────────────────────
+
+    def log(self, message: str):
+        self.queue.put(Event("log", None, message))
+
+    def start(self, name: str):
+        self.queue.put(Event("start", name, None))
+
+    def delta(self, name: str, text: str):
+        self.queue.put(Event("delta", name, text))
+
+    def done(self, name: str, output, elapsed: float):
+        self.queue.put(Event("done", name, (output, elapsed)))
+
+    # ── 调用线程侧 ────────────────────────────────────
+
+    def batches(self):
+        """
+        逐批产出事件，直到流水线结束（成功或失败）。
+        同一批内每个阶段的输出片段只保留最新一条，避免逐 token 刷新页面。
+        """
+        finished = False
+        while not finished:
+            try:
+                events = [self.queue.get(timeout=self.poll)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch, latest = [], {}
+            for e in events:
+                if e.kind == "result":
+                    self.result, finished = e.data, True
+                elif e.kind == "error":
+                    self.error, finished = e.data, True
+                elif e.kind == "delta":
+                    if e.name in latest:
+                        batch[latest[e.name]] = None
+                    latest[e.name] = len(batch)
+                    batch.append(e)
+                else:
+                    if e.kind == "done":
+                        self.outputs[e.name] = e.data[0]
+                        latest.pop(e.name, None)
+                    batch.append(e)
+            batch = [e for e in batch if e is not None]
+            if batch:
+                yield batch
+        self._thread.join()
@@ -0,0 +1,280 @@
+// 正掌讯 · 拜访报告渲染脚本
+// 报告 HTML 只携带 <script id="report-data"> 中的本次拜访数据，页面结构和图表在此统一生成。
+(function () {
+const D = JSON.parse(document.getElementById('report-data').textContent);
+const BRAND = "#0055D4", GREEN = "#00A878";
+const DIM_LABELS = ["开场信任","需求探询","产品呈现","异议处理","成交推进","沟通专业"];
+
+function esc(s) {
+  return String(s == null ? "" : s).replace(/&/g,"&amp;").replace(/</g,"&lt;").replace(/>/g,"&gt;").replace(/"/g,"&quot;");
+}
+function scoreColor(v) {
+  v = parseFloat(v) || 0;
+  if (v >= 8) return "#00A878";
+  if (v >= 6) return "#0055D4";
+  if (v >= 4) return "#F59E0B";
+  return "#E5483A";
+}
+function gradeColor(g) {
+  return {A:"#00A878",B:"#0055D4",C:"#F59E0B",D:"#E5483A",E:"#B91C1C"}[g] || "#888";
+}
+const join = (arr, fn) => (arr || []).map(fn).join("\n");
+
+function dimBars() {
+  return join(D.dims, (d, i) => {
+    const v = d[0], col = scoreColor(v);
+    return `<div class="dim-row">
+  <div class="dim-head"><span class="dim-label">${DIM_LABELS[i]}</span><span class="dim-score" style="color:${col}">${esc(v)}<span style="font-size:11px;font-weight:400">/10</span></span></div>
+  <div class="dim-track"><div class="dim-fill" style="width:${v*10}%;background:${col}"></div></div>
+  <div class="dim-cmt">${esc(d[1])}</div>
+</div>`;
+  });
+}
+
+function dialogue() {
+  const CLS = {s:"turn-sales", c:"turn-customer", u:"turn-unknown"};
+  const AV  = {s:"销", c:"客", u:"?"};
+  const LBL = {s:"销售", c:"客户", u:"未知"};
+  return join(D.turns, (t, i) => {
+    const sp = t[0], badge = t[2] ? `<span class="stage-badge">${esc(t[2])}</span>` : "";
+    return `<div class="turn ${CLS[sp]}">
+  <div class="av">${AV[sp]}</div>
+  <div class="bwrap"><div class="bubble">${esc(t[1])}${badge}</div>
+  <div class="turn-meta">${LBL[sp]} · #${i+1}</div></div>
+</div>`;
+  });
+}
+
+function strengthsWeaknesses() {
+  return join(D.strengths, s => `<div class="sw-item sw-good"><span class="sw-icon">+</span><span>${esc(s)}</span></div>`)
+    + "\n" + join(D.weaknesses, w => `<div class="sw-item sw-bad"><span class="sw-icon">−</span><span>${esc(w)}</span></div>`);
+}
+
+function scriptImprove() {
+  return join(D.improve, s => `<div class="improve-card">
+  <div class="improve-orig">原：${esc(s[0])}</div>
+  <div class="improve-issue">问题：${esc(s[1])}</div>
+  <div class="improve-new">改进：${esc(s[2])}</div>
+  <div class="improve-principle">${esc(s[3])}</div>
+</div>`) || "<p class='muted'>暂无改进示例</p>";
+}
+
+function nextScript() {
+  const nv = D.next, qs = (nv.questions || []).map(q => `<div class="script-q">· ${esc(q)}</div>`).join("");
+  return `<div class="script-block">
+  <div class="script-lbl">开场</div>
+  <div class="script-text">${esc(nv.opening)}</div>
+</div>
+<div class="script-block">
+  <div class="script-lbl">需求探询提问</div>
+  ${qs}
+</div>
+<div class="script-block">
+  <div class="script-lbl">价格异议应对</div>
+  <div class="script-text">${esc(nv.price)}</div>
+</div>
+<div class="script-block">
+  <div class="script-lbl">成交推进话术</div>
+  <div class="script-text highlight">${esc(nv.closing)}</div>
+</div>`;
+}
+
+function plan() {
+  return join(D.plan, (w, i) => `<div class="tl-item ${i < 1 ? "done" : i == 1 ? "active" : ""}">
+  <div class="tl-dot"></div>
+  <div class="tl-body">
+    <div class="tl-week">第 ${esc(w[0] == null ? i+1 : w[0])} 周 · ${esc(w[1])}</div>
+    <div class="tl-action">${esc(w[2])}</div>
+    <div class="tl-metric">目标：${esc(w[3])}</div>
+  </div>
+</div>`);
+}
+
+function teamDimBars() {
+  if (!D.team.visits) return "";
+  return join(D.team.dims, (v, i) => {
+    const col = scoreColor(v);
+    return `<div class="dim-row">
+  <div class="dim-head"><span class="dim-label">${DIM_LABELS[i]}</span><span class="dim-score" style="color:${col}">${Number(v).toFixed(1)}</span></div>
+  <div class="dim-track"><div class="dim-fill" style="width:${v*10}%;background:${col}"></div></div>
+</div>`;
+  });
+}
+
+function teamTags() {
+  if (!D.team.tags.length) return "<p class='muted'>暂无标签统计</p>";
+  return join(D.team.tags, t => `<div class="dim-row">
+  <div class="dim-head"><span class="dim-label">${esc(t[0])}</span><span class="dim-score" style="color:#0055D4">${t[1]}<span style="font-size:11px;font-weight:400"> 次</span></span></div>
+  <div class="dim-track"><div class="dim-fill" style="width:${(t[1]*100/D.team.visits).toFixed(0)}%;background:#0055D4"></div></div>
+</div>`);
+}
+
+function historyCards() {
+  if (!D.history.length) return '<div class="empty-state">暂无历史记录，完成首次分析后将在此显示</div>';
+  return join(D.history, h => {
+    const gc = gradeColor(h[1]);
+    const link = h[5] ? `href="${esc(h[5])}"` : 'href="#" onclick="return false"';
+    return `<a class="hist-card" ${link}>
+  <div class="hist-score" style="background:${gc}18;color:${gc}">
+    <div class="hs-num">${esc(h[0])}</div>
+    <div class="hs-grade">${esc(h[1])}</div>
+  </div>
+  <div class="hist-info">
+    <div class="hist-name">${esc(h[2])}</div>
+    <div class="hist-meta">${esc(h[3])} · ${esc(h[4])}</div>
+  </div>
+  <div class="hist-arrow">›</div>
+</a>`;
+  });
+}
+
+const missing = D.missing.length
+  ? `<div class="notice notice-amber">⚠ 缺失阶段：${D.missing.map(s => `<span class="miss-tag">${esc(s)}</span>`).join("")}</div>` : "";
+const critical = D.critical_issue ? `<div class="notice notice-red">核心问题：${esc(D.critical_issue)}</div>` : "";
+const c = D.counts;
+
+document.getElementById('app').innerHTML = `
+<div class="topbar">
+  <div class="topbar-logo">
+    <svg viewBox="0 0 20 20" fill="none">
+      <rect x="2" y="5" width="16" height="11" rx="2" stroke="white" stroke-width="1.6"/>
+      <path d="M5 9h10M5 12.5h6" stroke="white" stroke-width="1.6" stroke-linecap="round"/>
+      <circle cx="15.5" cy="5.5" r="3" fill="#7FB3FF"/>
+    </svg>
+  </div>
+  <div>
+    <div class="topbar-name">正掌讯 AI 销售教练</div>
+    <div class="topbar-sub">Sales Intelligence</div>
+  </div>
+  <div class="topbar-right">
+    ${esc(D.rep_name)}<br>${esc(D.visit_date)}
+  </div>
+</div>
+
+<div class="page active" id="page-report">
+  <div class="hero">
+    <div class="hero-top">
+      <div class="hero-score-circle">
+        <div class="num">${esc(D.total)}</div>
+        <div class="num-lbl">综合评分</div>
+        <div class="hero-grade-badge" style="color:${gradeColor(D.grade)}">${esc(D.grade)}</div>
+      </div>
+      <div class="hero-right">
+        <div class="hero-visit">${esc(D.visit_id)} · ${esc(D.customer_id)}</div>
+        <div class="hero-rep">${esc(D.rep_name)}</div>
+        <div class="hero-stats">
+          <div class="hero-stat"><div class="sv">${c[0]}</div><div class="sl">销售话轮</div></div>
+          <div class="hero-stat"><div class="sv">${c[1]}</div><div class="sl">客户话轮</div></div>
+          <div class="hero-stat"><div class="sv">${esc(c[2])}</div><div class="sl">提问次数</div></div>
+          <div class="hero-stat"><div class="sv">${c[3]}</div><div class="sl">处理异议</div></div>
+        </div>
+      </div>
+    </div>
+    <div class="hero-grade-desc">${esc(D.grade_description)}</div>
+  </div>
+
+  ${missing}
+  ${critical}
+
+  <div class="card"><div class="card-title">六维评分</div>${dimBars()}</div>
+  <div class="card">
+    <div class="card-title">能力雷达</div>
+    <div class="chart-wrap" style="height:220px"><canvas id="teamRadarChart"></canvas></div>
+  </div>
+  <div class="card"><div class="card-title">优势 & 不足</div>${strengthsWeaknesses()}</div>
+  <div class="card">
+    <div class="card-title">销售阶段分布</div>
+    <div class="chart-wrap" style="height:180px"><canvas id="stageChart"></canvas></div>
+    <div style="font-size:12px;color:#9BA3B8;margin-top:8px">${esc(D.stage_summary)}</div>
+  </div>
+  <div class="card"><div class="card-title">对话回放</div>${dialogue()}</div>
+  <div class="card"><div class="card-title">话术改进示例</div>${scriptImprove()}</div>
+  <div class="card"><div class="card-title">下次拜访话术脚本</div>${nextScript()}</div>
+  <div class="card"><div class="card-title">30天提升计划</div><div class="timeline">${plan()}</div></div>
+  <div class="card">
+    <div class="card-title">教练辅导总结</div>
+    <div class="summary-text">${esc(D.summary)}</div>
+  </div>
+</div>
+
+<div class="page" id="page-team">
+  <div class="metric-grid">
+    <div class="metric-cell"><div class="mlbl">分析记录数</div><div class="mval">${D.team.visits}</div><div class="msub">共计拜访</div></div>
+    <div class="metric-cell"><div class="mlbl">平均评分</div><div class="mval">${D.team.avg}</div><div class="msub">综合均值</div></div>
+    <div class="metric-cell"><div class="mlbl">最高评分</div><div class="mval">${D.team.best}</div><div class="msub">历史最优</div></div>
+    <div class="metric-cell"><div class="mlbl">本次评分</div><div class="mval">${esc(D.total)}</div><div class="msub">${esc(D.grade)} 级</div></div>
+  </div>
+  <div class="card"><div class="card-title">团队维度均值</div>${teamDimBars()}</div>
+  <div class="card"><div class="card-title">团队高频标签</div>${teamTags()}</div>
+  <div class="card">
+    <div class="card-title">历史趋势</div>
+    <div class="chart-wrap" style="height:180px"><canvas id="trendChart"></canvas></div>
+  </div>
+  <div class="card"><div class="card-title">历史记录</div>${historyCards()}</div>
+</div>
+
+<nav class="bottom-nav">
+  <button class="nav-tab active" id="tab-report" onclick="switchTab('report')">
+    <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.8">
+      <rect x="4" y="3" width="16" height="18" rx="2"/>
+      <path d="M8 8h8M8 12h8M8 16h5" stroke-linecap="round"/>
+    </svg>
+    本次报告
+  </button>
+  <button class="nav-tab" id="tab-team" onclick="switchTab('team')">
+    <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.8">
+      <circle cx="9" cy="7" r="3"/><circle cx="15" cy="7" r="3"/>
+      <path d="M3 20c0-3.3 2.7-6 6-6h6c3.3 0 6 2.7 6 6" stroke-linecap="round"/>
+    </svg>
+    团队看板
+  </button>
+</nav>`;
+
+window.switchTab = function (t) {
+  document.querySelectorAll('.page').forEach(p => p.classList.remove('active'));
+  document.querySelectorAll('.nav-tab').forEach(b => b.classList.remove('active'));
+  document.getElementById('page-'+t).classList.add('active');
+  document.getElementById('tab-'+t).classList.add('active');
+};
+
+if (typeof Chart === "undefined") return;     // 离线打开时图表库不可用，其余内容照常显示
+
+new Chart(document.getElementById('stageChart'), {
+  type:'bar',
+  data:{
+    labels:['开场','需求探询','产品呈现','异议处理','成交推进','收场跟进'],
+    datasets:[{data:D.stage_data,backgroundColor:['#E8F0FF','#D1E4FF','#B5D4FF','#8FBBFF','#5C99FF',BRAND],borderRadius:5}]
+  },
+  options:{responsive:true,maintainAspectRatio:false,
+    plugins:{legend:{display:false}},
+    scales:{x:{grid:{display:false},ticks:{font:{size:10},maxRotation:30}},y:{beginAtZero:true,ticks:{stepSize:1,font:{size:10}}}}
+  }
+});
+
+new Chart(document.getElementById('teamRadarChart'), {
+  type:'radar',
+  data:{
+    labels:DIM_LABELS,
+    datasets:[
+      {label:'本次',data:D.dims.map(d => d[0]),backgroundColor:'rgba(0,85,212,.08)',borderColor:BRAND,pointBackgroundColor:BRAND,pointRadius:3,borderWidth:2},
+      {label:'团队均值',data:D.team.dims,backgroundColor:'rgba(0,168,120,.08)',borderColor:GREEN,pointBackgroundColor:GREEN,pointRadius:3,borderWidth:2,borderDash:[4,3]}
+    ]
+  },
+  options:{responsive:true,maintainAspectRatio:false,
+    scales:{r:{min:0,max:10,ticks:{stepSize:2,font:{size:10},backdropColor:'transparent'},pointLabels:{font:{size:11}}}},
+    plugins:{legend:{display:true,position:'bottom',labels:{font:{size:11},boxWidth:10,padding:12}}}
+  }
+});
+
+new Chart(document.getElementById('trendChart'), {
+  type:'line',
+  data:{
+    labels:D.team.trend.map(t => t[0]),
+    datasets:[{label:'综合评分',data:D.team.trend.map(t => t[1]),borderColor:BRAND,backgroundColor:'rgba(0,85,212,.08)',pointBackgroundColor:BRAND,pointRadius:4,fill:true,tension:0.35,borderWidth:2.5}]
+  },
+  options:{responsive:true,maintainAspectRatio:false,
+    plugins:{legend:{display:false}},
+    scales:{x:{grid:{display:false},ticks:{font:{size:10},maxRotation:40}},y:{min:0,max:100,ticks:{stepSize:20,font:{size:10}}}}
+  }
+});
+})();
@@ -3,61 +3,58 @@ AI 需求分析 & 原型生成引擎 —— Streamlit 版
 =========================================
 依赖：pip install streamlit requests
 运行：streamlit run zzx_ai_prototype_llm_engine.py
+批量：python zzx_batch.py 会议纪要目录/ -o 报告目录/   （无界面，不需要 streamlit，见 zzx_batch.py）
 """
 
-import json, re, os, html as _html
-import requests
-import streamlit as st
+import json, os, html as _html
+try:
+    import streamlit as st
+except ImportError:  # 无界面批量运行时不需要 streamlit；引擎部分（run_pipeline 及以上）不依赖它
+    st = None
 from datetime import datetime
 from typing import Dict, Any
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client, LLMError
+from llm_json import request_json
+from stage_graph import run_stage_graph, cache_stages, input_hash, StepCache
+from stage_stream import PipelineEvents, StreamRun
 
 # ══════════════════════════════════════════════════════
 # 配置
 # ══════════════════════════════════════════════════════
 DASHSCOPE_API_KEY = os.environ.get("DASHSCOPE_API_KEY", "sk-c4bbfc49d1a84880ae3241dff77a9e8f")
-DASHSCOPE_URL     = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
 MODEL             = "qwen-plus"
+LLM_TEMPERATURE   = 0.3
+STEP_CACHE_PATH   = os.environ.get("ZZX_STEP_CACHE_PATH", "zzx_step_cache.db")   # 各步骤结果缓存
 
 # ══════════════════════════════════════════════════════
 # LLM 调用
 # ══════════════════════════════════════════════════════
 
-def call_llm(prompt: str, system: str = "", max_tokens: int = 2000) -> str:
-    api_key = st.session_state.get("api_key") or DASHSCOPE_API_KEY
-    messages = []
-    if system:
-        messages.append({"role": "system", "content": system})
-    messages.append({"role": "user", "content": prompt})
-    try:
-        r = requests.post(
-            DASHSCOPE_URL,
-            headers={"Authorization": f"Bearer {api_key}",
-                     "Content-Type": "application/json"},
-            json={"model": MODEL, "messages": messages,
-                  "max_tokens": max_tokens, "temperature": 0.3},
-            timeout=90
-        )
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"ERROR: {e}"
-
-
-def call_llm_json(prompt: str, system: str = "") -> Any:
+def call_llm(prompt: str, system: str = "", max_tokens: int = 2000,
+             use_cache: bool = True, on_delta=None, api_key: str = None) -> str:
+    """
+    经共享客户端调用（连接复用、重试、缓存）；失败抛出 LLMError。
+    api_key 由调用方传入（界面取自侧边栏），未传时用环境变量 DASHSCOPE_API_KEY。
+    """
+    api_key = api_key or DASHSCOPE_API_KEY
+    return get_llm_client().complete(
+        prompt, system, api_key=api_key, model=MODEL, max_tokens=max_tokens,
+        temperature=LLM_TEMPERATURE, use_cache=use_cache, on_delta=on_delta)
+
+
+def call_llm_json(prompt: str, system: str = "", api_key: str = None, use_cache: bool = True,
+                  on_delta=None, schema=None) -> Any:
+    """单遍提取 JSON（容忍说明文字、代码块、尾随逗号、截断）；按 schema 校验，缺字段时只补问缺失字段"""
     sys_full = (system or "") + "\n\n【重要】只输出合法 JSON，不加任何说明，不使用 Markdown 代码块。"
-    raw = call_llm(prompt, sys_full.strip())
-    clean = re.sub(r'^```(?:json)?\s*', '', raw.strip())
-    clean = re.sub(r'\s*```$', '', clean.strip())
+
+    def call(p, reask=False):
+        return call_llm(p, sys_full.strip(), use_cache=use_cache, on_delta=None if reask else on_delta,
+                        api_key=api_key)
     try:
-        return json.loads(clean)
-    except Exception:
-        m = re.search(r'(\{.*\}|\[.*\])', clean, re.DOTALL)
-        if m:
-            try:
-                return json.loads(m.group())
-            except Exception:
-                pass
-    return {"error": "JSON解析失败", "raw": raw[:400]}
+        return request_json(call, prompt, schema, raw_chars=400)
+    except LLMError as e:
+        return {"error": "LLM调用失败", "detail": str(e)}
 
 # ══════════════════════════════════════════════════════
 # Prompt 模板
@@ -105,36 +102,97 @@ def prompt_questions(structured_json: str) -> str:
 # 引擎核心
 # ══════════════════════════════════════════════════════
 
-def run_pipeline(raw_text: str, progress_cb=None) -> Dict:
-    def step(msg):
-        if progress_cb:
-            progress_cb(msg)
-
-    step("⏳ [1/4] 语义整理中，请稍候...")
-    cleaned = call_llm_json(prompt_semantic_clean(raw_text))
-    step("✅ [1/4] 语义整理完成")
-
-    step("⏳ [2/4] 提取结构化需求中...")
-    requirements = call_llm_json(prompt_structured_extraction(
-        json.dumps(cleaned, ensure_ascii=False)))
-    step("✅ [2/4] 结构化需求提取完成")
-
-    step("⏳ [3/4] 生成系统原型中...")
-    prototype = call_llm_json(prompt_prototype(
-        json.dumps(requirements, ensure_ascii=False)))
-    step("✅ [3/4] 系统原型生成完成")
-
-    step("⏳ [4/4] 生成澄清问题中...")
-    questions = call_llm_json(prompt_questions(
-        json.dumps(requirements, ensure_ascii=False)))
-    step("✅ [4/4] 澄清问题生成完成")
+# 步骤依赖：原型与澄清问题都只依赖结构化需求，二者并发
+STEP_LABELS = {
+    "cleaned":      ("[1/4]", "语义整理"),
+    "requirements": ("[2/4]", "提取结构化需求"),
+    "prototype":    ("[3/4]", "生成系统原型"),
+    "questions":    ("[4/4]", "生成澄清问题"),
+}
+STEP_PROMPTS = {
+    "cleaned":      prompt_semantic_clean,
+    "requirements": prompt_structured_extraction,
+    "prototype":    prompt_prototype,
+    "questions":    prompt_questions,
+}
+# 各步骤输出的顶层结构；结构化需求缺字段时只补问缺失字段
+REQUIREMENT_FIELDS = ["业务目标", "用户角色", "核心场景", "功能模块", "业务流程",
+                      "数据对象", "权限角色", "关键指标", "约束条件", "优先级判断"]
+STEP_SCHEMAS = {
+    "cleaned":      list,
+    "requirements": {k: (str, list, dict) for k in REQUIREMENT_FIELDS},
+    "prototype":    {"pages": list, "flows": list},
+    "questions":    list,
+}
+RERUNNABLE_STEPS = ("prototype", "questions")
+
+_step_cache = None
+
+
+def get_step_cache() -> StepCache:
+    global _step_cache
+    if _step_cache is None:
+        _step_cache = StepCache(STEP_CACHE_PATH)
+    return _step_cache
+
+
+def build_graph(raw_text: str, api_key: str, fresh=(), events: PipelineEvents = None) -> dict:
+    """fresh 中的步骤不读 LLM 响应缓存（部分重跑时需要得到新结果）；events 接收各步骤生成中的文本"""
+    def llm(step, payload):
+        prompt = STEP_PROMPTS[step](payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False))
+        return call_llm_json(prompt, api_key=api_key, use_cache=step not in fresh,
+                             on_delta=events.delta_cb(step) if events else None, schema=STEP_SCHEMAS[step])
+    return {
+        "cleaned":      (lambda: llm("cleaned", raw_text), []),
+        "requirements": (lambda cleaned: llm("requirements", cleaned), ["cleaned"]),
+        "prototype":    (lambda requirements: llm("prototype", requirements), ["requirements"]),
+        "questions":    (lambda requirements: llm("questions", requirements), ["requirements"]),
+    }
+
+
+def step_salt(raw_text: str) -> dict:
+    """步骤缓存键材料：模型 + 提示词模板（模板修改后旧缓存自动失效）；根步骤再加原始输入"""
+    salt = {name: input_hash(MODEL, LLM_TEMPERATURE, fn("")) for name, fn in STEP_PROMPTS.items()}
+    salt["cleaned"] = input_hash(salt["cleaned"], raw_text)
+    return salt
+
+
+def run_pipeline(raw_text: str, progress_cb=None, rerun=(), api_key: str = None,
+                 use_cache: bool = True, events: PipelineEvents = None) -> Dict:
+    """
+    按依赖图执行四个步骤，结果按输入哈希持久缓存。
+    rerun     : 只重新生成这些步骤（如 {"prototype"}），上游步骤取缓存，不重复调用 LLM
+    use_cache : False 时所有步骤跳过缓存读取
+    events    : 接收进度日志、步骤开始 / 完成与生成中的文本（见 stage_stream）；未传时日志交给 progress_cb
+    """
+    ev   = events or PipelineEvents(progress_cb)
+    step = ev.log
+
+    api_key = api_key or DASHSCOPE_API_KEY
+    force   = set(STEP_LABELS) if not use_cache else set(rerun)
+    status  = {}
+    graph   = cache_stages(build_graph(raw_text, api_key, fresh=force, events=events), get_step_cache(),
+                           salt=step_salt(raw_text), force=force, status=status)
+
+    def on_start(name):
+        no, label = STEP_LABELS[name]
+        ev.start(name)
+        step(f"⏳ {no} {label}中...")
+
+    def on_done(name, output, elapsed):
+        no, label = STEP_LABELS[name]
+        ev.done(name, output, elapsed)
+        step(f"✅ {no} {label}完成" + ("（缓存）" if status.get(name) == "cache" else f"（{elapsed:.1f}s）"))
+
+    results, timings = run_stage_graph(graph, max_workers=2, on_start=on_start, on_done=on_done)
     step("🎉 分析完成！")
 
     return {
-        "cleaned":      cleaned,
-        "requirements": requirements,
-        "prototype":    prototype,
-        "questions":    questions
+        "cleaned":      results["cleaned"],
+        "requirements": results["requirements"],
+        "prototype":    results["prototype"],
+        "questions":    results["questions"],
+        "meta":         {"steps": status, "timings": timings},
     }
 
 # ══════════════════════════════════════════════════════
@@ -435,6 +493,55 @@ def render_results(result: Dict):
         st.json(result)
 
 
+STREAM_PREVIEW_CHARS = 1200     # 步骤生成中只预览末尾若干字符
+
+
+def run_streaming(target, base: Dict = None):
+    """
+    在工作线程中执行 target(events)，逐步骤刷新页面：步骤开始即显示模型输出，完成即显示解析结果，
+    并立即写入 st.session_state["result"]（base 为起点，部分重跑时保留未重跑的步骤）。
+    成功返回 target 的返回值；失败返回 None，已完成步骤的结果保留在 session_state 中继续展示。
+    """
+    log_box  = st.empty()
+    progress = st.progress(0)
+    slots    = {name: st.empty() for name in STEP_LABELS}
+    log_msgs = []
+    partial  = dict(base or {})
+    run      = StreamRun(target)
+    for batch in run.batches():
+        for e in batch:
+            if e.kind == "log":
+                log_msgs.append(e.data)
+                continue
+            no, label = STEP_LABELS[e.name]
+            if e.kind == "start":
+                slots[e.name].info(f"⏳ {no} {label}中...")
+            elif e.kind == "delta":
+                with slots[e.name].container():
+                    st.caption(f"⏳ {no} {label} · 生成中（已输出 {len(e.data)} 字）")
+                    st.code(e.data[-STREAM_PREVIEW_CHARS:], language="json")
+            elif e.kind == "done":
+                partial[e.name] = e.data[0]
+                st.session_state["result"] = dict(partial)
+                with slots[e.name].expander(f"✅ {no} {label}", expanded=False):
+                    st.json(e.data[0])
+                progress.progress(int(100 * len(run.outputs) / len(STEP_LABELS)))
+        log_box.info("\n\n".join(log_msgs))
+
+    if run.error is not None:
+        st.error(f"❌ 分析出错：{run.error}")
+        if run.outputs:
+            done = "、".join(STEP_LABELS[n][1] for n in run.outputs)
+            st.warning(f"已完成步骤的结果已保留：{done}")
+        return None
+    for slot in slots.values():
+        slot.empty()
+    progress.progress(100)
+    log_box.success("🎉 分析完成！")
+    st.session_state["result"] = run.result
+    return run.result
+
+
 def main():
     st.set_page_config(
         page_title="AI 需求原型引擎",
@@ -455,6 +562,10 @@ def main():
             help="也可通过环境变量 DASHSCOPE_API_KEY 设置"
         )
         st.session_state["api_key"] = api_key_input
+        # 只作用于本会话：随 use_cache 传入流水线，不修改进程内共享的缓存实例
+        use_cache = not st.checkbox("跳过 LLM 缓存（强制重新生成）", value=False, key="bypass_cache")
+        stats = get_llm_cache().stats()
+        st.caption(f"LLM 缓存：{stats['entries']} 条 · 本进程命中 {stats['hits']} / 未命中 {stats['misses']}")
         st.markdown("---")
         st.markdown("**使用提示**")
         st.markdown("""
@@ -491,34 +602,29 @@ def main():
             st.error("请先在侧边栏填写 DashScope API Key")
             st.stop()
 
-        log_box     = st.empty()
-        progress    = st.progress(0)
-        log_msgs    = []
-        prog_steps  = {"1/4": 25, "2/4": 50, "3/4": 75, "4/4": 95}
-
-        def progress_cb(msg):
-            log_msgs.append(msg)
-            log_box.info("\n\n".join(log_msgs))
-            for key, pct in prog_steps.items():
-                if key in msg and msg.startswith("✅"):
-                    progress.progress(pct)
-
-        with st.spinner("AI 分析中..."):
-            try:
-                result = run_pipeline(raw_text.strip(), progress_cb=progress_cb)
-                progress.progress(100)
-                log_box.success("🎉 分析完成！")
-                st.session_state["result"]    = result
-                st.session_state["raw_input"] = raw_text
-            except Exception as e:
-                st.error(f"❌ 分析出错：{e}")
-                st.stop()
+        # 流水线在工作线程中执行（线程内不能读取 session_state，api_key 在此取出）
+        api_key = st.session_state["api_key"]
+        st.session_state.pop("result", None)
+        st.session_state["raw_input"] = raw_text
+        run_streaming(lambda events: run_pipeline(raw_text.strip(), api_key=api_key, use_cache=use_cache,
+                                                  events=events))
 
     # ── 结果展示 ──
     if "result" in st.session_state:
         st.divider()
         st.subheader("📊 分析结果")
 
+        # 部分重跑：只重新生成一个下游步骤，语义整理和需求提取取自步骤缓存
+        rerun_cols = st.columns(len(RERUNNABLE_STEPS))
+        for col, name in zip(rerun_cols, RERUNNABLE_STEPS):
+            if col.button(f"🔄 重新{STEP_LABELS[name][1]}", key=f"rerun_{name}"):
+                raw_input = st.session_state.get("raw_input", "").strip()
+                api_key   = st.session_state.get("api_key") or DASHSCOPE_API_KEY
+                if run_streaming(lambda events: run_pipeline(raw_input, rerun={name}, api_key=api_key,
+                                                             use_cache=use_cache, events=events),
+                                 base=st.session_state["result"]) is not None:
+                    st.rerun()
+
         # 下载按钮
         html_report = generate_html_report(
             st.session_state["result"],
@@ -0,0 +1,243 @@
+"""
+AI 需求原型引擎 —— 无界面批量运行
+=================================
+把一个目录下的客户沟通纪要（.txt / .md，含子目录）逐份跑完四个步骤，
+每份输出一个 HTML 报告（与界面下载的相同），并在输出目录写 index.json 汇总索引。
+
+  - 多份文件并发处理（--workers），LLM 请求受全局限速（--rate-limit，每分钟请求数）与客户端并发上限约束
+  - 断点续跑：每完成一份即写回 index.json；再次运行同一命令时，已完成且内容未变的文件直接跳过，
+    失败的文件重跑（已完成的步骤取步骤缓存），部分步骤出错的文件只重新生成出错的步骤
+
+用法：
+    python zzx_batch.py 会议纪要/ -o 原型报告/ --workers 4 --rate-limit 60
+    python zzx_batch.py 会议纪要/ -o 原型报告/ --force       # 忽略索引，全部重跑
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
+from stage_graph import input_hash
+from zzx_ai_prototype_llm_engine import (run_pipeline, generate_html_report, get_step_cache,
+                                         DASHSCOPE_API_KEY, MODEL, STEP_LABELS)
+
+INPUT_SUFFIXES  = (".txt", ".md")
+INDEX_NAME      = "index.json"
+DEFAULT_WORKERS = 4
+
+
+def find_inputs(src: Path) -> list:
+    """目录下全部纪要文件（相对路径，排序后处理顺序稳定）"""
+    return sorted(p.relative_to(src) for p in src.rglob("*")
+                  if p.is_file() and p.suffix.lower() in INPUT_SUFFIXES)
+
+
+def report_paths(inputs: list) -> dict:
+    """相对路径 -> 报告相对路径：沿用目录结构，同名不同后缀（a.txt / a.md）时追加后缀区分"""
+    out, used = {}, set()
+    for rel in inputs:
+        html = rel.with_suffix(".html")
+        if html in used:
+            html = rel.with_name(f"{rel.stem}_{rel.suffix.lstrip('.')}.html")
+        used.add(html)
+        out[rel] = html
+    return out
+
+
+def step_errors(result: dict) -> list:
+    """输出带 error 的步骤（LLM 调用或 JSON 解析失败）"""
+    return [name for name in STEP_LABELS
+            if isinstance(result.get(name), dict) and "error" in result[name]]
+
+
+def result_summary(result: dict) -> dict:
+    prototype = result.get("prototype") if isinstance(result.get("prototype"), dict) else {}
+    listed    = lambda v: len(v) if isinstance(v, list) else 0
+    return {
+        "requirements": len(result["requirements"]) if isinstance(result.get("requirements"), dict) else 0,
+        "pages":        listed(prototype.get("pages")),
+        "flows":        listed(prototype.get("flows")),
+        "questions":    listed(result.get("questions")),
+    }
+
+
+class BatchIndex:
+    """输出目录下的 index.json：{相对路径: 条目}；每次更新后整体原子写回，中断后可续跑"""
+
+    def __init__(self, out_dir: Path, source: Path):
+        self.path   = out_dir / INDEX_NAME
+        self.source = source
+        self.lock   = threading.Lock()
+        self.items  = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self.items = {it["source"]: it for it in data.get("items", [])}
+            except (ValueError, KeyError):
+                print(f"[Batch] 索引文件无法解析，将重新生成：{self.path}")
+
+    def get(self, key: str) -> dict:
+        with self.lock:
+            return self.items.get(key)
+
+    def update(self, entry: dict):
+        with self.lock:
+            self.items[entry["source"]] = entry
+            self._save()
+
+    def counts(self) -> dict:
+        with self.lock:
+            return self._counts()
+
+    def _counts(self) -> dict:
+        counts = {"done": 0, "partial": 0, "failed": 0, "skipped": 0}
+        for it in self.items.values():
+            counts[it["status"]] += 1
+        return counts
+
+    def _save(self):
+        data = {
+            "source":     str(self.source.resolve()),
+            "model":      MODEL,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "counts":     self._counts(),
+            "items":      [self.items[k] for k in sorted(self.items)],
+        }
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def plan(text: str, prev: dict, out_dir: Path, force: bool):
+    """
+    续跑判断，返回需重新生成的步骤：None 表示跳过，空集表示正常运行（已完成的步骤取缓存）。
+    内容未变且上次已完成、报告仍在 → 跳过；上次部分步骤出错 → 只重跑这些步骤。
+    """
+    if force or not prev or prev.get("input_hash") != input_hash(text):
+        return set()
+    if prev["status"] == "skipped" or (prev["status"] == "done" and (out_dir / prev["html"]).exists()):
+        return None
+    if prev["status"] == "partial":
+        return set(prev.get("failed_steps") or ())
+    return set()
+
+
+def process_one(src: Path, rel: Path, html_rel: Path, out_dir: Path, index: BatchIndex,
+                api_key: str, use_cache: bool, force: bool):
+    """处理一份纪要并写回索引；返回条目（跳过时返回 None）"""
+    text  = (src / rel).read_text(encoding="utf-8", errors="ignore").strip()
+    key   = rel.as_posix()
+    entry = {"source": key, "input_hash": input_hash(text), "html": html_rel.as_posix(),
+             "chars": len(text)}
+    rerun = plan(text, index.get(key), out_dir, force)
+    if rerun is None:
+        return None
+    if not text:
+        entry.update(status="skipped", error="空文件",
+                     finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        index.update(entry)
+        return entry
+
+    t0 = time.perf_counter()
+    try:
+        result = run_pipeline(text, rerun=rerun, api_key=api_key, use_cache=use_cache)
+        html_path = out_dir / html_rel
+        html_path.parent.mkdir(parents=True, exist_ok=True)
+        html_path.write_text(generate_html_report(result, text), encoding="utf-8")
+        failed = step_errors(result)
+        entry.update(status="partial" if failed else "done", failed_steps=failed,
+                     steps=result["meta"]["steps"], summary=result_summary(result))
+    except Exception as e:
+        entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    entry["elapsed"]     = round(time.perf_counter() - t0, 2)
+    entry["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    index.update(entry)
+    return entry
+
+
+def run_batch(src: Path, out_dir: Path, workers: int = DEFAULT_WORKERS, api_key: str = None,
+              use_cache: bool = True, force: bool = False) -> dict:
+    """处理目录下全部纪要，返回各状态计数"""
+    inputs = find_inputs(src)
+    if not inputs:
+        print(f"[Batch] {src} 下没有 {' / '.join(INPUT_SUFFIXES)} 文件")
+        return {}
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index   = BatchIndex(out_dir, src)
+    reports = report_paths(inputs)
+    api_key = api_key or DASHSCOPE_API_KEY
+    get_step_cache()            # 在主线程中打开步骤缓存，工作线程共用
+    print(f"[Batch] 共 {len(inputs)} 份纪要，{workers} 个并发任务，输出到 {out_dir.resolve()}")
+
+    t0, n, skipped = time.perf_counter(), 0, 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(process_one, src, rel, reports[rel], out_dir, index, api_key, use_cache, force): rel
+                   for rel in inputs}
+        for future in as_completed(futures):
+            n += 1
+            entry = future.result()
+            if entry is None:
+                skipped += 1
+                continue
+            if entry["status"] in ("done", "partial"):
+                s = entry["summary"]
+                info = (f"原型 {s['pages']} 页 / 流程 {s['flows']} 步 / 问题 {s['questions']} 个"
+                        + (f"，出错步骤 {entry['failed_steps']}" if entry["failed_steps"] else ""))
+            else:
+                info = entry.get("error", "")
+            print(f"[Batch] {n}/{len(inputs)} {entry['status']:<7} {entry['source']}"
+                  f"（{entry.get('elapsed', 0):.1f}s）{info}")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("\n[Batch] 已中断：进行中的文件完成后写入索引，重新运行同一命令即可续跑")
+        raise
+    pool.shutdown()
+
+    counts = index.counts()
+    print(f"[Batch] 结束：本次跳过 {skipped} 份（此前已完成），用时 {time.perf_counter() - t0:.0f}s；"
+          f"索引共 完成 {counts['done']} / 部分出错 {counts['partial']} / 失败 {counts['failed']}"
+          f" / 空文件 {counts['skipped']}  → {index.path.resolve()}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI 需求原型引擎 · 批量处理客户沟通纪要")
+    parser.add_argument("source", help="纪要目录（.txt / .md，含子目录）")
+    parser.add_argument("-o", "--out", default="prototype_reports", help="输出目录（默认 prototype_reports）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"并发处理的文件数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument("--rate-limit", type=float, default=0, help="LLM 全局限速，每分钟请求数（0 不限）")
+    parser.add_argument("--api-key", default=None, help="DashScope API Key（默认取环境变量 DASHSCOPE_API_KEY）")
+    parser.add_argument("--no-cache", action="store_true", help="跳过 LLM 响应缓存与步骤缓存，全部重新调用模型")
+    parser.add_argument("--force", action="store_true", help="忽略索引中的完成记录，全部重新处理")
+    args = parser.parse_args(argv)
+
+    src = Path(args.source)
+    if not src.is_dir():
+        parser.error(f"目录不存在：{args.source}")
+    if args.workers < 1:
+        parser.error("--workers 至少为 1")
+    if args.no_cache:
+        get_llm_cache().bypass = True
+    if args.rate_limit:
+        get_llm_client().limiter.set_rate(args.rate_limit)
+
+    try:
+        counts = run_batch(src, Path(args.out), args.workers, args.api_key,
+                           use_cache=not args.no_cache, force=args.force)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(1 if counts.get("failed") else 0)
+
+
+if __name__ == "__main__":
+    main()